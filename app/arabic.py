@@ -0,0 +1,129 @@
+"""
+Arabic-aware text normalisation.
+Folds the spelling variants that make otherwise identical Arabic text compare
+unequal: tashkeel (diacritics), tatweel, alef/yaa/taa-marbuta variants and
+Arabic-Indic digits. Latin text is case-folded.
+
+`normalize_with_offsets` builds a normalised "shadow" of a document together
+with a map back to the original, so matches found in the shadow can be mapped
+to exact spans of the original text.
+"""
+
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+# Harakat, Quranic annotation marks and superscript alef
+_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+TATWEEL = "\u0640"
+
+_LETTERS = str.maketrans({
+    "\u0622": "\u0627",  # alef with madda -> alef
+    "\u0623": "\u0627",  # alef with hamza above -> alef
+    "\u0625": "\u0627",  # alef with hamza below -> alef
+    "\u0671": "\u0627",  # alef wasla -> alef
+    "\u0649": "\u064A",  # alef maksura -> yaa
+    "\u0629": "\u0647",  # taa marbuta -> haa
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + d): str(d) for d in range(10)},  # Extended (Persian) digits
+})
+
+
+def normalize_arabic(text: str) -> str:
+    """
+    Normalise text for matching (not for display).
+
+    Args:
+        text: Any text
+
+    Returns:
+        Text without diacritics or tatweel, with letter variants folded and
+        Latin case-folded
+    """
+    text = _DIACRITICS.sub("", text).replace(TATWEEL, "")
+    return text.translate(_LETTERS).casefold()
+
+
+def _fold_char(ch: str) -> str:
+    if ch == TATWEEL or _DIACRITICS.match(ch):
+        return ""
+    return ch.translate(_LETTERS).casefold()
+
+
+@lru_cache(maxsize=8)
+def normalize_with_offsets(text: str) -> Tuple[str, Tuple[int, ...]]:
+    """
+    Normalise like `normalize_arabic` and collapse whitespace runs to one space,
+    keeping a map back to the original.
+
+    Results are cached per text, so repeated lookups on the same document
+    reuse the shadow.
+
+    Args:
+        text: Original text
+
+    Returns:
+        (shadow, offsets): `offsets[i]` is the index in `text` of the character
+        that produced `shadow[i]`; a final entry equal to `len(text)` maps the
+        end of the shadow
+    """
+    chars = []
+    offsets = []
+    folded = {}  # char -> normalised form, memoised per call
+    previous_space = False
+
+    for index, ch in enumerate(text):
+        if ch.isspace():
+            if not previous_space:
+                chars.append(" ")
+                offsets.append(index)
+            previous_space = True
+            continue
+        previous_space = False
+
+        out = folded.get(ch)
+        if out is None:
+            out = folded[ch] = _fold_char(ch)
+        for c in out:
+            chars.append(c)
+            offsets.append(index)
+
+    offsets.append(len(text))
+    return "".join(chars), tuple(offsets)
+
+
+def normalize_query(text: str) -> str:
+    """Normalise a search/highlight query exactly like a document shadow."""
+    # Bypasses the cache so short queries do not evict document shadows
+    return normalize_with_offsets.__wrapped__(text)[0].strip()
+
+
+def to_original(offsets: Tuple[int, ...], start: int, end: int) -> Tuple[int, int]:
+    """
+    Map a `[start, end)` span of a shadow back to the original text.
+
+    Diacritics and tatweel that follow the last matched letter are included.
+    """
+    original_start = offsets[start]
+    original_end = max(offsets[end], offsets[end - 1] + 1) if end > start else original_start
+    return original_start, original_end
+
+
+def find_all(text: str, query: str) -> List[Tuple[int, int]]:
+    """
+    Find every occurrence of `query` in `text`, ignoring diacritics, letter
+    variants, case and whitespace differences.
+
+    Returns:
+        Non-overlapping `(start, end)` spans of the original text
+    """
+    needle = normalize_query(query)
+    if not needle:
+        return []
+    shadow, offsets = normalize_with_offsets(text)
+    spans = []
+    position = shadow.find(needle)
+    while position != -1:
+        spans.append(to_original(offsets, position, position + len(needle)))
+        position = shadow.find(needle, position + len(needle))
+    return spans
@@ -0,0 +1,180 @@
+"""
+Token estimation and budget planning for consolidation input.
+Measures each extracted file before any LLM call, projects input/output tokens
+and cost, and trims the combined text to fit the model's context window.
+"""
+
+import os
+import re
+from typing import Dict, List, Tuple
+
+# gemini-2.5-flash limits
+MODEL_INPUT_LIMIT = int(os.getenv("BOOKGEN_INPUT_TOKEN_LIMIT", "1048576"))
+MODEL_OUTPUT_LIMIT = 65536  # matches consolidator.generation_config["max_output_tokens"]
+
+# Tokens kept free for the system instruction and request overhead
+RESERVED_TOKENS = 4096
+
+# USD per 1M tokens (override to match your billing tier)
+PRICE_PER_M_INPUT = float(os.getenv("BOOKGEN_PRICE_PER_M_INPUT", "0.30"))
+PRICE_PER_M_OUTPUT = float(os.getenv("BOOKGEN_PRICE_PER_M_OUTPUT", "2.50"))
+
+# The consolidated book is a condensation of its sources
+OUTPUT_RATIO = 0.5
+
+# Approximate characters per token. Arabic script tokenizes much denser than Latin.
+CHARS_PER_TOKEN_LATIN = 4.0
+CHARS_PER_TOKEN_OTHER = 2.5
+
+_FILE_BLOCK = re.compile(
+    r"\n\n--- START OF FILE: (?P<name>.+?) ---\n\n(?P<content>.*?)\n\n--- END OF FILE: (?P=name) ---\n\n",
+    re.DOTALL
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap offline token estimate (no API call).
+
+    Args:
+        text: Any text
+
+    Returns:
+        Estimated token count
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / CHARS_PER_TOKEN_LATIN + other_chars / CHARS_PER_TOKEN_OTHER) + 1
+
+
+def split_combined_text(combined_text: str) -> List[Tuple[str, str]]:
+    """
+    Split text built by `consolidator.build_combined_text` back into files.
+
+    Returns:
+        List of (file name, content) tuples in their original order
+    """
+    return [(m.group("name"), m.group("content")) for m in _FILE_BLOCK.finditer(combined_text)]
+
+
+def wrap_file(name: str, content: str) -> str:
+    """Wrap one file's content in the START/END OF FILE markers."""
+    return (
+        f"\n\n--- START OF FILE: {name} ---\n\n"
+        f"{content}"
+        f"\n\n--- END OF FILE: {name} ---\n\n"
+    )
+
+
+def combine_sources(sources: List[Tuple[str, str]]) -> str:
+    """Combined text (as built by `consolidator.build_combined_text`) from (name, content) tuples."""
+    return "".join(wrap_file(name, content) for name, content in sources)
+
+
+def _truncate_to_tokens(content: str, max_tokens: int) -> str:
+    """Keep whole paragraphs from the start of `content` up to `max_tokens`."""
+    kept = []
+    used = 0
+    for paragraph in content.split("\n\n"):
+        cost = estimate_tokens(paragraph) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(paragraph)
+        used += cost
+    return "\n\n".join(kept)
+
+
+def plan_consolidation(combined_text: str, input_limit: int = MODEL_INPUT_LIMIT) -> Dict:
+    """
+    Measure the consolidation input and fit it to the model window.
+
+    Files are admitted smallest first so as many sources as possible are kept
+    whole; the first file that does not fit is truncated at a paragraph
+    boundary and any remaining files are dropped. Admitted files keep their
+    original order in the fitted text.
+
+    Args:
+        combined_text: Text with START/END OF FILE markers
+        input_limit: Model input window in tokens
+
+    Returns:
+        Dictionary with per-file estimates, projected tokens and cost, and
+        `text` (the combined text to send, unchanged when everything fits)
+    """
+    files = split_combined_text(combined_text)
+    budget = input_limit - RESERVED_TOKENS
+
+    entries = []
+    for index, (name, content) in enumerate(files):
+        entries.append({
+            "index": index,
+            "name": name,
+            "tokens": estimate_tokens(wrap_file(name, content)),
+            "status": "included"
+        })
+
+    total_tokens = sum(e["tokens"] for e in entries)
+    fits = total_tokens <= budget
+
+    fitted_contents = {i: content for i, (_, content) in enumerate(files)}
+    if not fits:
+        used = 0
+        overflowed = False
+        for entry in sorted(entries, key=lambda e: e["tokens"]):
+            if not overflowed and used + entry["tokens"] <= budget:
+                used += entry["tokens"]
+                continue
+            truncated = ""
+            if not overflowed:
+                overflowed = True
+                remaining = budget - used - estimate_tokens(wrap_file(entry["name"], ""))
+                if remaining > 0:
+                    truncated = _truncate_to_tokens(files[entry["index"]][1], remaining)
+            if truncated:
+                fitted_contents[entry["index"]] = truncated
+                entry["status"] = "truncated"
+                entry["kept_tokens"] = estimate_tokens(wrap_file(entry["name"], truncated))
+                used += entry["kept_tokens"]
+            else:
+                del fitted_contents[entry["index"]]
+                entry["status"] = "dropped"
+
+    if fits:
+        text = combined_text
+    else:
+        text = "".join(wrap_file(files[i][0], fitted_contents[i]) for i in sorted(fitted_contents))
+
+    input_tokens = estimate_tokens(text) + RESERVED_TOKENS
+    output_tokens = min(MODEL_OUTPUT_LIMIT, int(input_tokens * OUTPUT_RATIO))
+
+    return {
+        "files": entries,
+        "total_source_tokens": total_tokens,
+        "input_tokens": input_tokens,
+        "projected_output_tokens": output_tokens,
+        "max_output_tokens": MODEL_OUTPUT_LIMIT,
+        "input_limit": input_limit,
+        "fits": fits,
+        "estimated_cost_usd": round(
+            input_tokens / 1e6 * PRICE_PER_M_INPUT + output_tokens / 1e6 * PRICE_PER_M_OUTPUT, 4
+        ),
+        "max_cost_usd": round(
+            input_tokens / 1e6 * PRICE_PER_M_INPUT + MODEL_OUTPUT_LIMIT / 1e6 * PRICE_PER_M_OUTPUT, 4
+        ),
+        "text": text
+    }
+
+
+def summarize_plan(plan: Dict) -> str:
+    """One-line human readable summary of a plan."""
+    summary = (
+        f"~{plan['input_tokens']:,} input / ~{plan['projected_output_tokens']:,} output tokens, "
+        f"est. ${plan['estimated_cost_usd']:.4f}"
+    )
+    if not plan["fits"]:
+        truncated = sum(1 for f in plan["files"] if f["status"] == "truncated")
+        dropped = sum(1 for f in plan["files"] if f["status"] == "dropped")
+        summary += f" (over the {plan['input_limit']:,} token window: {truncated} truncated, {dropped} dropped)"
+    return summary
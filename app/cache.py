@@ -0,0 +1,87 @@
+"""
+Validated file read cache.
+Text and JSON reads of small, frequently re-read files (base context,
+highlights, chat sessions) are memoised process-wide, so they are shared by
+every Streamlit session and API request. An entry is reused only while the
+file's size, mtime and inode are unchanged, so a rerun that finds nothing
+changed costs one `stat` per file and no reads. Writers in this package also
+call `invalidate` explicitly.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Tuple
+
+from app import storage
+
+MAX_ENTRIES = 512
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # (resolved path, kind) -> (signature, value)
+
+
+def _signature(path: Path) -> Tuple[int, int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def _cached(path: Path, kind: str, load: Callable[[Path], Any]) -> Any:
+    path = Path(path)
+    key = (str(path.resolve()), kind)
+    try:
+        signature = _signature(path)
+    except FileNotFoundError:
+        invalidate(path)
+        raise
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[0] == signature:
+            _entries.move_to_end(key)
+            return entry[1]
+
+    value = load(path)
+    with _lock:
+        _entries[key] = (signature, value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return value
+
+
+def read_text(path: Path) -> str:
+    """
+    Contents of a UTF-8 text file (decompressed if stored compressed), from the
+    cache when unchanged.
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    return _cached(path, "text", storage.read_text)
+
+
+def read_json(path: Path, copy_result: bool = True) -> Any:
+    """
+    Parsed JSON file, from the cache when unchanged.
+
+    Args:
+        path: JSON file
+        copy_result: Return a deep copy (the default) so callers may mutate it;
+            pass False for read-only use
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        ValueError: If the file is not valid JSON
+    """
+    value = _cached(path, "json", storage.read_json)
+    return copy.deepcopy(value) if copy_result else value
+
+
+def invalidate(path: Path) -> None:
+    """Drop the cached reads of a file (call after writing it)."""
+    resolved = str(Path(path).resolve())
+    with _lock:
+        for key in [key for key in _entries if key[0] == resolved]:
+            del _entries[key]
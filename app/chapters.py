@@ -0,0 +1,125 @@
+"""
+Per-chapter consolidation.
+A quick outline pass plans the chapters from a digest of the sources, then
+every chapter is generated concurrently against its own sources, so the
+latency is roughly that of the slowest chapter instead of the whole book.
+Assembly in outline order is done by the caller (see app.jobs).
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Tuple
+
+from app import budget
+from app import metrics
+from app.consolidator import generate_chapter, generate_outline
+from app.sections import relevant_excerpts, strip_wrapping_fence
+
+CHAPTER_WORKERS = int(os.getenv("BOOKGEN_CHAPTER_WORKERS", "4"))
+
+# Sources sent with one chapter; larger source sets are reduced to relevant excerpts
+CHAPTER_SOURCE_TOKENS = int(os.getenv("BOOKGEN_CHAPTER_SOURCE_TOKENS", "200000"))
+
+# Outline digest: headings plus the opening of each file
+DIGEST_CHARS_PER_FILE = 3000
+DIGEST_MAX_HEADINGS = 200
+
+# A chapter call is retried once before the job fails
+CHAPTER_ATTEMPTS = 2
+
+
+def source_digest(sources: List[Tuple[str, str]]) -> str:
+    """Headings and opening of every source file: enough to plan chapters cheaply."""
+    parts = []
+    for name, content in sources:
+        headings = [line for line in content.splitlines() if line.startswith("#")][:DIGEST_MAX_HEADINGS]
+        parts.append((name, "\n".join(headings) + "\n\n" + content[:DIGEST_CHARS_PER_FILE]))
+    return budget.combine_sources(parts)
+
+
+def plan_outline(sources: List[Tuple[str, str]]) -> Dict:
+    """
+    Run the outline pass and validate its result.
+
+    Args:
+        sources: (file name, content) tuples to consolidate
+
+    Returns:
+        {"title", "chapters"}; each chapter's `sources` only lists known files
+
+    Raises:
+        ValueError: If the model returned no chapters
+    """
+    with metrics.span("outline"):
+        outline = generate_outline(source_digest(sources))
+
+    known = {name for name, _ in sources}
+    chapters = []
+    for chapter in outline.get("chapters") or []:
+        if not isinstance(chapter, dict) or not str(chapter.get("title", "")).strip():
+            continue
+        chapters.append({
+            "title": str(chapter["title"]).strip(),
+            "summary": str(chapter.get("summary", "")).strip(),
+            "sources": [s for s in chapter.get("sources") or [] if s in known]
+        })
+    if not chapters:
+        raise ValueError("The outline pass returned no chapters.")
+
+    return {"title": str(outline.get("title") or "Base Context").strip(), "chapters": chapters}
+
+
+def chapter_sources(chapter: Dict, sources: List[Tuple[str, str]]) -> str:
+    """
+    Source text for one chapter.
+
+    Uses the files the outline assigned to the chapter (all files if none),
+    whole when they fit CHAPTER_SOURCE_TOKENS and as relevant excerpts otherwise.
+    """
+    files = [(name, content) for name, content in sources if name in chapter["sources"]] or sources
+    combined_text = budget.combine_sources(files)
+    if budget.estimate_tokens(combined_text) <= CHAPTER_SOURCE_TOKENS:
+        return combined_text
+    excerpts, _ = relevant_excerpts(chapter["title"], chapter["summary"], files, CHAPTER_SOURCE_TOKENS)
+    return excerpts
+
+
+def _normalize_chapter(title: str, markdown: str) -> str:
+    """Strip a wrapping code fence and make sure the chapter starts with its H2 heading."""
+    markdown = strip_wrapping_fence(markdown)
+    if not markdown.startswith("## "):
+        markdown = f"## {title}\n\n{markdown}"
+    return markdown
+
+
+def _write_chapter(book_title: str, outline_text: str, chapter: Dict, sources: List[Tuple[str, str]]) -> str:
+    source_text = chapter_sources(chapter, sources)
+    for attempt in range(1, CHAPTER_ATTEMPTS + 1):
+        try:
+            with metrics.span("chapter"):
+                markdown = generate_chapter(book_title, outline_text, chapter, source_text)
+            return _normalize_chapter(chapter["title"], markdown)
+        except Exception:
+            if attempt == CHAPTER_ATTEMPTS:
+                raise
+
+
+def iter_chapters(outline: Dict, sources: List[Tuple[str, str]]) -> Iterator[Tuple[int, str]]:
+    """
+    Generate all chapters concurrently.
+
+    Yields:
+        (chapter index, chapter markdown) in completion order. Closing the
+        generator cancels chapters that have not started yet.
+    """
+    outline_text = "\n".join(f"## {chapter['title']}" for chapter in outline["chapters"])
+    executor = ThreadPoolExecutor(max_workers=CHAPTER_WORKERS, thread_name_prefix="chapter")
+    futures = {
+        executor.submit(_write_chapter, outline["title"], outline_text, chapter, sources): index
+        for index, chapter in enumerate(outline["chapters"])
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
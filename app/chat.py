@@ -2,6 +2,9 @@ import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 
+from app import metrics
+from app import provenance
+
 load_dotenv()
 
 def get_api_key():
@@ -89,10 +92,11 @@ def chat_with_data(user_query: str, context_content: str, history: list = None,
         # Pass `context_content` inside `system_instruction` to save tokens in history 
         # and keep it authoritative.
         
+        # Section IDs on the headings let the model cite where an answer comes from
         full_system_instruction = f"""{DEVELOPER_INSTRUCTION}
-        
+        {provenance.CITATION_INSTRUCTION}
         --- BASE CONTEXT ---
-        {context_content}
+        {provenance.annotate_context(context_content)}
         --- END BASE CONTEXT ---
         """
         
@@ -103,7 +107,9 @@ def chat_with_data(user_query: str, context_content: str, history: list = None,
         )
         
         chat_session = model.start_chat(history=gemini_history)
-        response = chat_session.send_message(user_query)
+        with metrics.span("llm_call"):
+            response = chat_session.send_message(user_query)
+        metrics.record_llm_usage("chat", response)
         
         return response.text
         
@@ -1,8 +1,14 @@
 import google.generativeai as genai
+import json
 import os
 from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
 from dotenv import load_dotenv
 
+from app import budget
+from app import metrics
+from app import storage
+
 load_dotenv()
 
 def get_api_key():
@@ -103,7 +109,41 @@ You will receive the raw text content of multiple input files.
 Return ONLY the structured Markdown content.
 """
 
-def generate_summary(combined_text: str) -> str:
+def build_combined_text(md_files: list) -> str:
+    """
+    Concatenate extracted markdown files, wrapping each in START/END OF FILE markers.
+
+    Args:
+        md_files: Paths of the extracted `.md` files, in the order to send them
+
+    Returns:
+        The combined text passed to `generate_summary`
+    """
+    return budget.combine_sources(read_sources(md_files))
+
+def read_sources(md_files: list) -> List[Tuple[str, str]]:
+    """
+    Read extracted markdown files (compressed or not).
+
+    Returns:
+        List of (file name, content) tuples in the given order
+    """
+    sources = []
+    with metrics.span("source_read"):
+        for md_file in md_files:
+            sources.append((md_file.name, storage.read_text(md_file)))
+    return sources
+
+def stream_summary(combined_text: str) -> Iterator[str]:
+    """
+    Stream the consolidated book from Gemini.
+
+    Args:
+        combined_text: Text built by `build_combined_text`
+
+    Yields:
+        Markdown chunks in the order they arrive
+    """
     # Ensure API key is configured
     if not get_api_key():
          raise ValueError("GEMINI_API_KEY is missing. Please set it in .env or Streamlit Secrets.")
@@ -116,11 +156,177 @@ def generate_summary(combined_text: str) -> str:
             system_instruction=system_instruction
         )
         
-        # We might need to handle token limits if the input is massive.
-        # For this version, we assume it fits (Gemini 1.5 Flash has ~1M context).
+        # Token limits are handled before this call: app.budget.plan_consolidation
+        # measures the input and trims it to the model window.
         chat_session = model.start_chat(history=[])
-        response = chat_session.send_message(combined_text)
-        return response.text
+        with metrics.span("llm_call"):
+            response = chat_session.send_message(combined_text, stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final finish-reason chunk)
+                    continue
+                if text:
+                    yield text
+        metrics.record_llm_usage("consolidate", response)
     except Exception as e:
         print(f"Error generating summary: {e}")
         raise e
+
+def generate_summary(combined_text: str) -> str:
+    """Non-streaming wrapper around `stream_summary`. Returns the whole book."""
+    return "".join(stream_summary(combined_text))
+
+OUTLINE_PROMPT = """
+Plan the chapters of the Base Context for the sources summarised below (the headings
+and opening of each file). Do not write the chapters themselves.
+
+Return JSON of the form:
+{"title": "<course title>", "chapters": [{"title": "<chapter title>", "summary": "<one or two sentences>", "sources": ["<file name>", ...]}]}
+
+Chapters are the H2-level Main Chapters or Modules, in teaching order. `sources` lists
+the file names each chapter draws on.
+
+**Sources:**
+"""
+
+CHAPTER_PROMPT = """
+Write ONE chapter of the Base Context. The other chapters are written separately, so do
+not write the course title or any other chapter.
+
+**Course title:** {title}
+
+**Book outline:**
+{outline}
+
+**Chapter to write:** {chapter_title}
+{summary}
+
+Start with `## {chapter_title}`, use H3/H4 for its sub-topics, apply all formatting
+instructions (including the Triad framework) and return ONLY the chapter markdown.
+
+**Source excerpts:**
+"""
+
+def generate_outline(source_digest: str) -> Dict:
+    """
+    Outline pass of per-chapter consolidation.
+
+    Args:
+        source_digest: Headings and opening of each source file, wrapped in START/END OF FILE markers
+
+    Returns:
+        Dictionary with the course `title` and `chapters` ({"title", "summary", "sources"})
+    """
+    if not get_api_key():
+         raise ValueError("GEMINI_API_KEY is missing. Please set it in .env or Streamlit Secrets.")
+
+    try:
+        model = genai.GenerativeModel(
+            model_name=MODEL_NAME,
+            generation_config={**generation_config, "max_output_tokens": 8192,
+                               "response_mime_type": "application/json"},
+            system_instruction=system_instruction
+        )
+        chat_session = model.start_chat(history=[])
+        with metrics.span("llm_call"):
+            response = chat_session.send_message(OUTLINE_PROMPT + source_digest)
+        metrics.record_llm_usage("outline", response)
+        return json.loads(response.text)
+    except Exception as e:
+        print(f"Error generating outline: {e}")
+        raise e
+
+def generate_chapter(book_title: str, outline: str, chapter: Dict, source_text: str) -> str:
+    """
+    Write one chapter of per-chapter consolidation.
+
+    Args:
+        book_title: Course title from the outline pass
+        outline: Chapter titles of the whole book, one per line
+        chapter: Outline entry ({"title", "summary", ...})
+        source_text: Sources for this chapter wrapped in START/END OF FILE markers
+
+    Returns:
+        The chapter markdown, starting with its H2 heading
+    """
+    if not get_api_key():
+         raise ValueError("GEMINI_API_KEY is missing. Please set it in .env or Streamlit Secrets.")
+
+    prompt = CHAPTER_PROMPT.format(
+        title=book_title,
+        outline=outline,
+        chapter_title=chapter["title"],
+        summary=chapter.get("summary", "")
+    )
+    try:
+        model = genai.GenerativeModel(
+            model_name=MODEL_NAME,
+            generation_config=generation_config,
+            system_instruction=system_instruction
+        )
+        chat_session = model.start_chat(history=[])
+        with metrics.span("llm_call"):
+            response = chat_session.send_message(prompt + source_text)
+        metrics.record_llm_usage("chapter", response)
+        return response.text
+    except Exception as e:
+        print(f"Error generating chapter '{chapter['title']}': {e}")
+        raise e
+
+SECTION_PROMPT = """
+Rewrite ONE section of an existing Base Context. Do not write any other part of the book.
+
+**Book outline (for placement only, do not reproduce it):**
+{outline}
+
+**Current version of the section:**
+{section}
+
+{instructions}
+Keep the heading text and level (`{heading_marks}`) unchanged, apply all formatting
+instructions, base the content on the source excerpts below, and return ONLY the
+rewritten section starting with its heading.
+
+**Source excerpts:**
+"""
+
+def generate_section(section_markdown: str, heading_level: int, outline: str,
+                     source_text: str, instructions: str = None) -> str:
+    """
+    Regenerate a single section of the base context.
+
+    Args:
+        section_markdown: Current markdown of the section (heading included)
+        heading_level: Level of the section heading (2 for H2, ...)
+        outline: Headings of the whole book, one per line
+        source_text: Relevant source excerpts wrapped in START/END OF FILE markers
+        instructions: Optional extra guidance from the user
+
+    Returns:
+        The rewritten section markdown
+    """
+    if not get_api_key():
+         raise ValueError("GEMINI_API_KEY is missing. Please set it in .env or Streamlit Secrets.")
+
+    prompt = SECTION_PROMPT.format(
+        outline=outline,
+        section=section_markdown,
+        instructions=f"**Reviewer instructions:** {instructions}\n" if instructions else "",
+        heading_marks="#" * heading_level
+    )
+    try:
+        model = genai.GenerativeModel(
+            model_name=MODEL_NAME,
+            generation_config=generation_config,
+            system_instruction=system_instruction
+        )
+        chat_session = model.start_chat(history=[])
+        with metrics.span("llm_call"):
+            response = chat_session.send_message(prompt + source_text)
+        metrics.record_llm_usage("regenerate_section", response)
+        return response.text
+    except Exception as e:
+        print(f"Error regenerating section: {e}")
+        raise e
@@ -0,0 +1,170 @@
+"""
+Source deduplication before consolidation.
+Uploads often hold the same material twice (a `.docx` and its `.pdf`, or two
+revisions), so repeated paragraphs are dropped before anything is sent to
+Gemini:
+
+- exact duplicates: hash of the normalised paragraph text
+- near duplicates: MinHash over word shingles with LSH banding, confirmed by
+  the estimated Jaccard similarity
+
+Matching runs on Arabic-normalised text (app.arabic). The first occurrence,
+in file order, is kept.
+"""
+
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app import budget
+from app import metrics
+from app.arabic import normalize_arabic
+
+DEDUP_ENABLED = os.getenv("BOOKGEN_DEDUP", "1") != "0"
+
+# Paragraphs shorter than this (normalised characters) are always kept: headings,
+# labels and short list items legitimately repeat across sources
+MIN_PARAGRAPH_CHARS = 40
+
+# Near-duplicate detection
+SHINGLE_SIZE = 3              # words per shingle
+MIN_NEAR_DUPLICATE_WORDS = 12 # shorter paragraphs are only checked for exact duplicates
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 32                # 32 bands x 4 rows: candidates from ~0.4 similarity
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_rows_per_band = NUM_PERMUTATIONS // LSH_BANDS
+_rng = np.random.default_rng(1234)
+# Multiply-shift hash family: ((a * x + b) mod 2^64) >> 32, with odd a
+_PERM_A = _rng.integers(1, 2 ** 63, size=NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2 ** 63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_WORD = re.compile(r"\w+")
+
+
+def _words(paragraph: str) -> List[str]:
+    return _WORD.findall(normalize_arabic(paragraph))
+
+
+def _signature(words: List[str]) -> np.ndarray:
+    """MinHash signature of the paragraph's word shingles."""
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+    with np.errstate(over="ignore"):
+        permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1)
+
+
+class _NearDuplicateIndex:
+    """LSH index of the MinHash signatures of kept paragraphs."""
+
+    def __init__(self):
+        self._buckets = {}     # (band, band bytes) -> [signature index]
+        self._signatures = []
+
+    def find(self, signature: np.ndarray) -> float:
+        """Best estimated Jaccard similarity to an indexed paragraph (0 if none)."""
+        best = 0.0
+        seen = set()
+        for band in range(LSH_BANDS):
+            key = (band, signature[band * _rows_per_band:(band + 1) * _rows_per_band].tobytes())
+            for index in self._buckets.get(key, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                best = max(best, float(np.mean(self._signatures[index] == signature)))
+        return best
+
+    def add(self, signature: np.ndarray) -> None:
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band in range(LSH_BANDS):
+            key = (band, signature[band * _rows_per_band:(band + 1) * _rows_per_band].tobytes())
+            self._buckets.setdefault(key, []).append(index)
+
+
+def deduplicate(sources: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Dict]:
+    """
+    Drop repeated paragraphs across (and within) source files.
+
+    Args:
+        sources: (file name, markdown) tuples in consolidation order
+
+    Returns:
+        (deduplicated sources, report). Files left without content are
+        omitted. The report has per-file counts of `exact_duplicates`,
+        `near_duplicates` and `tokens_saved`, plus totals.
+    """
+    seen_hashes = set()
+    index = _NearDuplicateIndex()
+    kept_sources = []
+    files = []
+
+    for name, content in sources:
+        kept = []
+        exact = near = saved = 0
+        for paragraph in content.split("\n\n"):
+            words = _words(paragraph)
+            normalized = " ".join(words)
+            if len(normalized) < MIN_PARAGRAPH_CHARS:
+                kept.append(paragraph)
+                continue
+
+            digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+            if digest in seen_hashes:
+                exact += 1
+                saved += budget.estimate_tokens(paragraph)
+                continue
+
+            if len(words) >= MIN_NEAR_DUPLICATE_WORDS:
+                signature = _signature(words)
+                if index.find(signature) >= NEAR_DUPLICATE_THRESHOLD:
+                    near += 1
+                    saved += budget.estimate_tokens(paragraph)
+                    continue
+                index.add(signature)
+
+            seen_hashes.add(digest)
+            kept.append(paragraph)
+
+        deduplicated = "\n\n".join(kept)
+        if deduplicated.strip():
+            kept_sources.append((name, deduplicated))
+        files.append({
+            "name": name,
+            "exact_duplicates": exact,
+            "near_duplicates": near,
+            "tokens_saved": saved,
+            "dropped": not deduplicated.strip()
+        })
+
+    report = {
+        "files": files,
+        "exact_duplicates": sum(f["exact_duplicates"] for f in files),
+        "near_duplicates": sum(f["near_duplicates"] for f in files),
+        "tokens_saved": sum(f["tokens_saved"] for f in files)
+    }
+    return kept_sources, report
+
+
+def prepare_sources(sources: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Optional[Dict]]:
+    """`deduplicate` unless disabled with BOOKGEN_DEDUP=0 (then the report is None)."""
+    if not DEDUP_ENABLED:
+        return sources, None
+    with metrics.span("dedup"):
+        return deduplicate(sources)
+
+
+def summarize_report(report: Dict) -> str:
+    """One-line human readable summary of a dedup report."""
+    return (
+        f"Removed {report['exact_duplicates']} exact and {report['near_duplicates']} near-duplicate "
+        f"paragraph(s), saving ~{report['tokens_saved']:,} tokens"
+    )
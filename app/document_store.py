@@ -0,0 +1,165 @@
+"""
+Structured document cache.
+Persists the DoclingDocument produced during extraction next to its markdown
+(`extracted_docs/<stem>.docling.json.gz`) so later projections — markdown,
+section outlines, page maps — are computed from the structured model instead
+of re-converting the source file.
+"""
+
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+CACHE_SUFFIX = ".docling.json.gz"
+
+# Parsed documents kept in memory (keyed by path + mtime)
+MAX_LOADED_DOCUMENTS = 8
+
+_lock = threading.Lock()
+_loaded = OrderedDict()  # (path, mtime_ns) -> DoclingDocument
+
+
+def cache_path(output_dir: Path, stem: str) -> Path:
+    """Path of the cached document for `<output_dir>/<stem>.md`."""
+    return output_dir / f"{stem}{CACHE_SUFFIX}"
+
+
+def save_document(document, output_dir: Path, stem: str) -> Path:
+    """
+    Serialise a DoclingDocument as compact gzipped JSON.
+
+    Args:
+        document: `result.document` from `DocumentConverter.convert`
+        output_dir: Directory holding the extracted markdown
+        stem: File stem shared with `<stem>.md`
+
+    Returns:
+        Path of the written cache file
+    """
+    path = cache_path(output_dir, stem)
+    data = json.dumps(document.export_to_dict(), ensure_ascii=False, separators=(",", ":"))
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(data)
+    tmp_path.replace(path)
+    return path
+
+
+def remove_document(output_dir: Path, stem: str) -> bool:
+    """
+    Delete the cached document for a stem, e.g. when its markdown was rewritten
+    by another converter and the structure no longer matches.
+
+    Returns:
+        True if a cache file was removed
+    """
+    path = cache_path(output_dir, stem)
+    resolved = str(path.resolve())
+    with _lock:
+        for key in [key for key in _loaded if key[0] == resolved]:
+            del _loaded[key]
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def has_document(output_dir: Path, stem: str) -> bool:
+    """True if a structured document is cached for this stem."""
+    return cache_path(output_dir, stem).exists()
+
+
+def load_document(output_dir: Path, stem: str):
+    """
+    Lazily load a cached DoclingDocument. Returns None if none is cached.
+
+    Parsed documents are memoised until the cache file changes.
+    """
+    path = cache_path(output_dir, stem)
+    if not path.exists():
+        return None
+
+    key = (str(path.resolve()), path.stat().st_mtime_ns)
+    with _lock:
+        if key in _loaded:
+            _loaded.move_to_end(key)
+            return _loaded[key]
+
+    from docling_core.types.doc import DoclingDocument
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        document = DoclingDocument.model_validate(json.load(f))
+
+    with _lock:
+        _loaded[key] = document
+        while len(_loaded) > MAX_LOADED_DOCUMENTS:
+            _loaded.popitem(last=False)
+    return document
+
+
+def export_markdown(output_dir: Path, stem: str) -> Optional[str]:
+    """Re-export markdown from the cached document (no re-conversion)."""
+    document = load_document(output_dir, stem)
+    if document is None:
+        return None
+    return document.export_to_markdown()
+
+
+def section_map(output_dir: Path, stem: str) -> Optional[List[Dict]]:
+    """
+    Outline of the document: titles and section headers with their pages.
+
+    Returns:
+        List of {"text", "level", "page"} in reading order, or None if not cached
+    """
+    document = load_document(output_dir, stem)
+    if document is None:
+        return None
+
+    from docling_core.types.doc import SectionHeaderItem, TitleItem
+
+    sections = []
+    for item, _ in document.iterate_items():
+        if isinstance(item, (TitleItem, SectionHeaderItem)):
+            sections.append({
+                "text": item.text,
+                "level": 0 if isinstance(item, TitleItem) else item.level,
+                "page": item.prov[0].page_no if item.prov else None
+            })
+    return sections
+
+
+def page_map(output_dir: Path, stem: str) -> Optional[Dict[int, str]]:
+    """
+    Markdown of each page, keyed by page number.
+
+    Returns:
+        Dict of page number -> markdown, or None if not cached. Formats without
+        pages (e.g. DOCX) return an empty dict.
+    """
+    document = load_document(output_dir, stem)
+    if document is None:
+        return None
+    return {page_no: document.export_to_markdown(page_no=page_no) for page_no in sorted(document.pages)}
+
+
+def text_pages(output_dir: Path, stem: str) -> Optional[List[Tuple[str, int]]]:
+    """
+    Text of every item with its page number, in reading order.
+
+    Returns:
+        List of (text, page) tuples, or None if not cached. Items without
+        provenance (e.g. from DOCX) are skipped.
+    """
+    document = load_document(output_dir, stem)
+    if document is None:
+        return None
+    return [
+        (item.text, item.prov[0].page_no)
+        for item, _ in document.iterate_items()
+        if getattr(item, "text", None) and getattr(item, "prov", None)
+    ]
@@ -0,0 +1,668 @@
+"""
+Book export.
+Renders the base context, with its highlights, to DOCX, EPUB and PDF.
+
+The document is split into chapter fragments at its H1/H2 headings. Each
+fragment is rendered once to XHTML (shared by EPUB and PDF) or to
+WordprocessingML body XML (DOCX) and cached on disk under the hash of its
+highlighted markdown, so re-exporting after a small edit only re-renders the
+chapters that changed. An export whose fragments are all unchanged reuses the
+previous output file.
+
+Text direction is decided per block from its first strong character, so
+Arabic paragraphs are right-to-left and English ones left-to-right in every
+format. DOCX and EPUB are assembled with the standard library; PDF needs the
+optional `weasyprint` package.
+"""
+
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from hashlib import sha1
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from markdown_it import MarkdownIt
+
+from app import cache
+from app import metrics
+from app import storage
+from app import viewer
+from app.sections import parse_sections, slugify
+from app.workspace import get_workspace
+
+FORMATS = ("docx", "epub", "pdf")
+
+MEDIA_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "epub": "application/epub+zip",
+    "pdf": "application/pdf",
+}
+
+# Fragment renderer used by each format
+FRAGMENT_KINDS = {"docx": "docx", "epub": "html", "pdf": "html"}
+
+# Headings that start a new chapter fragment
+CHAPTER_LEVELS = (1, 2)
+
+# Bump to invalidate cached fragments after changing a renderer
+RENDER_VERSION = 1
+
+# DOCX indentation steps (twentieths of a point)
+INDENT_STEP = 360
+QUOTE_INDENT = 720
+
+# Usable text width of an A4 page with the default margins (twips), shared by table columns
+TABLE_WIDTH = 9000
+
+_RTL = "\u0590-\u08FF\uFB1D-\uFDFF\uFE70-\uFEFF"
+_LTR = "A-Za-z\u00C0-\u024F"
+_STRONG = re.compile(f"[{_RTL}{_LTR}]")
+_RTL_CHAR = re.compile(f"[{_RTL}]")
+_LTR_CHAR = re.compile(f"[{_LTR}]")
+# An RTL run extends over neutrals (spaces, digits, punctuation) up to the last RTL letter before Latin text
+_RTL_RUN = re.compile(f"[{_RTL}](?:[^{_LTR}]*[{_RTL}])?")
+_TAG = re.compile(r"<[^>]*>")
+_INVALID_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_TITLE_MARKUP = re.compile(r"[*_`]")
+# Only the <mark> tags written by viewer.mark_spans survive as HTML; other raw HTML is exported as text
+_MARK_OPEN = re.compile(r'^<mark style="background-color: (#[0-9a-fA-F]{3,8});[^"<>]*">$')
+_MARK_CLOSE = "</mark>"
+
+# Blocks that get an explicit `dir` attribute in XHTML
+_DIRECTED_TAGS = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "ul", "ol", "blockquote", "table", "th", "td"}
+
+_lock = threading.Lock()
+
+
+def _render_raw_html(self, tokens, idx, options, env) -> str:
+    content = tokens[idx].content
+    if _MARK_OPEN.match(content) or content == _MARK_CLOSE:
+        return content
+    return escape(content, quote=False)
+
+
+def _markdown() -> MarkdownIt:
+    md = MarkdownIt("commonmark", {"xhtmlOut": True}).enable("table")
+    md.add_render_rule("html_inline", _render_raw_html)
+    md.add_render_rule("html_block", _render_raw_html)
+    return md
+
+
+_md = _markdown()
+
+
+def available_formats() -> List[str]:
+    """Formats whose dependencies are installed."""
+    formats = ["docx", "epub"]
+    if importlib.util.find_spec("weasyprint") is not None:
+        formats.append("pdf")
+    return formats
+
+
+def text_direction(text: str) -> Optional[str]:
+    """"rtl" or "ltr" from the first strong character of the text (markup ignored), None if it has none."""
+    match = _STRONG.search(_TAG.sub("", text))
+    if match is None:
+        return None
+    return "rtl" if _RTL_CHAR.match(match.group()) else "ltr"
+
+
+def book_direction(markdown: str) -> str:
+    """Direction of the whole book: whichever script has more letters."""
+    return "rtl" if len(_RTL_CHAR.findall(markdown)) >= len(_LTR_CHAR.findall(markdown)) else "ltr"
+
+
+def book_title(markdown: str) -> str:
+    """Title of the first H1 (or first heading) of the document."""
+    headings = parse_sections(markdown, (1, 2, 3, 4, 5, 6))
+    heading = next((h for h in headings if h["level"] == 1), headings[0] if headings else None)
+    return _TITLE_MARKUP.sub("", heading["title"]).strip() if heading else "Book"
+
+
+def split_fragments(markdown: str, highlights: list = None) -> List[Dict]:
+    """
+    Split a document into chapter fragments with their highlights marked.
+
+    Args:
+        markdown: Base context text
+        highlights: List of highlight dictionaries with 'text' and 'color'
+
+    Returns:
+        List of {"title", "start", "end", "markdown"} in document order;
+        `title` is "" for text before the first chapter heading and
+        `markdown` carries the <mark> tags of `viewer.mark_spans`
+    """
+    titles = {s["start"]: s["title"] for s in parse_sections(markdown, CHAPTER_LEVELS)}
+    starts = sorted({0, *titles})
+    # Matched once over the whole book, so a highlight is found wherever it lands
+    spans = viewer.highlight_spans(markdown, highlights) if highlights else []
+
+    fragments = []
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < len(starts) else len(markdown)
+        text = markdown[start:end]
+        if not text.strip():
+            continue
+        local = [
+            (s - start, min(e, end) - start, color, style)
+            for s, e, color, style in spans if start <= s < end
+        ]
+        fragments.append({
+            "title": _TITLE_MARKUP.sub("", titles.get(start, "")).strip(),
+            "start": start,
+            "end": end,
+            "markdown": viewer.mark_spans(text, local)
+        })
+    return fragments
+
+
+# --- XHTML fragments (EPUB, PDF) ---
+
+def render_html_fragment(markdown: str) -> str:
+    """Render a fragment to XHTML with a `dir` attribute on every block."""
+    tokens = _md.parse(markdown)
+    direction = None
+    # Walk backwards so each block opener takes the direction of the next inline text
+    for token in reversed(tokens):
+        if token.type == "inline":
+            direction = text_direction(token.content) or direction
+        elif token.nesting == 1 and token.tag in _DIRECTED_TAGS and direction:
+            token.attrSet("dir", direction)
+    return _md.renderer.render(tokens, _md.options, {})
+
+
+# --- WordprocessingML fragments (DOCX) ---
+
+def _xml(text: str) -> str:
+    return escape(_INVALID_XML.sub("", text))
+
+
+def _fill(color: str) -> str:
+    """`#rgb`, `#rrggbb` or `#rrggbbaa` -> `RRGGBB` for <w:shd w:fill>."""
+    digits = color.lstrip("#")
+    if len(digits) in (3, 4):
+        digits = "".join(c * 2 for c in digits[:3])
+    return digits[:6].upper()
+
+
+def _direction_runs(text: str) -> List[Tuple[str, bool]]:
+    """Split text into (segment, is_rtl) runs."""
+    runs = []
+    position = 0
+    for match in _RTL_RUN.finditer(text):
+        if match.start() > position:
+            runs.append((text[position:match.start()], False))
+        runs.append((match.group(), True))
+        position = match.end()
+    if position < len(text):
+        runs.append((text[position:], False))
+    return runs
+
+
+def _run(text: str, bold: bool = False, italic: bool = False, fill: str = None, style: str = None) -> str:
+    segments = [(text, False)] if style == "CodeChar" else _direction_runs(text)
+    parts = []
+    for segment, rtl in segments:
+        props = []
+        if style:
+            props.append(f'<w:rStyle w:val="{style}"/>')
+        if bold:
+            props.append("<w:b/><w:bCs/>")
+        if italic:
+            props.append("<w:i/><w:iCs/>")
+        if fill:
+            props.append(f'<w:shd w:val="clear" w:color="auto" w:fill="{fill}"/>')
+        if rtl:
+            props.append("<w:rtl/>")
+        rpr = f"<w:rPr>{''.join(props)}</w:rPr>" if props else ""
+        parts.append(f'<w:r>{rpr}<w:t xml:space="preserve">{_xml(segment)}</w:t></w:r>')
+    return "".join(parts)
+
+
+def _inline_runs(children, bold: bool = False) -> str:
+    """WordprocessingML runs of an inline token's children."""
+    out = []
+    strong = 1 if bold else 0
+    emphasis = 0
+    fill = None
+    link = None  # (href, index in out where the link text starts)
+    for child in children or []:
+        kind = child.type
+        style = "Hyperlink" if link else None
+        if kind == "text":
+            out.append(_run(child.content, strong > 0, emphasis > 0, fill, style))
+        elif kind == "softbreak":
+            out.append(_run(" ", strong > 0, emphasis > 0, fill, style))
+        elif kind == "hardbreak":
+            out.append("<w:r><w:br/></w:r>")
+        elif kind == "strong_open":
+            strong += 1
+        elif kind == "strong_close":
+            strong -= 1
+        elif kind == "em_open":
+            emphasis += 1
+        elif kind == "em_close":
+            emphasis -= 1
+        elif kind == "code_inline":
+            out.append(_run(child.content, strong > 0, emphasis > 0, fill, "CodeChar"))
+        elif kind == "image":
+            out.append(_run(child.content, strong > 0, emphasis > 0, fill, style))
+        elif kind == "link_open":
+            link = (child.attrGet("href") or "", len(out))
+        elif kind == "link_close" and link:
+            href, start = link
+            text = "".join(out[start:])
+            # A simple field needs no relationship part, so fragments stay self-contained
+            instruction = _xml(f' HYPERLINK "{href.replace(chr(34), "%22")}" ')
+            out[start:] = [f'<w:fldSimple w:instr="{instruction}">{text}</w:fldSimple>']
+            link = None
+        elif kind == "html_inline":
+            match = _MARK_OPEN.match(child.content)
+            if match:
+                fill = _fill(match.group(1))
+            elif child.content == _MARK_CLOSE:
+                fill = None
+            else:
+                out.append(_run(child.content, strong > 0, emphasis > 0, fill, style))
+    return "".join(out)
+
+
+def _paragraph(runs: str, direction: Optional[str], style: str = None, indent: int = 0) -> str:
+    props = []
+    if style:
+        props.append(f'<w:pStyle w:val="{style}"/>')
+    if direction == "rtl":
+        props.append("<w:bidi/>")
+    if indent:
+        props.append(f'<w:ind w:start="{indent}"/>')
+    ppr = f"<w:pPr>{''.join(props)}</w:pPr>" if props else ""
+    return f"<w:p>{ppr}{runs}</w:p>"
+
+
+def _table(rows: List[List[Tuple[str, Optional[str]]]]) -> str:
+    """A grid table from rows of (cell paragraph XML, direction)."""
+    columns = max(len(row) for row in rows)
+    width = TABLE_WIDTH // columns
+    direction = next((d for row in rows for _, d in row if d), None)
+    props = '<w:tblStyle w:val="TableGrid"/>'
+    if direction == "rtl":
+        props += "<w:bidiVisual/>"
+    props += '<w:tblW w:w="0" w:type="auto"/>'
+    grid = f'<w:gridCol w:w="{width}"/>' * columns
+    xml_rows = []
+    for row in rows:
+        cells = [paragraph for paragraph, _ in row] + ["<w:p/>"] * (columns - len(row))
+        xml_rows.append("<w:tr>" + "".join(
+            f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>{cell}</w:tc>' for cell in cells
+        ) + "</w:tr>")
+    return f"<w:tbl><w:tblPr>{props}</w:tblPr><w:tblGrid>{grid}</w:tblGrid>{''.join(xml_rows)}</w:tbl>"
+
+
+def render_docx_fragment(markdown: str) -> str:
+    """Render a fragment to WordprocessingML body content (paragraphs and tables)."""
+    body = []
+    lists = []  # [ordered, next number] of each open list
+    quote_depth = 0
+    block = None  # (style, indent, list prefix) of the paragraph being rendered
+    item_prefix = None  # marker of the current list item, consumed by its first paragraph
+    rows = None  # table rows while inside a table
+    header_cell = False
+
+    for token in _md.parse(markdown):
+        kind = token.type
+        if kind in ("bullet_list_open", "ordered_list_open"):
+            ordered = kind == "ordered_list_open"
+            lists.append([ordered, int(token.attrGet("start") or 1) if ordered else 0])
+        elif kind in ("bullet_list_close", "ordered_list_close"):
+            lists.pop()
+        elif kind == "list_item_open":
+            ordered, number = lists[-1]
+            item_prefix = f"{number}. " if ordered else "• "
+            if ordered:
+                lists[-1][1] += 1
+        elif kind == "blockquote_open":
+            quote_depth += 1
+        elif kind == "blockquote_close":
+            quote_depth -= 1
+        elif kind == "heading_open":
+            block = (f"Heading{token.tag[1]}", 0, None)
+        elif kind == "paragraph_open":
+            indent = INDENT_STEP * len(lists) + QUOTE_INDENT * quote_depth
+            style = "Quote" if quote_depth else ("ListParagraph" if lists else None)
+            block = (style, indent, item_prefix)
+            item_prefix = None
+        elif kind == "table_open":
+            rows = []
+        elif kind == "tr_open":
+            rows.append([])
+        elif kind in ("th_open", "td_open"):
+            header_cell = kind == "th_open"
+        elif kind == "table_close":
+            if rows:
+                body.append(_table(rows))
+            rows = None
+        elif kind == "inline":
+            direction = text_direction(token.content)
+            if rows is not None:
+                rows[-1].append((_paragraph(_inline_runs(token.children, header_cell), direction), direction))
+                continue
+            style, indent, prefix = block or (None, 0, None)
+            runs = (_run(prefix) if prefix else "") + _inline_runs(token.children)
+            body.append(_paragraph(runs, direction, style, indent))
+            block = None
+        elif kind in ("fence", "code_block"):
+            for line in token.content.rstrip("\n").split("\n"):
+                body.append(_paragraph(_run(line, style="CodeChar") if line else "", "ltr", "Code"))
+        elif kind == "hr":
+            body.append(_paragraph("", None, "HorizontalRule"))
+        elif kind == "html_block":
+            text = token.content.strip()
+            body.append(_paragraph(_run(text), text_direction(text)))
+    return "".join(body)
+
+
+RENDERERS = {"html": render_html_fragment, "docx": render_docx_fragment}
+
+
+# --- Document assembly ---
+
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+_DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>
+</Types>"""
+
+_DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>
+</Relationships>"""
+
+_DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+_DOCX_CORE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<dc:title>{title}</dc:title>
+<dc:language>{language}</dc:language>
+<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created>
+</cp:coreProperties>"""
+
+
+def _heading_style(level: int, size: int) -> str:
+    # Chapters (H2) start on a new page; the book title (H1) opens the document
+    page_break = "<w:pageBreakBefore/>" if level == 2 else ""
+    return (
+        f'<w:style w:type="paragraph" w:styleId="Heading{level}"><w:name w:val="heading {level}"/>'
+        f'<w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>'
+        f'<w:pPr><w:keepNext/>{page_break}<w:spacing w:before="240" w:after="120"/>'
+        f'<w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+        f'<w:rPr><w:b/><w:bCs/><w:sz w:val="{size}"/><w:szCs w:val="{size}"/></w:rPr></w:style>'
+    )
+
+
+_DOCX_STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="{_W}">
+<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:eastAsia="Calibri" w:cs="Arial"/><w:sz w:val="24"/><w:szCs w:val="26"/><w:lang w:val="en-US" w:bidi="ar-SA"/></w:rPr></w:rPrDefault>
+<w:pPrDefault><w:pPr><w:spacing w:after="120" w:line="300" w:lineRule="auto"/></w:pPr></w:pPrDefault></w:docDefaults>
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>
+{"".join(_heading_style(level, size) for level, size in ((1, 40), (2, 34), (3, 29), (4, 26), (5, 24), (6, 24)))}
+<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/><w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="60"/><w:contextualSpacing/></w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="Quote"><w:name w:val="Quote"/><w:basedOn w:val="Normal"/><w:rPr><w:i/><w:iCs/><w:color w:val="555555"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Code"><w:name w:val="Code"/><w:basedOn w:val="Normal"/><w:pPr><w:shd w:val="clear" w:color="auto" w:fill="F5F5F5"/><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="HorizontalRule"><w:name w:val="Horizontal Rule"/><w:basedOn w:val="Normal"/><w:pPr><w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" w:color="999999"/></w:pBdr></w:pPr></w:style>
+<w:style w:type="character" w:styleId="CodeChar"><w:name w:val="Code Char"/><w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas" w:cs="Consolas"/><w:sz w:val="20"/></w:rPr></w:style>
+<w:style w:type="character" w:styleId="Hyperlink"><w:name w:val="Hyperlink"/><w:rPr><w:color w:val="0563C1"/><w:u w:val="single"/></w:rPr></w:style>
+<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/><w:tblPr><w:tblBorders>
+<w:top w:val="single" w:sz="4" w:space="0" w:color="999999"/><w:left w:val="single" w:sz="4" w:space="0" w:color="999999"/>
+<w:bottom w:val="single" w:sz="4" w:space="0" w:color="999999"/><w:right w:val="single" w:sz="4" w:space="0" w:color="999999"/>
+<w:insideH w:val="single" w:sz="4" w:space="0" w:color="999999"/><w:insideV w:val="single" w:sz="4" w:space="0" w:color="999999"/>
+</w:tblBorders></w:tblPr></w:style>
+</w:styles>"""
+
+_CSS = """
+body { font-family: "Noto Naskh Arabic", "Amiri", "Arial", sans-serif; line-height: 1.7; }
+[dir="rtl"] { text-align: right; }
+[dir="ltr"] { text-align: left; }
+pre, code { font-family: "DejaVu Sans Mono", "Consolas", monospace; direction: ltr; unicode-bidi: embed; }
+pre { background: #f5f5f5; padding: 0.5em; white-space: pre-wrap; text-align: left; }
+blockquote { border-inline-start: 3px solid #ccc; margin-inline-start: 0; padding-inline-start: 1em; color: #555; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #999; padding: 0.3em 0.6em; }
+mark { color: inherit; }
+"""
+
+_PDF_CSS = """
+@page { size: A4; margin: 2cm; @bottom-center { content: counter(page); } }
+section.chapter + section.chapter { break-before: page; }
+h1, h2, h3 { break-after: avoid; }
+"""
+
+_EPUB_CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+
+def _xhtml(title: str, body: str, language: str, direction: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+        f'lang="{language}" xml:lang="{language}" dir="{direction}">\n'
+        f'<head><meta charset="utf-8"/><title>{_xml(title)}</title>'
+        f'<link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+        f"<body>\n{body}</body>\n</html>"
+    )
+
+
+def _write_docx(path: Path, fragments: List[str], title: str, direction: str, language: str) -> None:
+    section = "<w:sectPr><w:pgSz w:w=\"11906\" w:h=\"16838\"/>" \
+              "<w:pgMar w:top=\"1440\" w:right=\"1440\" w:bottom=\"1440\" w:left=\"1440\" " \
+              "w:header=\"708\" w:footer=\"708\" w:gutter=\"0\"/>" \
+              f"{'<w:bidi/>' if direction == 'rtl' else ''}</w:sectPr>"
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<w:document xmlns:w="{_W}"><w:body>{"".join(fragments)}{section}</w:body></w:document>'
+    )
+    created = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        z.writestr("_rels/.rels", _DOCX_RELS)
+        z.writestr("docProps/core.xml", _DOCX_CORE.format(title=_xml(title), language=language, created=created))
+        z.writestr("word/_rels/document.xml.rels", _DOCX_DOCUMENT_RELS)
+        z.writestr("word/styles.xml", _DOCX_STYLES)
+        z.writestr("word/document.xml", document)
+
+
+def _write_epub(path: Path, chapters: List[Tuple[str, str]], title: str, direction: str,
+                language: str, identifier: str) -> None:
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    names = [f"chapter-{index:03d}.xhtml" for index in range(1, len(chapters) + 1)]
+    manifest = "".join(
+        f'<item id="c{index}" href="{name}" media-type="application/xhtml+xml"/>'
+        for index, name in enumerate(names, 1)
+    )
+    spine = "".join(f'<itemref idref="c{index}"/>' for index in range(1, len(names) + 1))
+    package = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:identifier id="book-id">{identifier}</dc:identifier>'
+        f"<dc:title>{_xml(title)}</dc:title><dc:language>{language}</dc:language>"
+        f'<meta property="dcterms:modified">{modified}</meta></metadata>'
+        '<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+        f'<item id="css" href="style.css" media-type="text/css"/>{manifest}</manifest>'
+        f'<spine page-progression-direction="{direction}">{spine}</spine></package>'
+    )
+    toc = "".join(
+        f'<li><a href="{name}">{_xml(chapter_title or title)}</a></li>'
+        for name, (chapter_title, _) in zip(names, chapters)
+    )
+    nav = _xhtml(title, f'<nav epub:type="toc" id="toc"><h1>{_xml(title)}</h1><ol>{toc}</ol></nav>\n',
+                 language, direction)
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        # The mimetype entry must come first and be stored uncompressed
+        z.writestr("mimetype", MEDIA_TYPES["epub"], compress_type=zipfile.ZIP_STORED)
+        z.writestr("META-INF/container.xml", _EPUB_CONTAINER)
+        z.writestr("OEBPS/content.opf", package)
+        z.writestr("OEBPS/nav.xhtml", nav)
+        z.writestr("OEBPS/style.css", _CSS)
+        for name, (chapter_title, html) in zip(names, chapters):
+            z.writestr(f"OEBPS/{name}", _xhtml(chapter_title or title, html, language, direction))
+
+
+def _write_pdf(path: Path, chapters: List[Tuple[str, str]], title: str, direction: str, language: str) -> None:
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError) as e:
+        raise RuntimeError(f"PDF export needs the optional 'weasyprint' package: {e}")
+    body = "".join(f'<section class="chapter">\n{html}</section>\n' for _, html in chapters)
+    document = (
+        f'<!DOCTYPE html><html lang="{language}" dir="{direction}"><head><meta charset="utf-8"/>'
+        f"<title>{_xml(title)}</title><style>{_CSS}{_PDF_CSS}</style></head><body>{body}</body></html>"
+    )
+    HTML(string=document).write_pdf(str(path))
+
+
+# --- Fragment cache and export ---
+
+def _fragment_key(kind: str, markdown: str) -> str:
+    return sha1(f"{RENDER_VERSION}\0{kind}\0{markdown}".encode("utf-8")).hexdigest()
+
+
+def _load_manifest(path: Path) -> Dict:
+    try:
+        return cache.read_json(path)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _prune_fragments(fragments_dir: Path, manifest: Dict) -> int:
+    """Delete cached fragments no export in the manifest uses. Returns the number removed."""
+    in_use = {name for entry in manifest.values() for name in entry.get("fragments", [])}
+    removed = 0
+    for path in fragments_dir.glob("*.*"):
+        if path.name not in in_use:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def export_book(fmt: str, workspace_id: str = None, include_highlights: bool = True) -> Dict:
+    """
+    Export the base context of a workspace.
+
+    Args:
+        fmt: One of FORMATS
+        workspace_id: Workspace to export
+        include_highlights: Render highlights as shaded text
+
+    Returns:
+        {"format", "path", "filename", "media_type", "fragments", "rendered",
+        "reused", "cached_output", "bytes", "took_ms"}; `rendered`/`reused`
+        count chapter fragments, `cached_output` is True when the previous
+        file was still current
+
+    Raises:
+        ValueError: If the format is unknown
+        FileNotFoundError: If there is no base context
+        RuntimeError: If the format's optional dependency is missing
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Use one of: {', '.join(FORMATS)}.")
+    if fmt not in available_formats():
+        raise RuntimeError(f"{fmt.upper()} export needs the optional 'weasyprint' package.")
+
+    started = time.perf_counter()
+    workspace = get_workspace(workspace_id)
+    markdown = cache.read_text(workspace.base_context_file)
+    highlights = viewer.load_highlights(workspace.id).get("highlights", []) if include_highlights else []
+
+    kind = FRAGMENT_KINDS[fmt]
+    fragments_dir = workspace.exports_dir / "fragments"
+    manifest_file = workspace.exports_dir / "manifest.json"
+    output = workspace.exports_dir / f"book{'' if include_highlights else '-plain'}.{fmt}"
+
+    with _lock, metrics.span("export"):
+        fragments = split_fragments(markdown, highlights)
+        title = book_title(markdown)
+        direction = book_direction(markdown)
+        language = "ar" if direction == "rtl" else "en"
+        names = [f"{_fragment_key(kind, fragment['markdown'])}.{kind}" for fragment in fragments]
+        document_key = sha1(
+            json.dumps([RENDER_VERSION, fmt, title, direction, names]).encode("utf-8")
+        ).hexdigest()
+
+        manifest = _load_manifest(manifest_file)
+        entry = manifest.get(output.name, {})
+        cached_output = entry.get("key") == document_key and output.exists()
+        rendered = 0
+        if not cached_output:
+            fragments_dir.mkdir(parents=True, exist_ok=True)
+            rendered_fragments = []
+            for fragment, name in zip(fragments, names):
+                path = fragments_dir / name
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        rendered_fragments.append(f.read())
+                except FileNotFoundError:
+                    content = RENDERERS[kind](fragment["markdown"])
+                    storage.write_atomic(path, content)
+                    rendered_fragments.append(content)
+                    rendered += 1
+
+            tmp_output = output.with_name(f".{output.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                if fmt == "docx":
+                    _write_docx(tmp_output, rendered_fragments, title, direction, language)
+                else:
+                    chapters = [(f["title"], html) for f, html in zip(fragments, rendered_fragments)]
+                    if fmt == "epub":
+                        identifier = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, f'bookgen:{workspace.id}')}"
+                        _write_epub(tmp_output, chapters, title, direction, language, identifier)
+                    else:
+                        _write_pdf(tmp_output, chapters, title, direction, language)
+                os.replace(tmp_output, output)
+            finally:
+                if tmp_output.exists():
+                    tmp_output.unlink()
+
+            manifest[output.name] = {
+                "key": document_key,
+                "fragments": names,
+                "exported_at": datetime.now().isoformat()
+            }
+            storage.write_atomic(manifest_file, json.dumps(manifest, indent=2))
+            _prune_fragments(fragments_dir, manifest)
+
+    reused = len(fragments) - rendered
+    metrics.inc("bookgen_export_fragments_total", rendered, format=fmt, result="rendered")
+    metrics.inc("bookgen_export_fragments_total", reused, format=fmt, result="reused")
+    return {
+        "format": fmt,
+        "path": str(output),
+        "filename": f"{slugify(title)}.{fmt}",
+        "media_type": MEDIA_TYPES[fmt],
+        "fragments": len(fragments),
+        "rendered": rendered,
+        "reused": reused,
+        "cached_output": cached_output,
+        "bytes": output.stat().st_size,
+        "took_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
@@ -0,0 +1,323 @@
+"""
+Document extraction shared by the FastAPI app and the Streamlit UI.
+Converts an uploaded file with docling, writes `<stem>.md` and caches the
+structured document next to it.
+
+PDFs are converted with one of three pipeline profiles so born-digital files
+skip the expensive OCR and table-structure models:
+
+- fast:      text layer only (no OCR, no table structure)
+- balanced:  no OCR, fast table-structure model
+- full_ocr:  OCR plus the accurate table-structure model
+
+PDFs with at least SPLIT_PAGE_THRESHOLD pages are converted as page ranges in
+parallel worker processes and stitched back together in page order. Page-range
+processes split the extraction memory limit (see app.workers): each gets
+PAGE_WORKER_MEMORY_LIMIT_MB, one share per range worker plus one left for the
+extraction worker. They are replaced after PAGE_WORKER_MAX_TASKS ranges and
+exit when the extraction worker that started them goes away.
+"""
+
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from docling.datamodel.base_models import InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+from docling.document_converter import DocumentConverter, PdfFormatOption
+
+from app import metrics
+from app import document_store
+from app import storage
+from app import workers
+from app.workers import ExtractionError
+
+PROFILES = ("fast", "balanced", "full_ocr")
+AUTO_PROFILE = "auto"
+
+# Pre-scan settings
+PRESCAN_PAGES = 10            # pages sampled from the start of a PDF
+MIN_CHARS_PER_PAGE = 200      # below this a page is treated as scanned
+SCANNED_PAGE_RATIO = 0.5      # share of scanned pages that triggers OCR
+TABLE_LINE_RATIO = 0.15       # share of table-like lines that triggers table structure
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+
+# Page-level parallel conversion (set BOOKGEN_SPLIT_PAGE_THRESHOLD=0 to disable)
+SPLIT_PAGE_THRESHOLD = int(os.getenv("BOOKGEN_SPLIT_PAGE_THRESHOLD", "150"))
+PAGES_PER_RANGE = int(os.getenv("BOOKGEN_PAGES_PER_RANGE", "50"))
+PAGE_WORKERS = int(os.getenv("BOOKGEN_PAGE_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+PAGE_WORKER_MAX_TASKS = int(os.getenv("BOOKGEN_PAGE_WORKER_MAX_TASKS", "8"))
+PAGE_WORKER_MEMORY_LIMIT_MB = max(1, workers.WORKER_MEMORY_LIMIT_MB // (PAGE_WORKERS + 1))
+
+# Table-like line: three or more cells separated by tabs, pipes or runs of spaces.
+# Cells exclude "|" so a line can only be split one way (no backtracking blow-up
+# on long, malformed pipe rows).
+_TABLE_LINE = re.compile(r"^\s*\|?\s*[^\s|]+(?:(?:\t|\s{2,}|\s*(?:\|\s*)+)[^\s|]+){2,}\s*\|?\s*$")
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*$")
+
+_converter_lock = threading.Lock()
+_converters = {}  # profile -> DocumentConverter
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def _pipeline_options(profile: str) -> PdfPipelineOptions:
+    options = PdfPipelineOptions()
+    if profile == "fast":
+        options.do_ocr = False
+        options.do_table_structure = False
+    elif profile == "balanced":
+        options.do_ocr = False
+        options.do_table_structure = True
+        options.table_structure_options.mode = TableFormerMode.FAST
+    else:
+        options.do_ocr = True
+        options.do_table_structure = True
+        options.table_structure_options.mode = TableFormerMode.ACCURATE
+    return options
+
+
+def get_converter(profile: str) -> DocumentConverter:
+    """
+    Return the converter for a profile, creating it once per process.
+
+    Model loading is the expensive part of `DocumentConverter`, so converters
+    are reused across requests.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown extraction profile '{profile}'. Use one of: {', '.join(PROFILES)}.")
+
+    with _converter_lock:
+        converter = _converters.get(profile)
+        if converter is None:
+            with metrics.span("converter_init"):
+                converter = DocumentConverter(format_options={
+                    InputFormat.PDF: PdfFormatOption(pipeline_options=_pipeline_options(profile))
+                })
+            _converters[profile] = converter
+        return converter
+
+
+def prescan(file_path: Path) -> Dict:
+    """
+    Cheap look at a PDF's text layer (no docling models involved).
+
+    Returns:
+        Dictionary with sampled page count, share of pages without a usable
+        text layer and share of table-like lines
+    """
+    import pypdf
+
+    reader = pypdf.PdfReader(file_path)
+    pages = reader.pages[:PRESCAN_PAGES]
+
+    scanned_pages = 0
+    lines = []
+    for page in pages:
+        text = page.extract_text() or ""
+        if len(text.strip()) < MIN_CHARS_PER_PAGE:
+            scanned_pages += 1
+        lines.extend(line for line in text.splitlines() if line.strip())
+
+    table_lines = sum(1 for line in lines if _TABLE_LINE.match(line))
+
+    return {
+        "page_count": len(reader.pages),
+        "sampled_pages": len(pages),
+        "scanned_ratio": scanned_pages / len(pages) if pages else 1.0,
+        "table_line_ratio": table_lines / len(lines) if lines else 0.0
+    }
+
+
+def select_profile(file_path: Path) -> Tuple[str, Dict]:
+    """
+    Pick a pipeline profile from a pre-scan of the file.
+
+    Returns:
+        (profile, prescan details)
+    """
+    suffix = file_path.suffix.lower()
+    if suffix in IMAGE_SUFFIXES:
+        return "full_ocr", {"reason": "image input"}
+    if suffix != ".pdf":
+        # DOCX/MD/TXT never run the PDF models
+        return "fast", {"reason": f"{suffix or 'unknown'} input"}
+
+    try:
+        with metrics.span("prescan"):
+            details = prescan(file_path)
+    except Exception as e:
+        return "full_ocr", {"reason": f"pre-scan failed: {e}"}
+
+    if details["scanned_ratio"] >= SCANNED_PAGE_RATIO:
+        details["reason"] = "little or no text layer"
+        return "full_ocr", details
+    if details["table_line_ratio"] >= TABLE_LINE_RATIO:
+        details["reason"] = "table-dense text PDF"
+        return "balanced", details
+    details["reason"] = "born-digital text PDF"
+    return "fast", details
+
+
+def page_ranges(page_count: int, pages_per_range: int = PAGES_PER_RANGE) -> List[Tuple[int, int]]:
+    """Split 1-based pages into inclusive (start, end) ranges."""
+    return [
+        (start, min(start + pages_per_range - 1, page_count))
+        for start in range(1, page_count + 1, pages_per_range)
+    ]
+
+
+def _convert_page_range(file_path: str, profile: str, page_range: Tuple[int, int]) -> Tuple[str, dict]:
+    """Worker-process body: convert one page range of a PDF."""
+    result = get_converter(profile).convert(Path(file_path), page_range=page_range)
+    return result.document.export_to_markdown(), result.document.export_to_dict()
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            # spawn: never fork a process that is running uvicorn/Streamlit threads
+            _page_pool = ProcessPoolExecutor(
+                max_workers=PAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=workers.start_memory_watchdog,
+                initargs=(PAGE_WORKER_MEMORY_LIMIT_MB,),
+                max_tasks_per_child=PAGE_WORKER_MAX_TASKS
+            )
+        return _page_pool
+
+
+def _discard_page_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next conversion starts a fresh one."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stitch_markdown(parts: List[str]) -> str:
+    """
+    Join the markdown of consecutive page ranges in page order.
+
+    A range that starts mid-chapter can have its first heading promoted to a
+    document title (`# `) or repeat the heading the previous range ended in
+    (running headers). Later ranges therefore have `# ` demoted to `## `, and a
+    leading heading identical to the previous range's last heading is dropped.
+    """
+    stitched = []
+    last_heading = None
+
+    for index, part in enumerate(parts):
+        lines = part.strip("\n").split("\n")
+
+        if index > 0:
+            lines = ["#" + line if line.startswith("# ") else line for line in lines]
+            first = next((i for i, line in enumerate(lines) if line.strip()), None)
+            if first is not None:
+                match = _HEADING.match(lines[first])
+                if match and last_heading and match.group(2) == last_heading:
+                    del lines[first]
+
+        for line in lines:
+            match = _HEADING.match(line)
+            if match:
+                last_heading = match.group(2)
+
+        text = "\n".join(lines).strip("\n")
+        if text:
+            stitched.append(text)
+
+    return "\n\n".join(stitched)
+
+
+def _convert_in_page_ranges(file_path: Path, profile: str, page_count: int):
+    """Convert a large PDF range by range in worker processes."""
+    from docling_core.types.doc import DoclingDocument
+
+    ranges = page_ranges(page_count)
+    pool = _get_page_pool()
+    futures = [pool.submit(_convert_page_range, str(file_path), profile, r) for r in ranges]
+    try:
+        results = [future.result() for future in futures]
+    except BrokenProcessPool:
+        _discard_page_pool(pool)
+        raise ExtractionError(
+            f"A page-range worker died while converting {file_path.name} "
+            f"(memory limit {PAGE_WORKER_MEMORY_LIMIT_MB} MB per page-range worker).",
+            reason="memory_limit"
+        )
+
+    md_content = stitch_markdown([markdown for markdown, _ in results])
+    document = DoclingDocument.concatenate([DoclingDocument.model_validate(data) for _, data in results])
+    return md_content, document, len(ranges)
+
+
+def _page_count(file_path: Path, details: Dict) -> int:
+    if file_path.suffix.lower() != ".pdf":
+        return 0
+    if "page_count" in details:
+        return details["page_count"]
+    try:
+        import pypdf
+        return len(pypdf.PdfReader(file_path).pages)
+    except Exception:
+        return 0
+
+
+def convert_file(file_path: Path, output_dir: Path, profile: str = AUTO_PROFILE) -> Dict:
+    """
+    Convert a document to markdown and persist the results.
+
+    Writes `<output_dir>/<stem>.md` and the structured docling document
+    (`<stem>.docling.json.gz`) for later re-exports. PDFs with at least
+    SPLIT_PAGE_THRESHOLD pages are converted in parallel page ranges.
+
+    Args:
+        file_path: Uploaded source file
+        output_dir: Extracted documents directory of the workspace
+        profile: One of PROFILES, or "auto" to choose from a pre-scan
+
+    Returns:
+        Dictionary with `markdown`, the `profile` used and `prescan` details
+    """
+    if profile == AUTO_PROFILE:
+        profile, details = select_profile(file_path)
+    else:
+        details = {"reason": "requested"}
+
+    page_count = _page_count(file_path, details)
+    if SPLIT_PAGE_THRESHOLD and page_count >= SPLIT_PAGE_THRESHOLD:
+        with metrics.span("conversion_parallel"):
+            md_content, document, details["page_ranges"] = _convert_in_page_ranges(
+                file_path, profile, page_count
+            )
+    else:
+        converter = get_converter(profile)
+        with metrics.span("conversion"):
+            result = converter.convert(file_path)
+        document = result.document
+        with metrics.span("markdown_export"):
+            md_content = document.export_to_markdown()
+
+    output_path = output_dir / f"{file_path.stem}.md"
+    with metrics.span("file_write"):
+        storage.write_text(output_path, md_content)
+
+    try:
+        with metrics.span("document_cache_write"):
+            document_store.save_document(document, output_dir, file_path.stem)
+    except Exception as e:
+        # The markdown is what the pipeline needs; the structured cache is best effort
+        print(f"Could not cache structured document for {file_path.name}: {e}")
+
+    return {"markdown": md_content, "profile": profile, "prescan": details}
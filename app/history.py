@@ -1,16 +1,40 @@
 import json
+import threading
 import uuid
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
-SESSIONS_DIR = Path("chat_sessions")
+from app import cache
+from app import search
+from app import storage
+from app.arabic import normalize_arabic
+from app.workspace import get_workspace
+
+# Sessions directory of the default workspace
+SESSIONS_DIR = get_workspace().sessions_dir
 SESSIONS_DIR.mkdir(exist_ok=True)
 
-def create_session() -> str:
+# Summaries of all sessions, so listing does not open every session file
+INDEX_FILE_NAME = "_index.json"
+TITLE_CHARS = 80
+
+_index_lock = threading.Lock()
+
+def _sessions_dir(workspace_id: str = None) -> Path:
+    sessions_dir = get_workspace(workspace_id).sessions_dir
+    sessions_dir.mkdir(parents=True, exist_ok=True)
+    return sessions_dir
+
+def _write_session(session_file: Path, session_data: Dict) -> None:
+    # Compressed with BOOKGEN_COMPRESSION; the index below stays plain, it is small and rewritten often
+    storage.write_json(session_file, session_data)
+    cache.invalidate(session_file)
+
+def create_session(workspace_id: str = None) -> str:
     """Creates a new empty session and returns its ID."""
     session_id = str(uuid.uuid4())
-    session_file = SESSIONS_DIR / f"{session_id}.json"
+    session_file = _sessions_dir(workspace_id) / f"{session_id}.json"
     
     session_data = {
         "id": session_id,
@@ -18,23 +42,23 @@ def create_session() -> str:
         "messages": []
     }
     
-    with open(session_file, "w", encoding="utf-8") as f:
-        json.dump(session_data, f, indent=2, ensure_ascii=False)
+    _write_session(session_file, session_data)
+    _update_index(session_data, workspace_id)
         
     return session_id
 
-def get_session(session_id: str) -> Dict:
-    """Retrieves session data by ID. Returns None if not found."""
-    session_file = SESSIONS_DIR / f"{session_id}.json"
-    if not session_file.exists():
+def get_session(session_id: str, workspace_id: str = None) -> Dict:
+    """Retrieves session data by ID (cached until the file changes). Returns None if not found."""
+    session_file = _sessions_dir(workspace_id) / f"{session_id}.json"
+    try:
+        return cache.read_json(session_file)
+    except FileNotFoundError:
         return None
-        
-    with open(session_file, "r", encoding="utf-8") as f:
-        return json.load(f)
 
-def save_message(session_id: str, role: str, content: str):
-    """Appends a message to the session history."""
-    session_data = get_session(session_id)
+def save_message(session_id: str, role: str, content: str, workspace_id: str = None,
+                 citations: List[Dict] = None):
+    """Appends a message (with its source citations, if any) to the session history."""
+    session_data = get_session(session_id, workspace_id)
     if not session_data:
         raise ValueError("Session not found")
         
@@ -43,28 +67,131 @@ def save_message(session_id: str, role: str, content: str):
         "content": content,
         "timestamp": datetime.now().isoformat()
     }
+    if citations:
+        message["citations"] = citations
     
     session_data["messages"].append(message)
     
-    session_file = SESSIONS_DIR / f"{session_id}.json"
-    with open(session_file, "w", encoding="utf-8") as f:
-        json.dump(session_data, f, indent=2, ensure_ascii=False)
+    session_file = _sessions_dir(workspace_id) / f"{session_id}.json"
+    _write_session(session_file, session_data)
+    _update_index(session_data, workspace_id)
 
-def list_sessions() -> List[Dict]:
-    """Lists all available sessions, sorted by creation date (newest first)."""
-    sessions = []
-    for file_path in SESSIONS_DIR.glob("*.json"):
+    search.index_message(session_id, len(session_data["messages"]) - 1, message, workspace_id)
+
+def get_messages(session_id: str, workspace_id: str = None, before: int = None, limit: int = 20) -> Optional[Dict]:
+    """
+    A window of a session's messages, for paging back through long chats.
+
+    Args:
+        session_id: Session ID
+        workspace_id: Workspace of the session (default workspace if None)
+        before: Index of the first message not to include (None for the end)
+        limit: Maximum number of messages
+
+    Returns:
+        {"messages", "start", "total"} where `start` is the index of the first
+        returned message, or None if the session does not exist
+    """
+    session_data = get_session(session_id, workspace_id)
+    if session_data is None:
+        return None
+    messages = session_data.get("messages", [])
+    end = len(messages) if before is None else max(0, min(before, len(messages)))
+    start = max(0, end - limit)
+    return {"messages": messages[start:end], "start": start, "total": len(messages)}
+
+def _file_signature(session_file: Path) -> str:
+    stat = session_file.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def _summary(session_data: Dict, session_file: Path) -> Dict:
+    messages = session_data.get("messages", [])
+    first_prompt = next((m["content"] for m in messages if m.get("role") == "user"), "")
+    return {
+        "id": session_data["id"],
+        "created_at": session_data["created_at"],
+        "updated_at": messages[-1].get("timestamp", session_data["created_at"]) if messages else session_data["created_at"],
+        "message_count": len(messages),
+        "title": " ".join(first_prompt.split())[:TITLE_CHARS],
+        "signature": _file_signature(session_file)
+    }
+
+def _load_index(workspace_id: str = None) -> Dict[str, Dict]:
+    """
+    Session summaries by ID, reconciled with the session files on disk. Call with _index_lock held.
+
+    The lock only covers this process, and the API and Streamlit both rewrite the
+    index, so an overlapping save can lose an update. Each summary therefore keeps
+    its file's size:mtime, and a summary whose file has changed since is rebuilt.
+    """
+    sessions_dir = _sessions_dir(workspace_id)
+    index_file = sessions_dir / INDEX_FILE_NAME
+    try:
+        index = dict(cache.read_json(index_file, copy_result=False))
+    except (FileNotFoundError, ValueError):
+        index = {}
+
+    # Listing and stat-ing is cheap; only new or changed sessions are opened
+    on_disk = {p.stem: p for p in sessions_dir.glob("*.json") if not p.name.startswith("_")}
+    changed = False
+    for session_id in set(index) - set(on_disk):
+        del index[session_id]
+        changed = True
+    for session_id, session_file in on_disk.items():
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                sessions.append({
-                    "id": data["id"],
-                    "created_at": data["created_at"],
-                    "message_count": len(data.get("messages", []))
-                })
+            if session_id in index and index[session_id].get("signature") == _file_signature(session_file):
+                continue
+            index[session_id] = _summary(cache.read_json(session_file, copy_result=False), session_file)
+            changed = True
         except Exception:
             continue
-            
+    if changed:
+        _write_index(index_file, index)
+    return index
+
+def _write_index(index_file: Path, index: Dict[str, Dict]) -> None:
+    tmp_file = index_file.with_name(f".{index_file.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    tmp_file.replace(index_file)
+    cache.invalidate(index_file)
+
+def _update_index(session_data: Dict, workspace_id: str = None) -> None:
+    with _index_lock:
+        index = _load_index(workspace_id)
+        session_file = _sessions_dir(workspace_id) / f"{session_data['id']}.json"
+        index[session_data["id"]] = _summary(session_data, session_file)
+        _write_index(_sessions_dir(workspace_id) / INDEX_FILE_NAME, index)
+
+def page_sessions(workspace_id: str = None, offset: int = 0, limit: int = None,
+                  query: str = None) -> Tuple[List[Dict], int]:
+    """
+    One page of the session list, newest first, read from the session index.
+
+    Args:
+        workspace_id: Workspace to list (default workspace if None)
+        offset: Number of sessions to skip
+        limit: Page size (None for all)
+        query: Optional filter on the session title (first prompt) or ID
+
+    Returns:
+        (sessions, total matching). Each session has `id`, `created_at`,
+        `updated_at`, `message_count` and `title`
+    """
+    with _index_lock:
+        sessions = [
+            {key: value for key, value in summary.items() if key != "signature"}
+            for summary in _load_index(workspace_id).values()
+        ]
+    if query and query.strip():
+        needle = normalize_arabic(query.strip())
+        sessions = [s for s in sessions if needle in normalize_arabic(s["title"]) or needle in s["id"]]
+
     # Sort by created_at descending
     sessions.sort(key=lambda x: x["created_at"], reverse=True)
-    return sessions
+    end = None if limit is None else offset + limit
+    return sessions[offset:end], len(sessions)
+
+def list_sessions(workspace_id: str = None) -> List[Dict]:
+    """Lists all available sessions, sorted by creation date (newest first)."""
+    return page_sessions(workspace_id)[0]
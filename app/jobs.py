@@ -0,0 +1,411 @@
+"""
+Background job queue for consolidation.
+Jobs run on a local thread pool, their state is persisted as JSON next to the
+consolidated output, and the finished book is atomically swapped into place.
+
+The model output is streamed into `<output>.<job_id>.partial` as it arrives and
+the partial file is renamed over the output when the stream completes. A failed
+job keeps its partial file so the work done so far can be recovered.
+
+Two modes are supported: "single" (one streamed call for the whole book) and
+"chapters" (outline pass, then chapters in parallel via app.chapters; finished
+chapters are appended to the partial file in outline order).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app import budget
+from app import cache
+from app import dedup
+from app import storage
+from app.consolidator import read_sources, stream_summary
+from app.workspace import get_workspace
+
+# Consolidation is dominated by waiting on Gemini, so a small thread pool is enough
+MAX_WORKERS = int(os.getenv("BOOKGEN_JOB_WORKERS", "2"))
+
+ACTIVE_STATUSES = ("queued", "running")
+FINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+MODES = ("single", "chapters")
+
+# While output streams in, job state is persisted at most this often (seconds)
+STREAM_PERSIST_INTERVAL = 2.0
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="consolidation")
+_lock = threading.Lock()
+_jobs = {}           # job_id -> state of a job until it finishes (mirror of the JSON file)
+_cancel_events = {}  # job_id -> threading.Event
+_active_by_key = {}  # dedup key -> job_id of the queued/running job
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job has been cancelled."""
+
+
+def _job_file(job_id: str, workspace_id: str = None) -> Path:
+    return get_workspace(workspace_id).jobs_dir / f"{job_id}.json"
+
+
+def _persist(job: Dict) -> None:
+    """Write job state atomically (temp file + rename)."""
+    job_file = _job_file(job["id"], job["workspace"])
+    job_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = job_file.with_suffix(".json.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(job, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, job_file)
+
+
+def _snapshot(job: Dict) -> Dict:
+    """Copy of a job safe to hand out while the worker keeps appending events."""
+    return {**job, "events": list(job["events"])}
+
+
+def _update(job_id: str, **changes) -> Dict:
+    with _lock:
+        job = _jobs[job_id]
+        job.update(changes)
+        job["updated_at"] = datetime.now().isoformat()
+        _persist(job)
+        return _snapshot(job)
+
+
+def _emit(job_id: str, stage: str, message: str, progress: float) -> None:
+    """Append a progress event to the job."""
+    with _lock:
+        job = _jobs[job_id]
+        job["events"].append({
+            "timestamp": datetime.now().isoformat(),
+            "stage": stage,
+            "message": message,
+            "progress": progress
+        })
+        job["stage"] = stage
+        job["progress"] = progress
+        job["updated_at"] = datetime.now().isoformat()
+        _persist(job)
+
+
+def _check_cancelled(job_id: str) -> None:
+    if _cancel_events[job_id].is_set():
+        raise JobCancelled()
+
+
+def _dedup_key(md_files: List[Path], output_file: Path, mode: str) -> str:
+    """Identify a consolidation by its inputs (name, size, mtime), target file and mode."""
+    digest = hashlib.sha256(f"{output_file.resolve()}:{mode}".encode("utf-8"))
+    for md_file in sorted(md_files):
+        stat = md_file.stat()
+        digest.update(f"{md_file.name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def partial_file_for(output_file: Path, job_id: str) -> Path:
+    """Temp file a job streams its output into."""
+    return output_file.with_name(f"{output_file.name}.{job_id}.partial")
+
+
+def _stream_to_partial(job_id: str, combined_text: str, partial_file: Path, expected_tokens: int) -> None:
+    """Append streamed model output to `partial_file`, checking for cancellation between chunks."""
+    chunks = stream_summary(combined_text)
+    written = 0
+    received_tokens = 0
+    last_persist = time.monotonic()
+    try:
+        with open(partial_file, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                f.flush()
+                if not written:
+                    _emit(job_id, "streaming", "Receiving output", 0.2)
+                written += len(chunk)
+                received_tokens += budget.estimate_tokens(chunk)
+                _check_cancelled(job_id)
+
+                now = time.monotonic()
+                if now - last_persist >= STREAM_PERSIST_INTERVAL:
+                    last_persist = now
+                    progress = 0.2 + 0.75 * min(0.99, received_tokens / max(expected_tokens, 1))
+                    _update(job_id, progress=round(progress, 3), partial_chars=written)
+            os.fsync(f.fileno())
+    finally:
+        # Closing the generator ends the HTTP stream when we stop early
+        chunks.close()
+    _update(job_id, partial_chars=written)
+
+
+def _consolidate_by_chapter(job_id: str, sources: List[Tuple[str, str]], partial_file: Path) -> None:
+    """Outline pass, then parallel chapters appended to `partial_file` in outline order."""
+    from app import chapters
+
+    source_tokens = budget.estimate_tokens(budget.combine_sources(sources))
+    _emit(job_id, "budget", f"~{source_tokens:,} source tokens; each chapter is sent up to "
+                            f"{chapters.CHAPTER_SOURCE_TOKENS:,} tokens of its assigned sources", 0.1)
+
+    _emit(job_id, "outline", "Planning chapters", 0.15)
+    outline = chapters.plan_outline(sources)
+    titles = [chapter["title"] for chapter in outline["chapters"]]
+    total = len(titles)
+    _update(job_id, outline={"title": outline["title"], "chapters": titles})
+    _emit(job_id, "chapters", f"Writing {total} chapter(s) in parallel", 0.25)
+
+    finished = {}  # index -> markdown, waiting for the chapters before it
+    next_index = 0
+    written = 0
+    generated = chapters.iter_chapters(outline, sources)
+    try:
+        with open(partial_file, "w", encoding="utf-8") as f:
+            header = f"# {outline['title']}\n\n"
+            f.write(header)
+            written += len(header)
+            for index, markdown in generated:
+                finished[index] = markdown
+                _check_cancelled(job_id)
+
+                # Append every chapter that is now contiguous with what was written
+                while next_index in finished:
+                    text = finished.pop(next_index) + "\n\n"
+                    f.write(text)
+                    f.flush()
+                    written += len(text)
+                    next_index += 1
+
+                done = next_index + len(finished)
+                _emit(job_id, "chapters", f"Chapter {done}/{total} done: {titles[index]}",
+                      round(0.25 + 0.7 * done / total, 3))
+                _update(job_id, partial_chars=written)
+            os.fsync(f.fileno())
+    finally:
+        generated.close()
+
+
+def _promote(partial_file: Path, output_file: Path) -> None:
+    """Atomically replace the output with a completed partial file (compressing it if configured)."""
+    storage.promote(partial_file, output_file)
+    cache.invalidate(output_file)
+
+
+def read_output(job: Dict, offset: int = 0) -> bytes:
+    """
+    Output a job has produced so far, from byte `offset`.
+
+    Reads the partial file while the job streams, and the promoted output file
+    once it has succeeded (decompressed, so the bytes and offsets stay the same).
+    """
+    paths = [Path(job["partial_file"])] if job.get("partial_file") else []
+    if job["status"] == "succeeded":
+        paths.append(Path(job["output_file"]))
+    for path in paths:
+        try:
+            with storage.open_binary(path) as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            continue
+    return b""
+
+
+def _run_consolidation(job_id: str, md_files: List[Path], output_file: Path, mode: str = "single") -> None:
+    """Worker body: read sources, stream Gemini output to a temp file, swap it into place."""
+    partial_file = partial_file_for(output_file, job_id)
+    try:
+        _check_cancelled(job_id)
+        _update(job_id, status="running", started_at=datetime.now().isoformat())
+
+        _emit(job_id, "reading_sources", f"Reading {len(md_files)} extracted file(s)", 0.05)
+        sources = read_sources(md_files)
+        _check_cancelled(job_id)
+
+        # Drop paragraphs repeated across sources before paying to send them
+        sources, dedup_report = dedup.prepare_sources(sources)
+        if dedup_report:
+            _update(job_id, dedup=dedup_report)
+            _emit(job_id, "dedup", dedup.summarize_report(dedup_report), 0.08)
+
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        if mode == "chapters":
+            # Chapter calls budget their own sources; a whole-book window plan would not describe them
+            _consolidate_by_chapter(job_id, sources, partial_file)
+        else:
+            # Measure before the (slow) call and fit the input to the model window
+            plan = budget.plan_consolidation(budget.combine_sources(sources))
+            combined_text = plan.pop("text")
+            _update(job_id, budget=plan)
+            _emit(job_id, "budget", budget.summarize_plan(plan), 0.1)
+
+            _emit(job_id, "calling_model", "Consolidating with Gemini", 0.15)
+            _stream_to_partial(job_id, combined_text, partial_file, plan["projected_output_tokens"])
+        _check_cancelled(job_id)
+
+        _emit(job_id, "writing_output", f"Writing {output_file.name}", 0.95)
+        _promote(partial_file, output_file)
+
+        from app import provenance, search
+        search.index_base_context(_jobs[job_id]["workspace"])
+        try:
+            _emit(job_id, "provenance", "Mapping sections to their sources", 0.97)
+            provenance.build(_jobs[job_id]["workspace"])
+        except Exception as e:
+            # The book is done; citations are unavailable until the map is rebuilt
+            print(f"Could not build the provenance map: {e}")
+
+        with storage.open_text(output_file) as f:
+            content_preview = f.read(500)
+        _emit(job_id, "done", "Consolidation complete", 1.0)
+        _update(job_id, status="succeeded", finished_at=datetime.now().isoformat(),
+                content_preview=content_preview)
+
+    except JobCancelled:
+        if partial_file.exists():
+            partial_file.unlink()
+        _emit(job_id, "cancelled", "Job cancelled", _jobs[job_id]["progress"])
+        _update(job_id, status="cancelled", finished_at=datetime.now().isoformat())
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        error = str(e)
+        if partial_file.exists() and partial_file.stat().st_size:
+            error += f" (partial output kept in {partial_file.name})"
+        _update(job_id, status="failed", error=error, finished_at=datetime.now().isoformat())
+    finally:
+        with _lock:
+            key = _jobs[job_id]["dedup_key"]
+            if _active_by_key.get(key) == job_id:
+                del _active_by_key[key]
+            # Finished jobs are served from their JSON file by `get_job`
+            if _jobs[job_id]["status"] in FINAL_STATUSES:
+                del _jobs[job_id]
+                del _cancel_events[job_id]
+
+
+def submit_consolidation(workspace_id: str = None, mode: str = "single") -> Dict:
+    """
+    Queue a consolidation of every extracted `*.md` file in a workspace.
+
+    The book is written to the workspace's `base_context.md` on success. If an
+    identical consolidation (same inputs, output and mode) is already queued or
+    running, that job is returned instead of starting a new one.
+
+    Args:
+        workspace_id: Workspace to consolidate (default workspace if None)
+        mode: "single" for one call, "chapters" for an outline pass plus parallel chapters
+
+    Returns:
+        Job state dictionary, with `deduplicated` set when an existing job was reused
+
+    Raises:
+        FileNotFoundError: If there are no extracted documents
+        ValueError: If the mode is unknown
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown consolidation mode '{mode}'. Use one of: {', '.join(MODES)}.")
+    workspace = get_workspace(workspace_id).ensure()
+    output_file = workspace.base_context_file
+    md_files = sorted(workspace.output_dir.glob("*.md"))
+    if not md_files:
+        raise FileNotFoundError("No extracted documents found to consolidate.")
+
+    key = _dedup_key(md_files, output_file, mode)
+
+    with _lock:
+        existing_id = _active_by_key.get(key)
+        if existing_id:
+            job = _snapshot(_jobs[existing_id])
+            job["deduplicated"] = True
+            return job
+
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        job = {
+            "id": job_id,
+            "type": "consolidation",
+            "mode": mode,
+            "workspace": workspace.id,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0.0,
+            "sources": [f.name for f in md_files],
+            "output_file": str(output_file),
+            "partial_file": str(partial_file_for(output_file, job_id)),
+            "partial_chars": 0,
+            "dedup_key": key,
+            "events": [],
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        _jobs[job_id] = job
+        _cancel_events[job_id] = threading.Event()
+        _active_by_key[key] = job_id
+        _persist(job)
+
+    _executor.submit(_run_consolidation, job_id, md_files, output_file, mode)
+
+    result = _snapshot(job)
+    result["deduplicated"] = False
+    return result
+
+
+def get_job(job_id: str, workspace_id: str = None) -> Optional[Dict]:
+    """
+    Retrieve job state by ID. Returns None if not found in the workspace.
+
+    Active jobs come from memory, finished ones from their persisted JSON file.
+    Jobs persisted by a previous process that never finished are reported as failed.
+    """
+    workspace_id = get_workspace(workspace_id).id
+    with _lock:
+        job = _jobs.get(job_id)
+        if job and job["workspace"] == workspace_id:
+            return _snapshot(job)
+
+    job_file = _job_file(job_id, workspace_id)
+    if not job_file.exists():
+        return None
+
+    with open(job_file, "r", encoding="utf-8") as f:
+        job = json.load(f)
+
+    if job.get("status") in ACTIVE_STATUSES:
+        job["status"] = "failed"
+        job["error"] = "Interrupted: the server restarted before the job finished."
+    return job
+
+
+def list_jobs(workspace_id: str = None) -> List[Dict]:
+    """Lists the workspace's persisted jobs (without their event logs), newest first."""
+    jobs = []
+    for file_path in get_workspace(workspace_id).jobs_dir.glob("*.json"):
+        job = get_job(file_path.stem, workspace_id)
+        if job:
+            job.pop("events", None)
+            jobs.append(job)
+
+    jobs.sort(key=lambda j: j["created_at"], reverse=True)
+    return jobs
+
+
+def cancel_job(job_id: str, workspace_id: str = None) -> bool:
+    """
+    Request cancellation of a queued or running job.
+
+    Returns:
+        True if the job was active and is now being cancelled, False otherwise
+    """
+    workspace_id = get_workspace(workspace_id).id
+    with _lock:
+        job = _jobs.get(job_id)
+        if not job or job["workspace"] != workspace_id or job["status"] not in ACTIVE_STATUSES:
+            return False
+        _cancel_events[job_id].set()
+        return True
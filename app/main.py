@@ -1,96 +1,513 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-import shutil
+from fastapi import FastAPI, APIRouter, Depends, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import os
+import time
+import json
+import asyncio
+import codecs
 from pathlib import Path
-from docling.document_converter import DocumentConverter
+
+from app import cache
+from app import metrics
+from app import document_store
+from app.extraction import PROFILES, AUTO_PROFILE
+from app import search
+from app import uploads
+from app.workers import ExtractionError, run_extraction
+from app.workspace import Workspace, DEFAULT_WORKSPACE, get_workspace, list_workspaces
 
 app = FastAPI()
 
-UPLOAD_DIR = Path("uploaded_files")
-OUTPUT_DIR = Path("extracted_docs")
+# Data endpoints live on a router mounted twice: at the root (default workspace,
+# or `?workspace_id=`) and under /workspaces/{workspace_id}/
+router = APIRouter()
+
+def resolve_workspace(workspace_id: str = DEFAULT_WORKSPACE) -> Workspace:
+    """Dependency: resolves the workspace of the request and creates its directories."""
+    try:
+        return get_workspace(workspace_id).ensure()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.middleware("http")
+async def server_timing_middleware(request: Request, call_next):
+    """Collects the pipeline spans of each request into a Server-Timing header."""
+    token = metrics.start_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        spans = metrics.end_request(token)
+    total = time.perf_counter() - start
+
+    # Use the route template (not the raw path) to keep label cardinality bounded
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    metrics.observe("bookgen_http_request_duration_seconds", total, method=request.method, path=path)
 
-UPLOAD_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
+    response.headers["Server-Timing"] = metrics.server_timing_header(spans, total)
+    return response
 
-@app.post("/extract/")
-async def extract_document(file: UploadFile = File(...)):
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/workspaces/")
+async def list_all_workspaces():
+    """Lists workspace IDs."""
+    return list_workspaces()
+
+@app.post("/workspaces/{workspace_id}")
+async def create_workspace(workspace: Workspace = Depends(resolve_workspace)):
+    """Creates a workspace (idempotent)."""
+    return {"workspace_id": workspace.id}
+
+# HTTP status for each ExtractionError reason
+EXTRACTION_ERROR_STATUS = {"memory_limit": 413, "timeout": 504, "crashed": 500, "error": 500}
+
+@router.post("/extract/")
+async def extract_document(file: UploadFile = File(...), profile: str = AUTO_PROFILE,
+                           workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Extracts an uploaded document to markdown. `profile` selects the docling
+    pipeline (fast, balanced, full_ocr) or "auto" to pick one from a pre-scan.
+    """
+    if profile != AUTO_PROFILE and profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile '{profile}'.")
+    try:
+        filename = uploads.safe_filename(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         # Save upload file
-        file_location = UPLOAD_DIR / file.filename
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_location = workspace.upload_dir / filename
+        with metrics.span("upload_write"):
+            await run_in_threadpool(uploads.save_stream, file.file, file_location)
             
-        # Initialize converter (re-initializing per request is safe but maybe slow; 
-        # for production, might want a singleton if model loading is heavy)
-        converter = DocumentConverter()
+        return await extract_saved_file(file_location, profile, workspace)
         
-        # Convert
-        result = converter.convert(file_location)
-        md_content = result.document.export_to_markdown()
-        
-        # Save markdown
-        output_filename = f"{file_location.stem}.md"
-        output_path = OUTPUT_DIR / output_filename
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def extract_saved_file(file_location: Path, profile: str, workspace: Workspace) -> dict:
+    """Converts a file in uploaded_files/ and indexes the markdown (shared by /extract/ and /uploads/)."""
+    try:
+        # Convert and save markdown (+ structured document cache) in a worker process
+        extraction = await run_in_threadpool(run_extraction, file_location, workspace.output_dir, profile)
+    except ExtractionError as e:
+        status_code = EXTRACTION_ERROR_STATUS.get(e.reason, 500)
+        raise HTTPException(status_code=status_code, detail={"reason": e.reason, "message": str(e)})
+    output_path = workspace.output_dir / f"{file_location.stem}.md"
+    await run_in_threadpool(search.index_source, output_path, workspace.id)
         
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(md_content)
-            
+    return {
+        "filename": file_location.name, 
+        "status": "success", 
+        "extracted_file": str(output_path),
+        "extracted_content": extraction["markdown"],
+        "profile": extraction["profile"],
+        "prescan": extraction["prescan"]
+    }
+
+def _cached_document_or_404(result):
+    if result is None:
+        raise HTTPException(status_code=404, detail="No structured document cached for this file.")
+    return result
+
+@router.get("/documents/{stem}/markdown", response_class=PlainTextResponse)
+async def export_document_markdown(stem: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Re-exports markdown from the cached docling document (no re-conversion)."""
+    return _cached_document_or_404(document_store.export_markdown(workspace.output_dir, stem))
+
+@router.get("/documents/{stem}/sections")
+async def get_document_sections(stem: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Title and section headers of an extracted document, with page numbers."""
+    return _cached_document_or_404(document_store.section_map(workspace.output_dir, stem))
+
+@router.get("/documents/{stem}/pages")
+async def get_document_pages(stem: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Markdown of each page of an extracted document."""
+    return _cached_document_or_404(document_store.page_map(workspace.output_dir, stem))
+
+from app import jobs
+from app import budget
+from app import dedup
+from app.consolidator import read_sources
+
+@router.post("/consolidate/", status_code=202)
+async def consolidate_documents(mode: str = "single", workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Queues consolidation of the workspace's extracted documents as a background job.
+    `mode=chapters` plans an outline first and writes the chapters in parallel.
+    Poll `GET /consolidate/jobs/{job_id}` for progress.
+    """
+    if mode not in jobs.MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}'.")
+    try:
+        job = jobs.submit_consolidation(workspace.id, mode)
         return {
-            "filename": file.filename, 
-            "status": "success", 
-            "extracted_file": str(output_path),
-            "extracted_content": md_content
+            "status": job["status"],
+            "mode": job["mode"],
+            "message": "Consolidation already in progress." if job["deduplicated"] else "Consolidation queued.",
+            "job_id": job["id"],
+            "deduplicated": job["deduplicated"],
+            "file": job["output_file"]
         }
-        
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-from app.consolidator import generate_summary
+@router.get("/consolidate/plan")
+async def plan_consolidation(workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Reports duplicate paragraphs removed, per-file token estimates, projected
+    input/output tokens and cost for consolidating the workspace, without
+    calling the model.
+    """
+    md_files = sorted(workspace.output_dir.glob("*.md"))
+    if not md_files:
+        raise HTTPException(status_code=404, detail="No extracted documents found to consolidate.")
+    sources, dedup_report = dedup.prepare_sources(read_sources(md_files))
+    plan = budget.plan_consolidation(budget.combine_sources(sources))
+    plan.pop("text")
+    plan["dedup"] = dedup_report
+    plan["summary"] = budget.summarize_plan(plan)
+    if dedup_report:
+        plan["summary"] = f"{dedup.summarize_report(dedup_report)}; {plan['summary']}"
+    return plan
+
+@router.get("/consolidate/jobs/")
+async def list_consolidation_jobs(workspace: Workspace = Depends(resolve_workspace)):
+    """Lists consolidation jobs, newest first."""
+    return jobs.list_jobs(workspace.id)
+
+@router.get("/consolidate/jobs/{job_id}")
+async def get_consolidation_job(job_id: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Returns status, progress events and result preview for a job."""
+    job = jobs.get_job(job_id, workspace.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# How often the SSE stream checks the job for new output (seconds)
+SSE_POLL_INTERVAL = 0.5
+
+def _sse(event: str, data: dict, event_id: int = None) -> str:
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/consolidate/jobs/{job_id}/stream")
+async def stream_consolidation_job(job_id: str, request: Request, offset: int = 0,
+                                   workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Server-Sent Events stream of a job's output as it is generated.
+
+    Events: `progress` (stage changes), `chunk` (new markdown; its `id` is the
+    byte offset to resume from via `offset` or `Last-Event-ID`) and a final
+    `done` with the job status.
+    """
+    if not jobs.get_job(job_id, workspace.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        offset = int(last_event_id)
 
-CONSOLIDATED_DIR = Path("consolidated_docs")
-CONSOLIDATED_DIR.mkdir(exist_ok=True)
+    async def events():
+        position = offset
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        last_stage = None
+        while True:
+            job = jobs.get_job(job_id, workspace.id)
+            if job["stage"] != last_stage:
+                last_stage = job["stage"]
+                message = job["events"][-1]["message"] if job["events"] else ""
+                yield _sse("progress", {"stage": job["stage"], "progress": job["progress"], "message": message})
 
-@app.post("/consolidate/")
-async def consolidate_documents():
+            # Read whatever is on disk before checking for completion so the tail is not lost
+            data = jobs.read_output(job, position)
+            if data:
+                position += len(data)
+                text = decoder.decode(data)
+                if text:
+                    # Bytes of a split UTF-8 character stay in the decoder; resume before them
+                    yield _sse("chunk", {"text": text}, event_id=position - len(decoder.getstate()[0]))
+
+            if job["status"] not in jobs.ACTIVE_STATUSES:
+                yield _sse("done", {"status": job["status"], "error": job.get("error")})
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.delete("/consolidate/jobs/{job_id}")
+async def cancel_consolidation_job(job_id: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Cancels a queued or running job. The existing base context is left untouched."""
+    if not jobs.get_job(job_id, workspace.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not jobs.cancel_job(job_id, workspace.id):
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return {"job_id": job_id, "status": "cancelling"}
+
+from pydantic import BaseModel
+from typing import Optional
+
+# --- Resumable Uploads ---
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+
+def _upload_or_404(state):
+    if state is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return state
+
+@router.post("/uploads/", status_code=201)
+async def init_upload(request: UploadInitRequest, workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Starts a chunked upload, or returns the pending upload of the same file
+    (name, size, sha256) so the client can resume from its `offset`. Without
+    `sha256` a new upload is always started.
+    """
     try:
-        # 1. Read all markdown files from extracted_docs
-        md_files = list(OUTPUT_DIR.glob("*.md"))
-        if not md_files:
-            raise HTTPException(status_code=404, detail="No extracted documents found to consolidate.")
-            
-        combined_text = ""
-        for md_file in md_files:
-            with open(md_file, "r", encoding="utf-8") as f:
-                content = f.read()
-                combined_text += f"\n\n--- START OF FILE: {md_file.name} ---\n\n"
-                combined_text += content
-                combined_text += f"\n\n--- END OF FILE: {md_file.name} ---\n\n"
-        
-        # 2. Call Gemini Consolidator
-        summary_md = generate_summary(combined_text)
-        
-        # 3. Save to consolidated_docs
-        output_file = CONSOLIDATED_DIR / "base_context.md"
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(summary_md)
-            
-        return {
-            "status": "success",
-            "message": "Consolidation complete.",
-            "file": str(output_file),
-            "content_preview": summary_md[:500]
-        }
+        return await run_in_threadpool(uploads.init_upload, request.filename, request.size, request.sha256, workspace.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, workspace: Workspace = Depends(resolve_workspace)):
+    """State of a pending upload; `offset` is the next byte the server expects."""
+    return _upload_or_404(await run_in_threadpool(uploads.get_upload, upload_id, workspace.id))
+
+@router.put("/uploads/{upload_id}")
+async def append_upload_chunk(upload_id: str, offset: int, request: Request,
+                              workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Appends the raw request body at `offset`. An optional `X-Chunk-Sha256`
+    header is checked before anything is written. A wrong offset returns 409
+    with the offset to resume from; a chunk over MAX_CHUNK_BYTES returns 413.
+    """
+    too_large = f"Chunks are limited to {uploads.MAX_CHUNK_BYTES} bytes."
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header.")
+    if content_length > uploads.MAX_CHUNK_BYTES:
+        raise HTTPException(status_code=413, detail=too_large)
+    # Chunked requests have no Content-Length, so the limit is also enforced while reading
+    data = bytearray()
+    async for block in request.stream():
+        data += block
+        if len(data) > uploads.MAX_CHUNK_BYTES:
+            raise HTTPException(status_code=413, detail=too_large)
+    data = bytes(data)
+    try:
+        with metrics.span("upload_write"):
+            return await run_in_threadpool(
+                uploads.append_chunk, upload_id, offset, data, request.headers.get("x-chunk-sha256"), workspace.id
+            )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except uploads.UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.offset})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, profile: str = AUTO_PROFILE, extract: bool = True,
+                          workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Verifies size and checksum, moves the file into uploaded_files/ and (unless
+    `extract=false`) extracts it like `/extract/`.
+    """
+    if profile != AUTO_PROFILE and profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile '{profile}'.")
+    try:
+        file_location = await run_in_threadpool(uploads.complete_upload, upload_id, workspace.id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not extract:
+        return {"filename": file_location.name, "status": "uploaded"}
+    return await extract_saved_file(file_location, profile, workspace)
 
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Discards a pending upload."""
+    if not await run_in_threadpool(uploads.abort_upload, upload_id, workspace.id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "status": "aborted"}
+
+# --- Base Context Sections ---
+from app import sections
+
+class SectionRegenerateRequest(BaseModel):
+    instructions: Optional[str] = None
+
+@router.get("/context/sections")
+async def list_context_sections(workspace: Workspace = Depends(resolve_workspace)):
+    """Lists the H2/H3 sections of the base context with their IDs."""
+    return sections.list_sections(workspace.id)
+
+@router.post("/context/sections/{section_id}/regenerate")
+async def regenerate_context_section(section_id: str, request: SectionRegenerateRequest = None,
+                                     workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Regenerates one section from its most relevant source excerpts and splices
+    it back into base_context.md; the rest of the file is left byte-identical.
+    """
+    instructions = request.instructions if request else None
+    try:
+        return await run_in_threadpool(sections.regenerate_section, section_id, instructions, workspace.id)
+    except (FileNotFoundError, LookupError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except sections.SectionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Provenance ---
+from app import provenance
+
+@router.get("/context/provenance")
+async def get_context_provenance(workspace: Workspace = Depends(resolve_workspace)):
+    """Source file spans behind every H2/H3 section of the base context."""
+    result = provenance.load(workspace.id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No provenance map. Consolidate or POST /context/provenance.")
+    return result
+
+@router.post("/context/provenance")
+async def rebuild_context_provenance(workspace: Workspace = Depends(resolve_workspace)):
+    """Rebuilds the provenance map (e.g. after manual edits of base_context.md)."""
+    try:
+        result = await run_in_threadpool(provenance.build, workspace.id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Base context not found. Generate it first.")
+    return {"sections": len(result["sections"]), "built_at": result["built_at"]}
+
+@router.get("/context/sections/{section_id}/sources")
+async def get_section_sources(section_id: str, workspace: Workspace = Depends(resolve_workspace)):
+    """Source spans (file, offsets, page, excerpt) one section was written from."""
+    entry = (provenance.load(workspace.id) or {}).get("sections", {}).get(section_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No provenance for section '{section_id}'.")
+    return {"section_id": section_id, **entry}
+
+# --- Highlights ---
+from typing import Any, Dict, List
+from app import viewer
+
+class HighlightOperation(BaseModel):
+    op: str
+    id: Optional[str] = None
+    text: Optional[str] = None
+    color: Optional[str] = None
+
+class HighlightBatchRequest(BaseModel):
+    operations: List[HighlightOperation]
+
+class HighlightSet(BaseModel):
+    format: Optional[str] = None
+    version: Optional[int] = None
+    highlights: List[Dict[str, Any]]
+
+@router.get("/highlights")
+async def list_highlights(workspace: Workspace = Depends(resolve_workspace)):
+    """All highlights of the base context."""
+    return viewer.load_highlights(workspace.id)
+
+@router.post("/highlights/batch")
+async def batch_highlights(request: HighlightBatchRequest, workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Applies many add/remove/recolor operations and saves once. A malformed
+    operation rejects the whole batch.
+    """
+    operations = [operation.model_dump(exclude_none=True) for operation in request.operations]
+    try:
+        return await run_in_threadpool(viewer.apply_highlight_operations, operations, workspace.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/highlights/export")
+async def export_highlight_set(workspace: Workspace = Depends(resolve_workspace)):
+    """The highlights as a portable highlight set (for `POST /highlights/import`)."""
+    return viewer.export_highlights(workspace.id)
+
+@router.post("/highlights/import")
+async def import_highlight_set(highlight_set: HighlightSet, replace: bool = False,
+                               workspace: Workspace = Depends(resolve_workspace)):
+    """Merges (or with `replace=true`, replaces) the highlights with an exported set."""
+    try:
+        return await run_in_threadpool(
+            viewer.import_highlights, highlight_set.model_dump(exclude_none=True), replace, workspace.id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Export ---
+from fastapi.responses import FileResponse
+from app import exporter
+
+@router.get("/export/{fmt}")
+async def export_base_context(fmt: str, highlights: bool = True, workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Downloads the base context as DOCX, EPUB or PDF. Only chapters changed
+    since the last export are re-rendered.
+    """
+    try:
+        result = await run_in_threadpool(exporter.export_book, fmt, workspace.id, highlights)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Base context not found. Generate it first.")
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return FileResponse(
+        result["path"],
+        media_type=result["media_type"],
+        filename=result["filename"],
+        headers={
+            "X-Export-Fragments-Rendered": str(result["rendered"]),
+            "X-Export-Fragments-Reused": str(result["reused"])
+        }
+    )
+
+# --- Search ---
+@router.get("/search")
+async def search_workspace(q: str, kind: str = None, limit: int = 20,
+                           workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Ranked full-text search over the base context, extracted sources and chat
+    history. `kind` is a comma-separated subset of context, source, message.
+    """
+    kinds = [k.strip() for k in kind.split(",") if k.strip()] if kind else search.KINDS
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100.")
+    try:
+        return await run_in_threadpool(search.search, q, kinds, limit, workspace.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # --- Chat Endpoint ---
-from pydantic import BaseModel
-from typing import Optional
 from app.chat import chat_with_data
 from app import history
 
@@ -98,33 +515,53 @@ class ChatRequest(BaseModel):
     prompt: str
     temperature: Optional[float] = 0.7
 
-@app.post("/sessions/")
-async def create_new_session():
+@router.post("/sessions/")
+async def create_new_session(workspace: Workspace = Depends(resolve_workspace)):
     """Creates a new chat session."""
     try:
-        session_id = history.create_session()
+        with metrics.span("history_write"):
+            session_id = history.create_session(workspace.id)
         return {"session_id": session_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sessions/")
-async def list_chat_sessions():
-    """Lists all available sessions."""
-    return history.list_sessions()
+@router.get("/sessions/")
+async def list_chat_sessions(response: Response, offset: int = 0, limit: int = None, q: str = None,
+                             workspace: Workspace = Depends(resolve_workspace)):
+    """
+    Lists sessions, newest first. `offset`/`limit` page through them and `q`
+    filters on the first prompt or ID; the total is in the X-Total-Count header.
+    """
+    if offset < 0 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1.")
+    sessions, total = history.page_sessions(workspace.id, offset, limit, q)
+    response.headers["X-Total-Count"] = str(total)
+    return sessions
+
+@router.get("/sessions/{session_id}/messages")
+async def get_chat_messages(session_id: str, before: int = None, limit: int = 20,
+                            workspace: Workspace = Depends(resolve_workspace)):
+    """The `limit` messages before index `before` (default: the latest ones)."""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be >= 1.")
+    window = history.get_messages(session_id, workspace.id, before, limit)
+    if window is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return window
 
-@app.get("/sessions/{session_id}")
-async def get_chat_session(session_id: str):
+@router.get("/sessions/{session_id}")
+async def get_chat_session(session_id: str, workspace: Workspace = Depends(resolve_workspace)):
     """Retrieves history for a specific session."""
-    session = history.get_session(session_id)
+    session = history.get_session(session_id, workspace.id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
 
-@app.post("/chat/{session_id}")
-async def chat_endpoint(session_id: str, request: ChatRequest):
+@router.post("/chat/{session_id}")
+async def chat_endpoint(session_id: str, request: ChatRequest, workspace: Workspace = Depends(resolve_workspace)):
     try:
         # 1. Load the Base Context
-        context_file = CONSOLIDATED_DIR / "base_context.md"
+        context_file = workspace.base_context_file
         
         if not context_file.exists():
             raise HTTPException(
@@ -132,11 +569,12 @@ async def chat_endpoint(session_id: str, request: ChatRequest):
                 detail="Base context not found. Please run /consolidate/ first."
             )
             
-        with open(context_file, "r", encoding="utf-8") as f:
-            context_content = f.read()
+        with metrics.span("context_read"):
+            context_content = cache.read_text(context_file)
             
         # 2. Get Session History
-        session_data = history.get_session(session_id)
+        with metrics.span("history_load"):
+            session_data = history.get_session(session_id, workspace.id)
         if not session_data:
             # Auto-create if not exists? No, let's be strict.
             raise HTTPException(status_code=404, detail="Session not found")
@@ -151,12 +589,17 @@ async def chat_endpoint(session_id: str, request: ChatRequest):
             temperature=request.temperature
         )
         
-        # 4. Save the interaction to history
-        history.save_message(session_id, "user", request.prompt)
-        history.save_message(session_id, "assistant", response_text)
+        # 4. Resolve [§section] markers to source citations
+        response_text, citations = provenance.resolve_citations(response_text, workspace.id)
+        
+        # 5. Save the interaction to history
+        with metrics.span("history_write"):
+            history.save_message(session_id, "user", request.prompt, workspace.id)
+            history.save_message(session_id, "assistant", response_text, workspace.id, citations)
         
         return {
-            "response": response_text
+            "response": response_text,
+            "citations": citations
         }
         
     except HTTPException as he:
@@ -166,6 +609,9 @@ async def chat_endpoint(session_id: str, request: ChatRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+app.include_router(router)
+app.include_router(router, prefix="/workspaces/{workspace_id}")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
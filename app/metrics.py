@@ -0,0 +1,193 @@
+"""
+Lightweight latency instrumentation for the book generation pipeline.
+Records per-stage timing spans and counters in-process, renders them in the
+Prometheus text exposition format and collects the spans of the current
+request so they can be returned in a Server-Timing header.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Tuple
+
+# Histogram bucket upper bounds (seconds). Conversions and LLM calls can take minutes.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_METRIC = "bookgen_stage_duration_seconds"
+
+HELP_TEXT = {
+    STAGE_METRIC: "Time spent in each pipeline stage.",
+    "bookgen_stage_errors_total": "Number of pipeline stages that raised an exception.",
+    "bookgen_llm_tokens_total": "Tokens sent to / received from the LLM.",
+    "bookgen_http_request_duration_seconds": "End-to-end HTTP request latency.",
+    "bookgen_extractions_total": "Documents converted, by docling pipeline profile.",
+    "bookgen_extraction_failures_total": "Extractions that failed in a worker process, by reason.",
+    "bookgen_worker_recycles_total": "Extraction worker processes replaced (job count, RSS or crash).",
+    "bookgen_export_fragments_total": "Export fragments rendered or reused from the fragment cache.",
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (metric, labels) -> {"buckets": [...], "sum": float, "count": int}
+_counters = {}    # (metric, labels) -> float
+
+# Spans recorded during the current request (None outside of a request)
+_request_spans: ContextVar = ContextVar("request_spans", default=None)
+
+
+def _labels_key(labels: dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(metric: str, seconds: float, **labels) -> None:
+    """
+    Record one observation in a histogram.
+
+    Args:
+        metric: Histogram name
+        seconds: Observed duration in seconds
+        **labels: Label values for this series
+    """
+    key = (metric, _labels_key(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            _histograms[key] = hist
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += seconds
+        hist["count"] += 1
+
+
+def inc(metric: str, amount: float = 1, **labels) -> None:
+    """
+    Increment a counter.
+
+    Args:
+        metric: Counter name (should end in `_total`)
+        amount: Value to add
+        **labels: Label values for this series
+    """
+    key = (metric, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time a block of code as a named pipeline stage.
+
+    The duration is added to the stage histogram and, when called while
+    handling an HTTP request, to that request's Server-Timing spans.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("bookgen_stage_errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(STAGE_METRIC, elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def replay_spans(spans: List[Tuple[str, float]]) -> None:
+    """
+    Record spans timed in another process (e.g. an extraction worker) as if
+    they had run here: stage histogram plus the current request's spans.
+    """
+    for stage, seconds in spans:
+        observe(STAGE_METRIC, seconds, stage=stage)
+    request_spans = _request_spans.get()
+    if request_spans is not None:
+        request_spans.extend(spans)
+
+
+def record_llm_usage(call: str, response) -> None:
+    """
+    Record input/output token counts reported by a Gemini response.
+
+    Args:
+        call: Logical name of the call (e.g. "consolidate", "chat")
+        response: Response object returned by `send_message`
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    input_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    inc("bookgen_llm_tokens_total", input_tokens, call=call, direction="input")
+    inc("bookgen_llm_tokens_total", output_tokens, call=call, direction="output")
+
+
+def start_request():
+    """Start collecting spans for the current request. Returns a reset token."""
+    return _request_spans.set([])
+
+
+def end_request(token) -> List[Tuple[str, float]]:
+    """Stop collecting spans for the current request and return them."""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing_header(spans: List[Tuple[str, float]], total: float = None) -> str:
+    """
+    Format spans as a Server-Timing header value (durations in milliseconds).
+
+    Repeated stages within one request are summed.
+    """
+    merged = {}
+    for stage, seconds in spans:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    seen = set()
+    for (metric, labels), hist in histograms:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {HELP_TEXT.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+        # observe() increments every bucket the value fits under, so counts are cumulative
+        for bound, count in zip(BUCKETS, hist["buckets"]):
+            lines.append(f"{metric}_bucket{_format_labels(labels, (('le', repr(bound)),))} {count}")
+        lines.append(f"{metric}_bucket{_format_labels(labels, (('le', '+Inf'),))} {hist['count']}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {hist['sum']}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {hist['count']}")
+
+    for (metric, labels), value in counters:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {HELP_TEXT.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
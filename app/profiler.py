@@ -0,0 +1,80 @@
+"""
+Opt-in rerun profiler for the Streamlit app.
+Every interaction reruns `streamlit_app.py` top to bottom; this module times the
+named sections of a single rerun and keeps a rolling history of recent reruns
+so regressions in the UI hot path are visible.
+"""
+
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Number of reruns kept in the rolling history
+HISTORY_SIZE = 25
+
+# Enable by default with BOOKGEN_PROFILE=1 (the sidebar toggle overrides it per session)
+PROFILE_BY_DEFAULT = os.getenv("BOOKGEN_PROFILE", "0") == "1"
+
+
+class RerunProfiler:
+    """
+    Collects section timings and payload sizes for one Streamlit rerun.
+
+    When disabled, `section()` and `record_size()` are no-ops so the
+    instrumentation can stay in the script permanently.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.timings = {}  # section name -> milliseconds
+        self.sizes = {}    # payload name -> bytes
+
+    @contextmanager
+    def section(self, name: str):
+        """Time a block of the script. Repeated sections are summed."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def record_size(self, name: str, payload) -> None:
+        """Record the UTF-8 size of a payload sent to the browser."""
+        if not self.enabled:
+            return
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self.sizes[name] = len(payload or b"")
+
+    def finish(self, history: deque) -> dict:
+        """
+        Close this rerun and append its summary to the rolling history.
+
+        Args:
+            history: Deque kept in `st.session_state` across reruns
+
+        Returns:
+            Summary dictionary for this rerun
+        """
+        summary = {
+            "timestamp": time.strftime("%H:%M:%S"),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+        for name, ms in self.timings.items():
+            summary[f"{name}_ms"] = round(ms, 1)
+        for name, size in self.sizes.items():
+            summary[f"{name}_kb"] = round(size / 1024, 1)
+
+        history.append(summary)
+        return summary
+
+
+def new_history() -> deque:
+    """Create an empty rolling history buffer."""
+    return deque(maxlen=HISTORY_SIZE)
@@ -0,0 +1,260 @@
+"""
+Provenance of the base context.
+Maps every H2/H3 section of `base_context.md` to the source file spans (file,
+character offsets and page) it was most likely written from. The map is built
+once per consolidation, and again after a section is regenerated, and is stored
+in `consolidated_docs/provenance.json`. Chat answers cite sections by ID and
+each citation is resolved with a single dictionary lookup.
+
+Matching is lexical: source paragraphs are scored against a section by the
+IDF-weighted terms they share (Arabic-normalised, see app.arabic).
+"""
+
+import math
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app import document_store
+from app import metrics
+from app import storage
+from app.arabic import normalize_arabic
+from app.consolidator import read_sources
+from app.sections import parse_sections
+from app.workspace import get_workspace
+
+SPANS_PER_SECTION = 5
+
+# Spans scoring below this fraction of the section's best span are dropped
+MIN_RELATIVE_SCORE = 0.3
+
+# Terms found in more than this fraction of source paragraphs carry no provenance signal
+MAX_DOCUMENT_FREQUENCY = 0.5
+
+EXCERPT_CHARS = 200
+
+# Paragraphs are matched to docling items (and their pages) by their first words
+PAGE_KEY_WORDS = 8
+MIN_PAGE_KEY_WORDS = 3
+
+CITATION_INSTRUCTION = """
+Headings of the base context end with a section ID such as `{#vertical-knowledge}`.
+After each statement taken from the base context, cite the section it came from as
+[§vertical-knowledge]. Only cite IDs that appear in the base context.
+"""
+
+_TERM = re.compile(r"\w{3,}")
+_WORD = re.compile(r"\w+")
+_CITATION = re.compile(r"\s*\[§([^\]]+)\]")
+
+_lock = threading.Lock()
+_loaded = {}  # path -> (mtime_ns, provenance map)
+
+
+def _terms(text: str) -> List[str]:
+    return _TERM.findall(normalize_arabic(text))
+
+
+def _paragraphs(content: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets of the paragraphs of a source file (blank and heading-only ones skipped)."""
+    spans = []
+    start = 0
+    for part in content.split("\n\n"):
+        stripped = part.strip()
+        if stripped and not (stripped.startswith("#") and "\n" not in stripped):
+            offset = start + part.index(stripped[0])
+            spans.append((offset, offset + len(stripped)))
+        start += len(part) + 2
+    return spans
+
+
+def _page_lookup(output_dir: Path, name: str) -> Dict[str, int]:
+    """Opening words of each docling item -> its page (empty without a cached document)."""
+    try:
+        items = document_store.text_pages(output_dir, Path(name).stem) or []
+    except Exception as e:
+        print(f"Provenance: no page numbers for {name}: {e}")
+        return {}
+    lookup = {}
+    for text, page in items:
+        words = _WORD.findall(normalize_arabic(text))
+        for length in range(MIN_PAGE_KEY_WORDS, min(PAGE_KEY_WORDS, len(words)) + 1):
+            lookup.setdefault(" ".join(words[:length]), page)
+    return lookup
+
+
+def _page_of(paragraph: str, lookup: Dict[str, int]) -> Optional[int]:
+    words = _WORD.findall(normalize_arabic(paragraph))
+    for length in range(min(PAGE_KEY_WORDS, len(words)), MIN_PAGE_KEY_WORDS - 1, -1):
+        page = lookup.get(" ".join(words[:length]))
+        if page is not None:
+            return page
+    return None
+
+
+def build_map(markdown: str, sources: List[Tuple[str, str]],
+              pages: Dict[str, Dict[str, int]] = None) -> Dict[str, Dict]:
+    """
+    Map the H2/H3 sections of a base context to source spans.
+
+    Args:
+        markdown: Base context text
+        sources: (file name, content) tuples of the extracted sources
+        pages: Optional file name -> page lookup from `_page_lookup`
+
+    Returns:
+        Section ID -> {"title", "level", "sources"}; each source span is
+        {"file", "start", "end", "page", "excerpt", "score"}, in file order
+    """
+    pages = pages or {}
+    paragraphs = []  # (file name, start, end)
+    postings = defaultdict(list)
+    for name, content in sources:
+        for start, end in _paragraphs(content):
+            index = len(paragraphs)
+            paragraphs.append((name, start, end))
+            for term in set(_terms(content[start:end])):
+                postings[term].append(index)
+
+    total = len(paragraphs)
+    idf = {
+        term: math.log(total / len(indexes))
+        for term, indexes in postings.items()
+        if len(indexes) <= MAX_DOCUMENT_FREQUENCY * total
+    }
+    weights = [0.0] * total
+    for term, weight in idf.items():
+        for index in postings[term]:
+            weights[index] += weight
+
+    contents = dict(sources)
+    file_order = {name: i for i, (name, _) in enumerate(sources)}
+    sections = {}
+    for section in parse_sections(markdown):
+        scores = defaultdict(float)
+        for term in set(_terms(markdown[section["start"]:section["end"]])):
+            weight = idf.get(term)
+            if weight:
+                for index in postings[term]:
+                    scores[index] += weight
+
+        ranked = sorted(
+            ((score / math.sqrt(weights[index]), index) for index, score in scores.items()),
+            reverse=True
+        )[:SPANS_PER_SECTION]
+        best = ranked[0][0] if ranked else 0
+        spans = []
+        for score, index in ranked:
+            if score < MIN_RELATIVE_SCORE * best:
+                break
+            name, start, end = paragraphs[index]
+            text = contents[name][start:end]
+            spans.append({
+                "file": name,
+                "start": start,
+                "end": end,
+                "page": _page_of(text, pages.get(name, {})),
+                "excerpt": text[:EXCERPT_CHARS],
+                "score": round(score, 3)
+            })
+        spans.sort(key=lambda s: (file_order[s["file"]], s["start"]))
+
+        sections[section["id"]] = {"title": section["title"], "level": section["level"], "sources": spans}
+    return sections
+
+
+def build(workspace_id: str = None) -> Dict:
+    """
+    Build and store the provenance map of a workspace's base context.
+
+    Returns:
+        {"context_sha1", "built_at", "sections"}
+
+    Raises:
+        FileNotFoundError: If there is no base context
+    """
+    workspace = get_workspace(workspace_id)
+    markdown = storage.read_text(workspace.base_context_file)
+
+    with metrics.span("provenance"):
+        sources = read_sources(sorted(workspace.output_dir.glob("*.md")))
+        pages = {name: _page_lookup(workspace.output_dir, name) for name, _ in sources}
+        provenance = {
+            "context_sha1": sha1(markdown.encode("utf-8")).hexdigest(),
+            "built_at": datetime.now().isoformat(),
+            "sections": build_map(markdown, sources, pages)
+        }
+    storage.write_json(workspace.provenance_file, provenance)
+    return provenance
+
+
+def load(workspace_id: str = None) -> Optional[Dict]:
+    """The stored provenance map (memoised until the file changes), or None."""
+    path = get_workspace(workspace_id).provenance_file
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    key = str(path.resolve())
+    with _lock:
+        cached = _loaded.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    provenance = storage.read_json(path)
+    with _lock:
+        _loaded[key] = (mtime, provenance)
+    return provenance
+
+
+def annotate_context(markdown: str) -> str:
+    """Append `{#section-id}` to every H2/H3 heading so a model can cite sections."""
+    parts = []
+    cursor = 0
+    for section in parse_sections(markdown):
+        line_end = markdown.find("\n", section["start"])
+        line_end = len(markdown) if line_end == -1 else line_end
+        parts.append(markdown[cursor:line_end].rstrip())
+        parts.append(f" {{#{section['id']}}}")
+        cursor = line_end
+    parts.append(markdown[cursor:])
+    return "".join(parts)
+
+
+def resolve_citations(answer: str, workspace_id: str = None) -> Tuple[str, List[Dict]]:
+    """
+    Replace `[§section-id]` markers in a chat answer with numbered references.
+
+    Args:
+        answer: Model answer
+        workspace_id: Workspace whose provenance map resolves the IDs
+
+    Returns:
+        (answer with `[1]`-style references, citations). Each citation is
+        {"number", "section_id", "title", "sources"}. Markers naming unknown
+        sections are removed.
+    """
+    sections = (load(workspace_id) or {}).get("sections", {})
+    citations = {}
+
+    def replace(match):
+        references = []
+        for section_id in match.group(1).split(","):
+            section_id = section_id.strip().lstrip("§").strip()
+            entry = sections.get(section_id)
+            if entry is None:
+                continue
+            if section_id not in citations:
+                citations[section_id] = {
+                    "number": len(citations) + 1,
+                    "section_id": section_id,
+                    "title": entry["title"],
+                    "sources": entry["sources"]
+                }
+            references.append(f"[{citations[section_id]['number']}]")
+        return "".join(references)
+
+    return _CITATION.sub(replace, answer), list(citations.values())
@@ -6,6 +6,8 @@ Like Microsoft Word - select text, click color, see it highlighted immediately.
 import streamlit.components.v1 as components
 import json
 
+from app.viewer import highlight_payload
+
 
 def rich_text_editor_component(content: str, highlights: list, height: int = 500):
     """
@@ -20,19 +22,12 @@ def rich_text_editor_component(content: str, highlights: list, height: int = 500
         User actions via component value
     """
     
-    # Apply highlights to content for initial display
-    highlighted_content = content
-    for hl in sorted(highlights, key=lambda h: len(h.get("text", "")), reverse=True):
-        text = hl.get("text", "")
-        color = hl.get("color", "#ffeb3b")
-        if text:
-            import re
-            escaped = re.escape(text)
-            replacement = f'<mark style="background-color: {color}; padding: 2px 0;">{text}</mark>'
-            highlighted_content = re.sub(escaped, replacement, highlighted_content)
-    
-    # Convert markdown to HTML with line breaks
-    html_content = highlighted_content.replace('\n', '<br/>')
+    # Only the content and the highlight spans are shipped; the iframe builds the
+    # marked-up DOM itself (spans come from the shared, memoised engine in app.viewer)
+    payload = json.dumps(
+        {"content": content, **highlight_payload(content, highlights)},
+        ensure_ascii=False
+    ).replace("</", "<\\/")
     
     html_code = f"""
     <!DOCTYPE html>
@@ -158,7 +153,7 @@ def rich_text_editor_component(content: str, highlights: list, height: int = 500
                 <button class="action-btn remove" id="removeBtn" disabled>🗑️ Remove Highlight</button>
                 <span class="selection-info" id="selectionInfo"></span>
             </div>
-            <div id="editor" contenteditable="true">{html_content}</div>
+            <div id="editor" contenteditable="true"></div>
         </div>
         
         <script>
@@ -171,6 +166,30 @@ def rich_text_editor_component(content: str, highlights: list, height: int = 500
             let selectedColor = '#ffeb3b';
             let currentRange = null;
             
+            // Initial render: text nodes and <br> for the content, <mark> for each span
+            const payload = {payload};
+            (function render() {{
+                const chars = Array.from(payload.content);  // offsets are code points
+                const fragment = document.createDocumentFragment();
+                const appendText = (text) => {{
+                    text.split('\\n').forEach((line, i) => {{
+                        if (i) fragment.appendChild(document.createElement('br'));
+                        if (line) fragment.appendChild(document.createTextNode(line));
+                    }});
+                }};
+                let position = 0;
+                for (const [start, end, color, style] of payload.spans) {{
+                    appendText(chars.slice(position, start).join(''));
+                    const mark = document.createElement('mark');
+                    mark.setAttribute('style', `background-color: ${{color}}; ${{payload.styles[style]}}`);
+                    mark.textContent = chars.slice(start, end).join('');
+                    fragment.appendChild(mark);
+                    position = end;
+                }}
+                appendText(chars.slice(position).join(''));
+                editor.appendChild(fragment);
+            }})();
+            
             // Color selection
             colorBtns.forEach(btn => {{
                 btn.addEventListener('click', () => {{
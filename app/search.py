@@ -0,0 +1,340 @@
+"""
+Full-text search over a workspace.
+A persistent SQLite FTS5 index covers the sections of `base_context.md`, the
+extracted source files and every chat message. It is updated incrementally:
+extraction, consolidation, section regeneration, edits and new chat messages
+re-index only the document they touched, and each search first re-indexes
+any file whose size or mtime changed since it was indexed (so edits made
+outside the app are picked up too).
+
+Text is indexed Arabic-normalised (app.arabic) and results are ranked with
+BM25; snippets are cut from the original text.
+"""
+
+import re
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app import metrics
+from app import storage
+from app.arabic import find_all, normalize_arabic
+from app.sections import parse_sections
+from app.workspace import get_workspace
+
+KINDS = ("context", "source", "message")
+
+# Long sections and source files are indexed in paragraph-aligned chunks of about this size
+CHUNK_CHARS = 2000
+
+# BM25 column weights: a match in a title counts this many times more than in the body
+TITLE_WEIGHT = 4.0
+
+SNIPPET_CHARS = 160
+MATCH_MARK = "**"
+
+_WORD = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    entries INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(
+    title_terms, body_terms,
+    kind UNINDEXED, doc UNINDEXED, ref UNINDEXED, position UNINDEXED, title UNINDEXED, body UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def _connect(workspace_id: str = None) -> sqlite3.Connection:
+    index_file = get_workspace(workspace_id).search_index_file
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(index_file, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _signature(path: Path) -> Optional[str]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _chunks(text: str, base: int = 0) -> List[Tuple[int, str]]:
+    """Split text into (offset, chunk) pieces of about CHUNK_CHARS on paragraph boundaries."""
+    chunks = []
+    start = end = 0
+    while end < len(text):
+        next_break = text.find("\n\n", end + 1)
+        next_end = len(text) if next_break == -1 else next_break
+        if next_end - start > CHUNK_CHARS and end > start:
+            chunks.append((base + start, text[start:end]))
+            start = end
+        end = next_end
+    if text[start:].strip():
+        chunks.append((base + start, text[start:]))
+    return [
+        (offset + len(chunk) - len(chunk.lstrip()), chunk.strip())
+        for offset, chunk in chunks if chunk.strip()
+    ]
+
+
+def _context_entries(markdown: str) -> List[Tuple[str, int, str, str]]:
+    """(ref, position, title, body) per heading-delimited chunk of the base context."""
+    headings = parse_sections(markdown, levels=(1, 2, 3, 4, 5, 6))
+    linkable = parse_sections(markdown)  # H2/H3: the IDs the section API accepts
+    bounds = [0] + [h["start"] for h in headings] + [len(markdown)]
+    entries = []
+    for index in range(len(bounds) - 1):
+        start, end = bounds[index], bounds[index + 1]
+        heading = headings[index - 1] if index else None
+        title = " › ".join(heading["path"] + [heading["title"]]) if heading else ""
+        ref = next((s["id"] for s in reversed(linkable) if s["start"] <= start < s["end"]), "")
+        for offset, chunk in _chunks(markdown[start:end], start):
+            entries.append((ref, offset, title, chunk))
+    return entries
+
+
+def _source_entries(name: str, content: str) -> List[Tuple[str, int, str, str]]:
+    headings = parse_sections(content, levels=(1, 2, 3, 4, 5, 6))
+    entries = []
+    for offset, chunk in _chunks(content):
+        heading = next((h for h in reversed(headings) if h["start"] <= offset), None)
+        entries.append((name, offset, heading["title"] if heading else name, chunk))
+    return entries
+
+
+def _message_entry(session_id: str, index: int, message: Dict) -> Tuple[str, int, str, str]:
+    return (session_id, index, message.get("role", ""), message.get("content", ""))
+
+
+def _replace_document(conn: sqlite3.Connection, doc: str, kind: str, signature: str,
+                      entries: Sequence[Tuple[str, int, str, str]]) -> None:
+    conn.execute("DELETE FROM entries WHERE doc = ?", (doc,))
+    _insert_entries(conn, doc, kind, entries)
+    conn.execute(
+        "INSERT OR REPLACE INTO documents (doc, kind, signature, entries) VALUES (?, ?, ?, ?)",
+        (doc, kind, signature, len(entries))
+    )
+
+
+def _insert_entries(conn: sqlite3.Connection, doc: str, kind: str,
+                    entries: Sequence[Tuple[str, int, str, str]]) -> None:
+    conn.executemany(
+        "INSERT INTO entries (title_terms, body_terms, kind, doc, ref, position, title, body) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (normalize_arabic(title), normalize_arabic(body), kind, doc, ref, position, title, body)
+            for ref, position, title, body in entries
+        ]
+    )
+
+
+def _remove_document(conn: sqlite3.Connection, doc: str) -> None:
+    conn.execute("DELETE FROM entries WHERE doc = ?", (doc,))
+    conn.execute("DELETE FROM documents WHERE doc = ?", (doc,))
+
+
+def _read_entries(kind: str, path: Path) -> List[Tuple[str, int, str, str]]:
+    if kind == "message":
+        session = storage.read_json(path)
+        return [_message_entry(path.stem, i, m) for i, m in enumerate(session.get("messages", []))]
+    text = storage.read_text(path)
+    return _context_entries(text) if kind == "context" else _source_entries(path.name, text)
+
+
+def _sync_file(conn: sqlite3.Connection, doc: str, kind: str, path: Path, force: bool = False) -> bool:
+    """Re-index one file if it changed (or always with `force`). Returns True if re-indexed."""
+    signature = _signature(path)
+    if signature is None:
+        _remove_document(conn, doc)
+        return False
+    if not force:
+        row = conn.execute("SELECT signature FROM documents WHERE doc = ?", (doc,)).fetchone()
+        if row and row[0] == signature:
+            return False
+    _replace_document(conn, doc, kind, signature, _read_entries(kind, path))
+    return True
+
+
+def _tracked_files(workspace_id: str = None) -> Dict[str, Tuple[str, Path]]:
+    """doc key -> (kind, path) of every file that belongs in the index."""
+    workspace = get_workspace(workspace_id)
+    files = {"context": ("context", workspace.base_context_file)}
+    if workspace.output_dir.exists():
+        for path in workspace.output_dir.glob("*.md"):
+            files[f"source:{path.name}"] = ("source", path)
+    if workspace.sessions_dir.exists():
+        for path in workspace.sessions_dir.glob("*.json"):
+            if not path.name.startswith("_"):
+                files[f"session:{path.stem}"] = ("message", path)
+    return files
+
+
+def refresh(workspace_id: str = None) -> int:
+    """
+    Bring the index up to date with the workspace files.
+
+    Only files whose size or mtime changed are re-read, so this costs one
+    `stat` per file when nothing changed.
+
+    Returns:
+        Number of documents re-indexed
+    """
+    files = _tracked_files(workspace_id)
+    reindexed = 0
+    with closing(_connect(workspace_id)) as conn, conn:
+        indexed = {doc for (doc,) in conn.execute("SELECT doc FROM documents")}
+        for doc in indexed - set(files):
+            _remove_document(conn, doc)
+        for doc, (kind, path) in files.items():
+            reindexed += _sync_file(conn, doc, kind, path)
+    return reindexed
+
+
+def _safely(action: str, func, *args) -> None:
+    # Index updates must never fail the operation that triggered them; the next
+    # search re-indexes whatever was missed
+    try:
+        func(*args)
+    except Exception as e:
+        print(f"Search index: could not {action}: {e}")
+
+
+def index_base_context(workspace_id: str = None) -> None:
+    """Re-index `base_context.md` (after consolidation, section regeneration or an edit)."""
+    def update():
+        with closing(_connect(workspace_id)) as conn, conn:
+            _sync_file(conn, "context", "context", get_workspace(workspace_id).base_context_file, force=True)
+    _safely("index the base context", update)
+
+
+def index_source(md_path: Path, workspace_id: str = None) -> None:
+    """Re-index one extracted source file."""
+    md_path = Path(md_path)
+    def update():
+        with closing(_connect(workspace_id)) as conn, conn:
+            _sync_file(conn, f"source:{md_path.name}", "source", md_path, force=True)
+    _safely(f"index {md_path.name}", update)
+
+
+def index_message(session_id: str, index: int, message: Dict, workspace_id: str = None) -> None:
+    """
+    Add one chat message to the index after it was appended to its session file.
+
+    Appends a single entry when the session is otherwise up to date and
+    re-indexes the whole session if it is not.
+    """
+    session_file = get_workspace(workspace_id).sessions_dir / f"{session_id}.json"
+    doc = f"session:{session_id}"
+    def update():
+        with closing(_connect(workspace_id)) as conn, conn:
+            row = conn.execute("SELECT entries FROM documents WHERE doc = ?", (doc,)).fetchone()
+            if (row[0] if row else 0) != index:
+                _sync_file(conn, doc, "message", session_file, force=True)
+                return
+            _insert_entries(conn, doc, "message", [_message_entry(session_id, index, message)])
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (doc, kind, signature, entries) VALUES (?, ?, ?, ?)",
+                (doc, "message", _signature(session_file) or "", index + 1)
+            )
+    _safely(f"index a message of session {session_id}", update)
+
+
+def _match_expression(query: str) -> str:
+    """FTS5 query matching every word; the last word also matches as a prefix."""
+    words = _WORD.findall(normalize_arabic(query))
+    terms = [f'"{word}"' for word in words]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def snippet(text: str, query: str, width: int = SNIPPET_CHARS) -> str:
+    """
+    Excerpt of `text` around the first query match, with every match in the
+    excerpt wrapped in MATCH_MARK. Matching ignores diacritics and letter variants.
+    """
+    spans = sorted(span for word in _WORD.findall(normalize_arabic(query)) for span in find_all(text, word))
+    if not spans:
+        excerpt = text[:width]
+        return excerpt + ("…" if len(text) > width else "")
+
+    start = max(0, spans[0][0] - width // 3)
+    end = min(len(text), start + width)
+    parts = []
+    cursor = start
+    for match_start, match_end in spans:
+        if match_start < cursor or match_end > end:
+            continue
+        parts.append(text[cursor:match_start])
+        parts.append(f"{MATCH_MARK}{text[match_start:match_end]}{MATCH_MARK}")
+        cursor = match_end
+    parts.append(text[cursor:end])
+    excerpt = " ".join("".join(parts).split())
+    return ("…" if start else "") + excerpt + ("…" if end < len(text) else "")
+
+
+def search(query: str, kinds: Sequence[str] = KINDS, limit: int = 20, workspace_id: str = None) -> Dict:
+    """
+    Ranked full-text search.
+
+    Args:
+        query: Words to find (all must match; the last one may be a prefix)
+        kinds: Any of "context" (base context sections), "source" (extracted
+            files) and "message" (chat history)
+        limit: Maximum number of results
+        workspace_id: Workspace to search (default workspace if None)
+
+    Returns:
+        {"query", "results", "took_ms"}; each result has `kind`, `ref` (section
+        ID, source file name or session ID), `position` (character offset, or
+        message index), `title`, `snippet` and `score` (lower is better)
+
+    Raises:
+        ValueError: If `kinds` contains an unknown kind
+    """
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise ValueError(f"Unknown search kind(s): {', '.join(sorted(unknown))}.")
+
+    started = time.perf_counter()
+    expression = _match_expression(query)
+    results = []
+    if expression and kinds:
+        with metrics.span("search"):
+            refresh(workspace_id)
+            placeholders = ", ".join("?" for _ in kinds)
+            with closing(_connect(workspace_id)) as conn:
+                rows = conn.execute(
+                    f"SELECT kind, ref, position, title, body, bm25(entries, ?, 1.0) AS score "
+                    f"FROM entries WHERE entries MATCH ? AND kind IN ({placeholders}) "
+                    f"ORDER BY score LIMIT ?",
+                    (TITLE_WEIGHT, expression, *kinds, limit)
+                ).fetchall()
+            results = [
+                {
+                    "kind": kind,
+                    "ref": ref,
+                    "position": position,
+                    "title": title,
+                    "snippet": snippet(body, query),
+                    "score": round(score, 4)
+                }
+                for kind, ref, position, title, body, score in rows
+            ]
+
+    return {
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
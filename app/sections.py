@@ -0,0 +1,267 @@
+"""
+Section-level editing of the base context.
+Parses the H2/H3 sections of `base_context.md`, gathers the source excerpts
+most relevant to one section and splices a regenerated version back in place,
+leaving every other byte of the book (and the highlights on it) untouched.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from app import budget
+from app import jobs
+from app import metrics
+from app import storage
+from app import viewer
+from app.arabic import normalize_arabic
+from app.consolidator import generate_section, read_sources
+from app.workspace import get_workspace
+
+SECTION_LEVELS = (2, 3)
+
+# Source excerpts sent with a section regeneration
+SECTION_SOURCE_TOKENS = int(os.getenv("BOOKGEN_SECTION_SOURCE_TOKENS", "60000"))
+
+# Title words count this many times more than body words when ranking excerpts
+TITLE_WEIGHT = 3
+
+_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_WORD = re.compile(r"\w{3,}")
+WRAPPING_FENCE = re.compile(r"^```(?:markdown|md)?\s*\n(.*)\n```\s*$", re.DOTALL)
+
+
+class SectionConflict(Exception):
+    """The base context is being rewritten by something else."""
+
+
+def slugify(title: str) -> str:
+    """URL-safe section ID from a heading (keeps non-Latin letters)."""
+    slug = re.sub(r"[^\w]+", "-", title.casefold()).strip("-_")
+    return slug or "section"
+
+
+def parse_sections(markdown: str, levels: Tuple[int, ...] = SECTION_LEVELS) -> List[Dict]:
+    """
+    Locate the headed sections of a markdown document.
+
+    A section runs from its heading line to the next heading of the same or a
+    higher level (or the end of the document), so an H2 section contains its
+    H3 subsections. Headings inside fenced code blocks are ignored.
+
+    Args:
+        markdown: Document text
+        levels: Heading levels to report
+
+    Returns:
+        List of {"id", "title", "level", "path", "start", "end"} in document
+        order; `path` holds the titles of the enclosing headings and
+        `start`/`end` are character offsets
+    """
+    headings = []  # (offset, level, title)
+    offset = 0
+    in_fence = False
+    for line in markdown.splitlines(keepends=True):
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence:
+            match = _HEADING.match(line.rstrip("\r\n"))
+            if match:
+                headings.append((offset, len(match.group(1)), match.group(2)))
+        offset += len(line)
+
+    sections = []
+    seen = {}
+    stack = []  # (level, title) of the enclosing headings
+    for index, (start, level, title) in enumerate(headings):
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        path = [t for _, t in stack]
+        stack.append((level, title))
+        if level not in levels:
+            continue
+
+        end = next((o for o, l, _ in headings[index + 1:] if l <= level), len(markdown))
+        slug = slugify(title)
+        seen[slug] = seen.get(slug, 0) + 1
+        sections.append({
+            "id": slug if seen[slug] == 1 else f"{slug}-{seen[slug]}",
+            "title": title,
+            "level": level,
+            "path": path,
+            "start": start,
+            "end": end
+        })
+    return sections
+
+
+def find_section(markdown: str, section_id: str) -> Optional[Dict]:
+    """Return the section with this ID, or None."""
+    return next((s for s in parse_sections(markdown) if s["id"] == section_id), None)
+
+
+def strip_wrapping_fence(markdown: str) -> str:
+    """Strip surrounding whitespace and a ```markdown fence wrapping the whole text."""
+    markdown = markdown.strip()
+    fenced = WRAPPING_FENCE.match(markdown)
+    return fenced.group(1).strip() if fenced else markdown
+
+
+def splice_section(markdown: str, section: Dict, new_section: str) -> str:
+    """
+    Replace one section of `markdown`.
+
+    The original heading line and the whitespace separating the section from
+    the next one are kept, so only the section body changes. A heading or a
+    ```markdown fence the model wrapped its answer in is stripped. The new body
+    uses the heading line's line ending, so CRLF documents stay CRLF.
+    """
+    original = markdown[section["start"]:section["end"]]
+    heading_line = original.split("\n", 1)[0]
+    eol = "\r\n" if heading_line.endswith("\r") else "\n"
+    heading_line = heading_line.rstrip("\r")
+    trailing = original[len(original.rstrip()):]
+
+    body = strip_wrapping_fence(new_section.replace("\r\n", "\n"))
+    first_line, _, rest = body.partition("\n")
+    if _HEADING.match(first_line):
+        body = rest.strip()
+
+    replacement = f"{heading_line}\n\n{body}".replace("\n", eol) if body else heading_line
+    return markdown[:section["start"]] + replacement + trailing + markdown[section["end"]:]
+
+
+def _terms(text: str) -> List[str]:
+    return _WORD.findall(normalize_arabic(text))
+
+
+def relevant_excerpts(title: str, text: str, sources: List[Tuple[str, str]],
+                      max_tokens: int = SECTION_SOURCE_TOKENS) -> Tuple[str, List[str]]:
+    """
+    Pick the source paragraphs that best match a section.
+
+    Paragraphs are ranked by word overlap with the section (title words
+    weighted by TITLE_WEIGHT) and admitted best first until `max_tokens`;
+    the chosen paragraphs keep their original order within each file.
+
+    Args:
+        title: Section heading
+        text: Current section markdown
+        sources: (file name, content) tuples of the extracted sources
+        max_tokens: Token budget for the excerpts
+
+    Returns:
+        (excerpts wrapped in START/END OF FILE markers, names of the files used)
+    """
+    weights = {term: 1 for term in _terms(text)}
+    weights.update({term: TITLE_WEIGHT for term in _terms(title)})
+
+    candidates = []  # (score, file index, paragraph index, file name, paragraph)
+    for file_index, (name, content) in enumerate(sources):
+        paragraphs = [p for p in content.split("\n\n") if p.strip()]
+        for paragraph_index, paragraph in enumerate(paragraphs):
+            terms = set(_terms(paragraph))
+            score = sum(weights.get(term, 0) for term in terms)
+            if score:
+                # Normalise so long paragraphs do not win on length alone
+                candidates.append((score / len(terms) ** 0.5, file_index, paragraph_index, name, paragraph))
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    chosen = []
+    used = 0
+    for candidate in candidates:
+        cost = budget.estimate_tokens(candidate[4]) + 1
+        if used + cost > max_tokens:
+            continue
+        chosen.append(candidate)
+        used += cost
+
+    chosen.sort(key=lambda c: (c[1], c[2]))
+    by_file = {}
+    for _, _, _, name, paragraph in chosen:
+        by_file.setdefault(name, []).append(paragraph)
+
+    return budget.combine_sources((name, "\n\n".join(paragraphs)) for name, paragraphs in by_file.items()), list(by_file)
+
+
+def list_sections(workspace_id: str = None) -> List[Dict]:
+    """Sections of the workspace's base context (empty if there is none)."""
+    context_file = get_workspace(workspace_id).base_context_file
+    if not context_file.exists():
+        return []
+    markdown = storage.read_text(context_file)
+    return [
+        {**section, "chars": section["end"] - section["start"]}
+        for section in parse_sections(markdown)
+    ]
+
+
+def regenerate_section(section_id: str, instructions: str = None, workspace_id: str = None) -> Dict:
+    """
+    Regenerate one H2/H3 section of the base context from its relevant sources.
+
+    Args:
+        section_id: ID from `list_sections`
+        instructions: Optional guidance for the rewrite
+        workspace_id: Workspace to edit (default workspace if None)
+
+    Returns:
+        Dictionary with the new section `markdown`, the `source_files` used
+        and the IDs of highlights whose text no longer appears (`orphaned_highlights`)
+
+    Raises:
+        FileNotFoundError: If there is no base context or no extracted sources
+        LookupError: If the section does not exist
+        SectionConflict: If a consolidation is running or the file changed meanwhile
+    """
+    workspace = get_workspace(workspace_id)
+    if any(job["status"] in jobs.ACTIVE_STATUSES for job in jobs.list_jobs(workspace.id)):
+        raise SectionConflict("A consolidation is running; wait for it to finish.")
+
+    context_file = workspace.base_context_file
+    if not context_file.exists():
+        raise FileNotFoundError("Base context not found. Generate it first.")
+    # Read untranslated so the splice keeps the file's line endings
+    markdown = storage.read_text(context_file, newline="")
+
+    section = find_section(markdown, section_id)
+    if section is None:
+        raise LookupError(f"Section '{section_id}' not found.")
+
+    md_files = sorted(workspace.output_dir.glob("*.md"))
+    if not md_files:
+        raise FileNotFoundError("No extracted documents found.")
+
+    section_text = markdown[section["start"]:section["end"]]
+    with metrics.span("section_sources"):
+        source_text, source_files = relevant_excerpts(section["title"], section_text, read_sources(md_files))
+    outline = "\n".join(f"{'#' * s['level']} {s['title']}" for s in parse_sections(markdown))
+
+    new_section = generate_section(section_text, section["level"], outline, source_text, instructions)
+
+    if storage.read_text(context_file, newline="") != markdown:
+        raise SectionConflict("base_context.md changed while the section was regenerated; try again.")
+
+    updated = splice_section(markdown, section, new_section)
+    storage.write_atomic(context_file, updated, compress=True)
+
+    from app import provenance, search
+    search.index_base_context(workspace.id)
+    try:
+        provenance.build(workspace.id)
+    except Exception as e:
+        print(f"Could not rebuild the provenance map: {e}")
+
+    new_end = section["end"] + len(updated) - len(markdown)
+    highlights = viewer.load_highlights(workspace.id).get("highlights", [])
+    orphaned = [h["id"] for h in highlights if h["text"] in section_text and h["text"] not in updated]
+
+    return {
+        "section_id": section["id"],
+        "title": section["title"],
+        "level": section["level"],
+        "markdown": updated[section["start"]:new_end],
+        "source_files": source_files,
+        "orphaned_highlights": orphaned
+    }
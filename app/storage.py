@@ -0,0 +1,272 @@
+"""
+Compressed artifact storage.
+Extracted markdown (`extracted_docs/*.md`), chat sessions and the
+consolidated files can be stored zstd- or gzip-compressed. Compression is
+chosen with BOOKGEN_COMPRESSION ("none" by default, "gzip" or "zstd") and
+applies to files written from then on.
+
+Files keep their names, so globs and path-based lookups work unchanged.
+Readers detect the format from the first bytes, which means plain, gzip and
+zstd files can be mixed in one directory and switching the setting never
+makes existing data unreadable. zstd needs the
+optional `zstandard` package; without it, "zstd" falls back to gzip.
+
+    python -m app.storage compress --workspace tot-course
+    python -m app.storage decompress
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, BinaryIO, List, TextIO
+
+from app.workspace import get_workspace
+
+CODECS = ("none", "gzip", "zstd")
+
+COMPRESSION = os.getenv("BOOKGEN_COMPRESSION", "none").lower()
+
+GZIP_LEVEL = int(os.getenv("BOOKGEN_GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("BOOKGEN_ZSTD_LEVEL", "3"))
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_fallback_reported = False
+
+
+def _zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def codec() -> str:
+    """The configured compression, after falling back from zstd to gzip if `zstandard` is missing."""
+    global _fallback_reported
+    if COMPRESSION not in CODECS:
+        raise ValueError(f"Unknown BOOKGEN_COMPRESSION '{COMPRESSION}'. Use one of: {', '.join(CODECS)}.")
+    if COMPRESSION == "zstd" and _zstandard() is None:
+        if not _fallback_reported:
+            print("Storage: 'zstandard' is not installed; compressing with gzip instead.")
+            _fallback_reported = True
+        return "gzip"
+    return COMPRESSION
+
+
+def detect(path: Path) -> str:
+    """Codec a file was written with ("none", "gzip" or "zstd")."""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head == ZSTD_MAGIC:
+        return "zstd"
+    return "none"
+
+
+def open_binary(path: Path) -> BinaryIO:
+    """
+    Open a stored file for streaming reads of its decompressed bytes.
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        RuntimeError: If it is zstd-compressed and `zstandard` is not installed
+    """
+    kind = detect(path)
+    if kind == "gzip":
+        return gzip.open(path, "rb")
+    if kind == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed; install 'zstandard' to read it.")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def open_text(path: Path, newline: str = None) -> TextIO:
+    """
+    Open a stored UTF-8 file for streaming text reads, whatever its compression.
+
+    `newline` works as for `open`: pass "" to keep line endings untranslated.
+    """
+    if detect(path) == "none":
+        return open(path, "r", encoding="utf-8", newline=newline)
+    return io.TextIOWrapper(open_binary(path), encoding="utf-8", newline=newline)
+
+
+def read_text(path: Path, newline: str = None) -> str:
+    """Contents of a stored UTF-8 file (see `open_text` for `newline`)."""
+    with open_text(path, newline) as f:
+        return f.read()
+
+
+def read_bytes(path: Path) -> bytes:
+    """Decompressed bytes of a stored file."""
+    with open_binary(path) as f:
+        return f.read()
+
+
+def read_json(path: Path) -> Any:
+    """Parsed contents of a stored JSON file."""
+    with open_text(path) as f:
+        return json.load(f)
+
+
+def compress(data: bytes, kind: str) -> bytes:
+    """Encode bytes with a codec (no-op for "none")."""
+    if kind == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if kind == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def write_bytes(path: Path, data: bytes, kind: str = None) -> None:
+    """
+    Atomically write bytes, compressed with `kind` (default: the configured codec).
+
+    Written to a temp file in the same directory, fsynced, then renamed over the target.
+    """
+    kind = codec() if kind is None else kind
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(compress(data, kind))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+
+def write_text(path: Path, content: str, kind: str = None) -> None:
+    """Atomically write UTF-8 text, compressed with `kind` (default: the configured codec)."""
+    write_bytes(path, content.encode("utf-8"), kind)
+
+
+def write_json(path: Path, data: Any, kind: str = None) -> None:
+    """
+    Atomically write JSON. Uncompressed files stay pretty-printed; compressed
+    ones are written compact, since nobody reads them by eye.
+    """
+    kind = codec() if kind is None else kind
+    if kind == "none":
+        content = json.dumps(data, indent=2, ensure_ascii=False)
+    else:
+        content = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    write_text(path, content, kind)
+
+
+def write_atomic(path: Path, content: str, compress: bool = False) -> None:
+    """
+    Write text to a temp file in the same directory, then rename over the target,
+    and drop the file's cached reads.
+
+    With `compress`, the file is compressed with BOOKGEN_COMPRESSION; otherwise it is written plain.
+    """
+    from app import cache  # cache reads through this module
+    write_text(path, content, None if compress else "none")
+    cache.invalidate(path)
+
+
+def promote(source: Path, path: Path, kind: str = None) -> None:
+    """
+    Move a finished plain file (e.g. a streamed partial output) into place,
+    compressing it on the way if configured. `source` is removed.
+    """
+    kind = codec() if kind is None else kind
+    if kind == "none":
+        os.replace(source, path)
+        return
+    tmp_file = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(source, "rb") as src, open(tmp_file, "wb") as raw:
+            if kind == "gzip":
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as out:
+                    _copy(src, out)
+            else:
+                with _zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False) as out:
+                    _copy(src, out)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_file, path)
+        source.unlink()
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+
+def _copy(src: BinaryIO, dst: BinaryIO, block: int = 1024 * 1024) -> None:
+    for chunk in iter(lambda: src.read(block), b""):
+        dst.write(chunk)
+
+
+def convert(path: Path, kind: str) -> bool:
+    """
+    Rewrite one stored file with another codec. Returns False if it already used it.
+
+    The file's size changes, so size:mtime change detection sees it as modified:
+    the search index re-indexes it and the next consolidation is not
+    deduplicated against jobs submitted before the conversion.
+    """
+    if detect(path) == kind:
+        return False
+    write_bytes(path, read_bytes(path), kind)
+    return True
+
+
+def artifacts(workspace_id: str = None) -> List[Path]:
+    """
+    A workspace's files that may be stored compressed: extracted markdown, chat
+    sessions, the base context and its provenance map. Other JSON files
+    (jobs, the session index, highlights, watcher state) always stay plain.
+    """
+    workspace = get_workspace(workspace_id)
+    paths = sorted(workspace.output_dir.glob("*.md"))
+    paths += sorted(p for p in workspace.sessions_dir.glob("*.json") if not p.name.startswith("_"))
+    paths += [workspace.base_context_file, workspace.provenance_file]
+    return [p for p in paths if p.is_file()]
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.storage",
+                                     description="Compress or decompress a workspace's stored artifacts in place.")
+    parser.add_argument("action", choices=("compress", "decompress"))
+    parser.add_argument("--workspace", default=None, help="Workspace ID (default workspace if omitted)")
+    parser.add_argument("--codec", choices=("gzip", "zstd"), default=None,
+                        help="Codec for 'compress' (default: BOOKGEN_COMPRESSION, or gzip)")
+    args = parser.parse_args(argv)
+
+    if args.action == "decompress":
+        kind = "none"
+    else:
+        kind = args.codec or (codec() if COMPRESSION != "none" else "gzip")
+        if kind == "zstd" and _zstandard() is None:
+            parser.error("zstd needs the 'zstandard' package.")
+
+    try:
+        paths = artifacts(args.workspace)
+    except ValueError as e:
+        parser.error(str(e))
+
+    converted = before = after = 0
+    for path in paths:
+        size = path.stat().st_size
+        if convert(path, kind):
+            converted += 1
+            before += size
+            after += path.stat().st_size
+    print(f"Converted {converted} file(s) to {kind}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Chunked, resumable uploads.
+Large source documents are sent as a sequence of byte ranges instead of one
+multipart request, so an interrupted upload resumes from the last stored byte
+instead of from zero:
+
+1. `init_upload` registers the file (name, size, optional SHA-256). Calling it
+   again with the same SHA-256 returns the pending upload and its `offset`;
+   without a checksum every call starts a new upload (resume via its ID).
+2. `append_chunk` writes the bytes at `offset` (which must equal the stored
+   offset) straight to disk, optionally checking a per-chunk SHA-256.
+3. `complete_upload` checks the size and checksum and moves the file into
+   `uploaded_files/`.
+
+Pending data lives in `uploaded_files/.partial/<upload_id>.part` with its state
+in `<upload_id>.json`. The state only advances after the chunk is on disk, so
+after a crash the part file is truncated back to the recorded offset.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+from app import storage
+from app.workspace import get_workspace
+
+PARTIAL_DIR_NAME = ".partial"
+
+MAX_UPLOAD_BYTES = int(os.getenv("BOOKGEN_MAX_UPLOAD_MB", "2048")) * 1024 * 1024
+MAX_CHUNK_BYTES = int(os.getenv("BOOKGEN_MAX_CHUNK_MB", "16")) * 1024 * 1024
+
+# Suggested chunk size returned to clients
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Pending uploads untouched for this long are deleted
+STALE_UPLOAD_SECONDS = int(os.getenv("BOOKGEN_STALE_UPLOAD_HOURS", "24")) * 3600
+
+# Block size for streaming copies and checksums
+COPY_BLOCK_BYTES = 1024 * 1024
+
+_locks_lock = threading.Lock()
+_locks = {}  # upload ID -> lock serialising its appends
+
+
+class UploadOffsetMismatch(Exception):
+    """
+    A chunk was sent for the wrong position.
+
+    Attributes:
+        offset: Number of bytes stored so far; the client should resume from here
+    """
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+def _partial_dir(workspace_id: str = None) -> Path:
+    return get_workspace(workspace_id).upload_dir / PARTIAL_DIR_NAME
+
+
+def _paths(upload_id: str, workspace_id: str = None):
+    # Upload IDs are generated hex strings; reject anything else before touching paths
+    if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+        raise KeyError(upload_id)
+    directory = _partial_dir(workspace_id)
+    return directory / f"{upload_id}.json", directory / f"{upload_id}.part"
+
+
+def _lock_for(upload_id: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _save_state(state: Dict, workspace_id: str = None) -> None:
+    state_file, _ = _paths(state["upload_id"], workspace_id)
+    state["updated_at"] = datetime.now().isoformat()
+    storage.write_atomic(state_file, json.dumps(state, indent=2, ensure_ascii=False))
+
+
+def _load_state(upload_id: str, workspace_id: str = None) -> Optional[Dict]:
+    try:
+        state_file, _ = _paths(upload_id, workspace_id)
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (KeyError, FileNotFoundError, ValueError):
+        return None
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def safe_filename(filename: str) -> str:
+    """
+    Strip any directory part of a client-supplied file name.
+
+    Raises:
+        ValueError: If nothing usable is left
+    """
+    name = Path((filename or "").replace("\\", "/")).name.strip()
+    if not name or name in (".", "..") or name.startswith("."):
+        raise ValueError(f"Invalid file name '{filename}'.")
+    return name
+
+
+def save_stream(source: BinaryIO, destination: Path) -> int:
+    """
+    Copy a file-like object to disk in blocks, replacing `destination` only once
+    the copy is complete.
+
+    Returns:
+        Number of bytes written
+    """
+    tmp_file = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_file, "wb") as f:
+            shutil.copyfileobj(source, f, COPY_BLOCK_BYTES)
+            written = f.tell()
+        os.replace(tmp_file, destination)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+    return written
+
+
+def prune_stale_uploads(workspace_id: str = None, max_age: float = STALE_UPLOAD_SECONDS) -> int:
+    """Delete pending uploads untouched for `max_age` seconds. Returns the number removed."""
+    directory = _partial_dir(workspace_id)
+    if not directory.exists():
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for state_file in directory.glob("*.json"):
+        part_file = state_file.with_suffix(".part")
+        last_touched = max(
+            (p.stat().st_mtime for p in (state_file, part_file) if p.exists()), default=0
+        )
+        if last_touched < cutoff:
+            state_file.unlink(missing_ok=True)
+            part_file.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def init_upload(filename: str, size: int, sha256: str = None, workspace_id: str = None) -> Dict:
+    """
+    Start an upload, or find the pending upload of the same file.
+
+    A pending upload is only matched by its SHA-256: name and size alone could
+    belong to another version of the file, and resuming it would mix the two.
+
+    Args:
+        filename: Target name in `uploaded_files/`
+        size: Total size in bytes
+        sha256: Optional hex SHA-256 of the whole file, checked on completion
+        workspace_id: Workspace receiving the file
+
+    Returns:
+        Upload state {"upload_id", "filename", "size", "sha256", "offset",
+        "chunk_size", "created_at", "updated_at"}; resume from `offset`
+
+    Raises:
+        ValueError: If the name, size or checksum is invalid
+    """
+    filename = safe_filename(filename)
+    if not 0 < size <= MAX_UPLOAD_BYTES:
+        raise ValueError(f"Upload size must be between 1 byte and {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+            raise ValueError("sha256 must be 64 hex characters.")
+
+    directory = _partial_dir(workspace_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    prune_stale_uploads(workspace_id)
+
+    if sha256 is not None:
+        for state_file in directory.glob("*.json"):
+            state = _load_state(state_file.stem, workspace_id)
+            if state and state["filename"] == filename and state["size"] == size and state["sha256"] == sha256:
+                return get_upload(state["upload_id"], workspace_id)
+
+    state = {
+        "upload_id": uuid.uuid4().hex,
+        "filename": filename,
+        "size": size,
+        "sha256": sha256,
+        "offset": 0,
+        "chunk_size": CHUNK_BYTES,
+        "created_at": datetime.now().isoformat()
+    }
+    _paths(state["upload_id"], workspace_id)[1].touch()
+    _save_state(state, workspace_id)
+    return state
+
+
+def get_upload(upload_id: str, workspace_id: str = None) -> Optional[Dict]:
+    """State of a pending upload, or None if unknown (or already completed)."""
+    try:
+        _paths(upload_id, workspace_id)
+    except KeyError:
+        return None
+    with _lock_for(upload_id):
+        state = _load_state(upload_id, workspace_id)
+        if state is not None:
+            _recover(state, workspace_id)
+        return state
+
+
+def _recover(state: Dict, workspace_id: str = None) -> None:
+    """Make the part file match the recorded offset (bytes past it were never acknowledged)."""
+    _, part_file = _paths(state["upload_id"], workspace_id)
+    if not part_file.exists():
+        part_file.touch()
+    actual = part_file.stat().st_size
+    if actual > state["offset"]:
+        with open(part_file, "r+b") as f:
+            f.truncate(state["offset"])
+    elif actual < state["offset"]:
+        state["offset"] = actual
+        _save_state(state, workspace_id)
+
+
+def append_chunk(upload_id: str, offset: int, data: bytes, sha256: str = None,
+                 workspace_id: str = None) -> Dict:
+    """
+    Store the bytes of an upload starting at `offset`.
+
+    A chunk that was already stored (a retry after a lost response) is accepted
+    without writing it again.
+
+    Args:
+        upload_id: ID from `init_upload`
+        offset: Position of the first byte of `data`
+        data: Chunk bytes (at most MAX_CHUNK_BYTES)
+        sha256: Optional hex SHA-256 of `data`
+        workspace_id: Workspace of the upload
+
+    Returns:
+        Updated upload state
+
+    Raises:
+        KeyError: If the upload is unknown
+        UploadOffsetMismatch: If `offset` is not where the upload left off
+        ValueError: If the chunk is empty, too large, past the end or fails its checksum
+    """
+    if not data:
+        raise ValueError("Empty chunk.")
+    if len(data) > MAX_CHUNK_BYTES:
+        raise ValueError(f"Chunks are limited to {MAX_CHUNK_BYTES // (1024 * 1024)} MB.")
+    if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256.lower():
+        raise ValueError("Chunk checksum mismatch.")
+
+    _paths(upload_id, workspace_id)
+    with _lock_for(upload_id):
+        state = _load_state(upload_id, workspace_id)
+        if state is None:
+            raise KeyError(upload_id)
+        _recover(state, workspace_id)
+
+        if offset + len(data) <= state["offset"]:
+            return state
+        if offset != state["offset"]:
+            raise UploadOffsetMismatch(
+                f"Expected a chunk at offset {state['offset']}, got {offset}.", state["offset"]
+            )
+        if offset + len(data) > state["size"]:
+            raise ValueError(f"Chunk ends at {offset + len(data)}, past the declared size {state['size']}.")
+
+        _, part_file = _paths(upload_id, workspace_id)
+        with open(part_file, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        state["offset"] = offset + len(data)
+        _save_state(state, workspace_id)
+        return state
+
+
+def complete_upload(upload_id: str, workspace_id: str = None) -> Path:
+    """
+    Finish an upload and move it into `uploaded_files/` (replacing a file of the same name).
+
+    Returns:
+        Path of the uploaded file
+
+    Raises:
+        KeyError: If the upload is unknown
+        ValueError: If bytes are missing or the file checksum does not match
+    """
+    _paths(upload_id, workspace_id)
+    with _lock_for(upload_id):
+        state = _load_state(upload_id, workspace_id)
+        if state is None:
+            raise KeyError(upload_id)
+        _recover(state, workspace_id)
+        if state["offset"] != state["size"]:
+            raise ValueError(f"Upload incomplete: {state['offset']} of {state['size']} bytes received.")
+
+        state_file, part_file = _paths(upload_id, workspace_id)
+        if state["sha256"] and _sha256_file(part_file) != state["sha256"]:
+            raise ValueError("File checksum mismatch. Abort the upload and start again.")
+
+        destination = get_workspace(workspace_id).upload_dir / state["filename"]
+        os.replace(part_file, destination)
+        state_file.unlink(missing_ok=True)
+
+    with _locks_lock:
+        _locks.pop(upload_id, None)
+    return destination
+
+
+def abort_upload(upload_id: str, workspace_id: str = None) -> bool:
+    """Delete a pending upload. Returns False if it was unknown."""
+    try:
+        state_file, part_file = _paths(upload_id, workspace_id)
+    except KeyError:
+        return False
+    with _lock_for(upload_id):
+        existed = state_file.exists()
+        state_file.unlink(missing_ok=True)
+        part_file.unlink(missing_ok=True)
+    with _locks_lock:
+        _locks.pop(upload_id, None)
+    return existed
@@ -1,29 +1,48 @@
-import json
 import uuid
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import re
 import html
+import threading
+from functools import lru_cache
 
-# Path to metadata file
-METADATA_FILE = Path("consolidated_docs/highlights_metadata.json")
+from app import cache, storage
+from app.arabic import normalize_query, normalize_with_offsets, to_original
+from app.workspace import get_workspace
 
+# Path to metadata file (default workspace)
+METADATA_FILE = get_workspace().highlights_file
 
-def load_highlights() -> dict:
+# Highlight set files written by `export_highlights`
+EXPORT_FORMAT = "bookgen-highlights"
+EXPORT_VERSION = 1
+
+# Colors end up in a style attribute, so only hex colors are accepted from batches and imports
+_COLOR = re.compile(r"^#[0-9a-fA-F]{3,8}$")
+
+# Serialises read-modify-write cycles of the highlights file
+_highlights_lock = threading.Lock()
+
+
+def load_highlights(workspace_id: str = None) -> dict:
     """
-    Load highlights from JSON file.
-    Returns empty structure if file doesn't exist.
+    Load highlights from JSON file (cached until the file changes).
+    Returns empty structure if file doesn't exist. The result is a copy the
+    caller may modify.
+    
+    Args:
+        workspace_id: Workspace to load from (default workspace if None)
     """
-    if not METADATA_FILE.exists():
+    metadata_file = get_workspace(workspace_id).highlights_file
+    if not metadata_file.exists():
         return {
             "highlights": [],
             "last_updated": datetime.now().isoformat()
         }
     
     try:
-        with open(METADATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return cache.read_json(metadata_file)
     except Exception as e:
         print(f"Error loading highlights: {e}")
         return {
@@ -32,32 +51,164 @@ def load_highlights() -> dict:
         }
 
 
-def save_highlights(highlights: list) -> None:
+def save_highlights(highlights: list, workspace_id: str = None) -> dict:
     """
-    Save highlights to JSON file.
+    Save highlights to JSON file (atomically, via a temp file and rename).
     
     Args:
         highlights: List of highlight dictionaries
+        workspace_id: Workspace to save to (default workspace if None)
+    
+    Returns:
+        The saved data ({"highlights", "last_updated"})
     """
     try:
-        METADATA_FILE.parent.mkdir(exist_ok=True)
-        
+        metadata_file = get_workspace(workspace_id).highlights_file
         data = {
             "highlights": highlights,
             "last_updated": datetime.now().isoformat()
         }
         
-        with open(METADATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        storage.write_json(metadata_file, data, "none")
+        cache.invalidate(metadata_file)
+        return data
     except Exception as e:
         print(f"Error saving highlights: {e}")
         raise e
 
 
+# Mark styles: whole-phrase matches vs. word-by-word (fuzzy) matches
+PHRASE_MARK_STYLE = "padding: 2px 4px; border-radius: 3px;"
+WORD_MARK_STYLE = "padding: 2px 0; border-radius: 2px;"
+
+# Fuzzy separator: whitespace and markdown symbols (*, _, -, #, `, >, .) between words
+FUZZY_SEPARATOR = r"(?:[\s\*\_\-\#\`\>\.]+)"
+_SEPARATOR_RUN = re.compile(FUZZY_SEPARATOR)
+
+
+@lru_cache(maxsize=8)
+def markdown_shadow(text: str) -> Tuple[str, List[int]]:
+    """
+    The normalised shadow of `text` with every run of whitespace and markdown
+    symbols (FUZZY_SEPARATOR) collapsed to one space, so a highlight that
+    spans formatting becomes a plain substring.
+
+    Cached per text, like `arabic.normalize_with_offsets`.
+
+    Returns:
+        (stripped, positions): `positions[i]` is the index in the normalised
+        shadow of `stripped[i]`, with a final entry for the end
+    """
+    shadow, _ = normalize_with_offsets(text)
+    pieces = []
+    positions = []
+    cursor = 0
+    for run in _SEPARATOR_RUN.finditer(shadow):
+        pieces.append(shadow[cursor:run.start()])
+        positions.extend(range(cursor, run.start()))
+        pieces.append(" ")
+        positions.append(run.start())
+        cursor = run.end()
+    pieces.append(shadow[cursor:])
+    positions.extend(range(cursor, len(shadow)))
+    positions.append(len(shadow))
+    return "".join(pieces), positions
+
+
+@lru_cache(maxsize=1024)
+def _prepared(highlight_text: str) -> Tuple[str, str, Tuple[Tuple[int, int], ...]]:
+    """
+    Search forms of a highlight, cached by its text.
+
+    Returns:
+        (phrase query for the shadow, fuzzy needle for `markdown_shadow`,
+        (start, end) of each word within the needle)
+    """
+    query = normalize_query(highlight_text)
+    needle = _SEPARATOR_RUN.sub(" ", query).strip()
+    words = tuple((m.start(), m.end()) for m in re.finditer(r"\S+", needle))
+    return query, needle, words
+
+
+def highlight_spans(text: str, highlights: list) -> List[tuple]:
+    """
+    Locate highlights in markdown text.
+
+    Matching runs once against the normalised shadow of the text
+    (`arabic.normalize_with_offsets`), so it ignores tashkeel, tatweel,
+    alef/yaa/taa-marbuta variants, case and whitespace differences, and every
+    match maps back to an exact span of the original.
+
+    Longer highlights are placed first and win overlaps. Each highlight is
+    matched as a phrase and then word by word, allowing markdown symbols
+    between the words (only the words are marked); the word-by-word pass only
+    marks occurrences the phrase pass has not already claimed.
+
+    Args:
+        text: Original markdown content
+        highlights: List of highlight dictionaries with 'text' and 'color'
+
+    Returns:
+        Non-overlapping (start, end, color, style) tuples sorted by start
+    """
+    shadow, offsets = normalize_with_offsets(text)
+    claimed = bytearray(len(text))
+    spans = []
+
+    def is_free(start, end):
+        return end > start and 1 not in claimed[start:end]
+
+    def claim(start, end, color, style):
+        if not is_free(start, end):
+            return
+        claimed[start:end] = b"\x01" * (end - start)
+        spans.append((start, end, color, style))
+
+    sorted_highlights = sorted(highlights, key=lambda h: len(h.get("text", "")), reverse=True)
+    for highlight in sorted_highlights:
+        query, needle, words = _prepared(highlight.get("text", ""))
+        color = highlight.get("color", "#ffeb3b")
+        if not query:
+            continue
+
+        # 1. Phrase match in the shadow
+        position = shadow.find(query)
+        while position != -1:
+            start, end = to_original(offsets, position, position + len(query))
+            if "\n" in text[start:end]:
+                # Marking across a line break would break the markdown block structure
+                for word in re.finditer(r"\S+", text[start:end]):
+                    claim(start + word.start(), start + word.end(), color, WORD_MARK_STYLE)
+            else:
+                claim(start, end, color, PHRASE_MARK_STYLE)
+            position = shadow.find(query, position + len(query))
+
+        # 2. Word-by-word match with markdown symbols in between: a substring
+        #    search in the markdown-stripped shadow. Runs even when the phrase
+        #    matched elsewhere; occurrences already claimed above are skipped.
+        if not needle:
+            continue
+        stripped, positions = markdown_shadow(text)
+        position = stripped.find(needle)
+        while position != -1:
+            occurrence = []
+            for word_start, word_end in words:
+                shadow_start = positions[position + word_start]
+                shadow_end = positions[position + word_end - 1] + 1
+                occurrence.append(to_original(offsets, shadow_start, shadow_end))
+            if all(is_free(start, end) for start, end in occurrence):
+                for start, end in occurrence:
+                    claim(start, end, color, WORD_MARK_STYLE)
+            position = stripped.find(needle, position + len(needle))
+
+    spans.sort()
+    return spans
+
+
 def apply_highlights(text: str, highlights: list) -> str:
     """
     Apply HTML highlight tags to markdown text using smart matching.
-    Ignores markdown symbols (*, _, #, etc.) when matching text.
+    Ignores markdown symbols (*, _, #, etc.) and Arabic spelling variants when matching text.
     
     Args:
         text: Original markdown content
@@ -68,111 +219,71 @@ def apply_highlights(text: str, highlights: list) -> str:
     """
     if not highlights:
         return text
-    
-    # Sort highlights by text length (longest first) to handle overlaps correctly
-    sorted_highlights = sorted(highlights, key=lambda h: len(h.get("text", "")), reverse=True)
-    
-    result = text
-    
-    for highlight in sorted_highlights:
-        highlight_text = highlight.get("text", "")
-        color = highlight.get("color", "#ffeb3b")
-        
-        if not highlight_text:
-            continue
-            
-        # 1. Try Exact Match First (Fastest)
-        escaped_text = re.escape(highlight_text)
-        if re.search(escaped_text, result):
-            replacement = f'<mark style="background-color: {color}; padding: 2px 4px; border-radius: 3px;">{highlight_text}</mark>'
-            result = re.sub(escaped_text, replacement, result)
-            continue
-            
-        # 2. Smart Match (Fuzzy)
-        # Split search text into words
-        words = highlight_text.split()
-        if not words:
-            continue
-            
-        # Build regex: Match words with optional markdown chars/whitespace in between
-        # Separator matches: whitespace, *, _, -, #, >, `
-        sep_pattern = r"(?:[\s\*\_\-\#\`\>\.]+)" 
-        
-        # Escape each word and join with separator
-        regex_pattern = sep_pattern.join(map(re.escape, words))
-        
-        # Allow optional markdown chars at start/end of the phrase too
-        # But be careful not to match too much. Just rely on the words sequence.
-        
-        try:
-            # We need to capture the matched text to preserve the markdown structure inside the mark tag
-            # Use a capturing group for the whole match
-            pattern = re.compile(f"({regex_pattern})", re.IGNORECASE)
-            
-            def replace_func(match):
-                original = match.group(1)
-                # Don't double highlight if already highlighted
-                if "<mark" in original: 
-                    return original
-                
-                # Instead of wrapping the whole block (which breaks Markdown structure across blocks),
-                # we reconstruct the string by wrapping ONLY the matched "words", leaving separators alone.
-                
-                # We can do this by finding the words again within the 'original' string
-                # Since we constructed the regex from these words, they MUST exist in order.
-                
-                result_parts = []
-                current_pos = 0
-                
-                for word in words:
-                    # Search for the word starting from current_pos
-                    # We use re.escape(word) because the word might contain regex chars
-                    # We use string search (find) or simple regex? 
-                    # Use re.search to handle case insensitivity if needed (regex was IGNORECASE)
-                    
-                    # Pattern for this specific word at the start of the remaining string (conceptually)
-                    # But actually, between words there is 'sep_pattern'.
-                    # Let's find the word content. 
-                    # Note: 'original' is valid text from the doc. 'word' is from user input.
-                    # They must match characters (modulo regex flags).
-                    
-                    word_pat = re.compile(re.escape(word), re.IGNORECASE)
-                    m = word_pat.search(original, current_pos)
-                    
-                    if m:
-                        start, end = m.span()
-                        # Append the text BEFORE the word (separator/syntax)
-                        result_parts.append(original[current_pos:start])
-                        # Append the WRAPPED word
-                        matched_word_text = original[start:end]
-                        result_parts.append(f'<mark style="background-color: {color}; padding: 2px 0; border-radius: 2px;">{matched_word_text}</mark>')
-                        current_pos = end
-                    else:
-                        # Should not happen if main regex matched, but safety fallback
-                        return original 
-                
-                # Append remaining text found in the match (if any)
-                result_parts.append(original[current_pos:])
-                
-                return "".join(result_parts)
-            
-            result = pattern.sub(replace_func, result)
-            
-        except Exception as e:
-            print(f"Smart match failed for '{highlight_text}': {e}")
-            continue
-            
-    return result
+    return mark_spans(text, highlight_spans(text, highlights))
 
 
-def add_highlight(text: str, color: str, highlights: list) -> dict:
+def mark_spans(text: str, spans: List[tuple]) -> str:
+    """
+    Wrap located highlight spans in `<mark>` tags.
+
+    Args:
+        text: Original markdown content
+        spans: Sorted, non-overlapping (start, end, color, style) tuples from `highlight_spans`
+
+    Returns:
+        Markdown text with HTML <mark> tags injected
+    """
+    parts = []
+    position = 0
+    for start, end, color, style in spans:
+        parts.append(text[position:start])
+        parts.append(f'<mark style="background-color: {color}; {style}">{text[start:end]}</mark>')
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+@lru_cache(maxsize=16)
+def _cached_spans(text: str, highlight_key: tuple) -> tuple:
+    return tuple(highlight_spans(text, [{"text": t, "color": c} for t, c in highlight_key]))
+
+
+def highlight_payload(text: str, highlights: list) -> dict:
+    """
+    Highlight spans in a compact form for client-side rendering.
+
+    Results are memoised per (text, highlights), so re-rendering unchanged
+    content does no matching at all.
+
+    Args:
+        text: Original content
+        highlights: List of highlight dictionaries with 'text' and 'color'
+
+    Returns:
+        {"styles": [mark style, ...], "spans": [[start, end, color, style index], ...]};
+        offsets count Unicode code points
+    """
+    styles = [PHRASE_MARK_STYLE, WORD_MARK_STYLE]
+    key = tuple((h.get("text", ""), h.get("color", "#ffeb3b")) for h in highlights)
+    spans = _cached_spans(text, key) if key else ()
+    return {
+        "styles": styles,
+        "spans": [[start, end, color, styles.index(style)] for start, end, color, style in spans]
+    }
+
+
+def add_highlight(text: str, color: str, highlights: list, workspace_id: str = None) -> dict:
     """
     Add a new highlight to the list.
     
+    The highlight is appended to the saved highlights as they are on disk, so
+    concurrent edits are not lost; `highlights` is updated as well.
+    
     Args:
         text: Text to highlight
         color: Hex color code
-        highlights: Current list of highlights
+        highlights: Caller's list of highlights
+        workspace_id: Workspace the highlights belong to
     
     Returns:
         New highlight dictionary
@@ -184,33 +295,182 @@ def add_highlight(text: str, color: str, highlights: list) -> dict:
         "created_at": datetime.now().isoformat()
     }
     
+    with _highlights_lock:
+        current = load_highlights(workspace_id).get("highlights", [])
+        current.append(new_highlight)
+        save_highlights(current, workspace_id)
     highlights.append(new_highlight)
-    save_highlights(highlights)
     
     return new_highlight
 
 
-def remove_highlight(highlight_id: str, highlights: list) -> bool:
+def remove_highlight(highlight_id: str, highlights: list, workspace_id: str = None) -> bool:
     """
-    Remove a highlight by ID.
+    Remove a highlight by ID from the saved highlights as they are on disk.
     
     Args:
         highlight_id: UUID of highlight to remove
-        highlights: Current list of highlights
+        highlights: Caller's list of highlights (unused; kept for compatibility)
+        workspace_id: Workspace the highlights belong to
     
     Returns:
         True if removed, False if not found
     """
-    original_length = len(highlights)
-    updated_highlights = [h for h in highlights if h.get("id") != highlight_id]
-    
-    if len(updated_highlights) < original_length:
-        save_highlights(updated_highlights)
-        return True
+    with _highlights_lock:
+        current = load_highlights(workspace_id).get("highlights", [])
+        updated_highlights = [h for h in current if h.get("id") != highlight_id]
+        
+        if len(updated_highlights) < len(current):
+            save_highlights(updated_highlights, workspace_id)
+            return True
     
     return False
 
 
+def _check_color(color, where: str) -> str:
+    if not isinstance(color, str) or not _COLOR.match(color):
+        raise ValueError(f"{where}: color must be a hex color like #ffeb3b.")
+    return color
+
+
+def apply_highlight_operations(operations: List[Dict], workspace_id: str = None) -> Dict:
+    """
+    Apply many highlight changes in memory and persist them with one write.
+
+    Operations:
+        {"op": "add", "text", "color"}: add a highlight (an identical text +
+            color pair already present is skipped; an optional unused `id` is kept)
+        {"op": "remove", "id"}: remove a highlight
+        {"op": "recolor", "id", "color"}: change a highlight's color
+
+    Args:
+        operations: Operations, applied in order
+        workspace_id: Workspace the highlights belong to
+
+    Returns:
+        Dictionary with the resulting `highlights` and `last_updated`, plus the
+        IDs that were `added`, `removed` and `recolored`, the IDs `not_found`
+        and the number of `duplicates` skipped
+
+    Raises:
+        ValueError: If an operation is malformed (nothing is written then)
+    """
+    with _highlights_lock:
+        current = load_highlights(workspace_id)
+        highlights = current.get("highlights", [])
+        by_id = {h.get("id"): h for h in highlights}
+        existing = {(h.get("text"), h.get("color")) for h in highlights}
+        result = {"added": [], "removed": [], "recolored": [], "not_found": [], "duplicates": 0}
+
+        for index, operation in enumerate(operations):
+            where = f"Operation {index}"
+            op = operation.get("op")
+            if op == "add":
+                text = (operation.get("text") or "").strip()
+                if not text:
+                    raise ValueError(f"{where}: text is required.")
+                color = _check_color(operation.get("color"), where)
+                if (text, color) in existing:
+                    result["duplicates"] += 1
+                    continue
+                highlight = {
+                    "id": operation.get("id") if operation.get("id") and operation["id"] not in by_id else str(uuid.uuid4()),
+                    "text": text,
+                    "color": color,
+                    "created_at": operation.get("created_at") or datetime.now().isoformat()
+                }
+                highlights.append(highlight)
+                by_id[highlight["id"]] = highlight
+                existing.add((text, color))
+                result["added"].append(highlight["id"])
+            elif op in ("remove", "recolor"):
+                highlight = by_id.get(operation.get("id"))
+                if highlight is None:
+                    result["not_found"].append(operation.get("id"))
+                    continue
+                if op == "remove":
+                    del by_id[highlight["id"]]
+                    existing.discard((highlight["text"], highlight["color"]))
+                    result["removed"].append(highlight["id"])
+                else:
+                    existing.discard((highlight["text"], highlight["color"]))
+                    highlight["color"] = _check_color(operation.get("color"), where)
+                    existing.add((highlight["text"], highlight["color"]))
+                    result["recolored"].append(highlight["id"])
+            else:
+                raise ValueError(f"{where}: unknown op '{op}' (use add, remove or recolor).")
+
+        kept = {id(h) for h in by_id.values()}
+        highlights = [h for h in highlights if id(h) in kept]
+        if result["added"] or result["removed"] or result["recolored"]:
+            data = save_highlights(highlights, workspace_id)
+        else:
+            data = {"highlights": highlights, "last_updated": current["last_updated"]}
+        return {**data, **result}
+
+
+def add_highlights(items: List[Dict], workspace_id: str = None) -> Dict:
+    """Add many {"text", "color"} highlights with one write. See `apply_highlight_operations`."""
+    return apply_highlight_operations([{"op": "add", **item} for item in items], workspace_id)
+
+
+def remove_highlights(highlight_ids: List[str], workspace_id: str = None) -> Dict:
+    """Remove many highlights with one write. See `apply_highlight_operations`."""
+    return apply_highlight_operations([{"op": "remove", "id": i} for i in highlight_ids], workspace_id)
+
+
+def recolor_highlights(highlight_ids: List[str], color: str, workspace_id: str = None) -> Dict:
+    """Give many highlights a new color with one write. See `apply_highlight_operations`."""
+    return apply_highlight_operations(
+        [{"op": "recolor", "id": i, "color": color} for i in highlight_ids], workspace_id
+    )
+
+
+def export_highlights(workspace_id: str = None) -> Dict:
+    """The workspace's highlights as a portable highlight set (see `import_highlights`)."""
+    return {
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "exported_at": datetime.now().isoformat(),
+        "highlights": [
+            {key: h[key] for key in ("id", "text", "color", "created_at") if key in h}
+            for h in load_highlights(workspace_id).get("highlights", [])
+        ]
+    }
+
+
+def import_highlights(highlight_set: Dict, replace: bool = False, workspace_id: str = None) -> Dict:
+    """
+    Import a highlight set produced by `export_highlights`, with one write.
+
+    Args:
+        highlight_set: Dictionary with a `highlights` list of {"text", "color", ...}
+        replace: Drop the current highlights first instead of merging
+        workspace_id: Workspace to import into
+
+    Returns:
+        Same as `apply_highlight_operations`
+
+    Raises:
+        ValueError: If the set is malformed
+    """
+    if highlight_set.get("format", EXPORT_FORMAT) != EXPORT_FORMAT:
+        raise ValueError(f"Not a highlight set (format '{highlight_set.get('format')}').")
+    items = highlight_set.get("highlights")
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError("A highlight set needs a 'highlights' list of objects.")
+
+    operations = []
+    if replace:
+        current = load_highlights(workspace_id).get("highlights", [])
+        operations = [{"op": "remove", "id": h.get("id")} for h in current]
+    operations += [
+        {"op": "add", **{key: item.get(key) for key in ("id", "text", "color", "created_at")}}
+        for item in items
+    ]
+    return apply_highlight_operations(operations, workspace_id)
+
+
 def sanitize_html(text: str) -> str:
     """
     Sanitize HTML to prevent XSS attacks.
@@ -0,0 +1,272 @@
+"""
+Watch-folder ingestion.
+Polls a shared folder and extracts documents dropped into it with the same
+pipeline as `POST /extract/`: the file is copied into the workspace's
+`uploaded_files/`, converted in a memory-capped worker process and indexed
+for search. It runs as its own process, so conversions never compete with
+the API or Streamlit for their event loop or threads:
+
+    python -m app.watcher /shared/incoming --workspace tot-course --consolidate
+
+- A file is processed once its size and mtime have not changed for
+  `--debounce` seconds, so half-copied files are never picked up.
+- Each processed file's SHA-256 is stored in
+  `consolidated_docs/watcher_state.json`; a file whose content is unchanged
+  (and whose markdown still exists) is skipped, also across restarts.
+- With `--consolidate`, a consolidation job is queued once a batch of changes
+  has been extracted and the folder has settled (no files still changing).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app import jobs
+from app import search
+from app import storage
+from app import uploads
+from app.extraction import AUTO_PROFILE, PROFILES
+from app.workers import ExtractionError, run_extraction
+from app.workspace import get_workspace
+
+# Same file types as the Streamlit uploader
+WATCHED_SUFFIXES = (".pdf", ".docx", ".txt", ".md")
+
+POLL_INTERVAL = float(os.getenv("BOOKGEN_WATCH_INTERVAL", "2"))
+DEBOUNCE_SECONDS = float(os.getenv("BOOKGEN_WATCH_DEBOUNCE", "5"))
+
+# Seconds between checks of a queued consolidation job in --once mode
+JOB_POLL_INTERVAL = 2.0
+
+STATE_FILE_NAME = "watcher_state.json"
+
+# Partial downloads and editor lock/temp files
+_IGNORED_PREFIXES = (".", "~$")
+_IGNORED_SUFFIXES = (".tmp", ".part", ".crdownload", ".download")
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(uploads.COPY_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_candidate(path: Path) -> bool:
+    name = path.name
+    return (
+        path.is_file()
+        and not name.startswith(_IGNORED_PREFIXES)
+        and not name.lower().endswith(_IGNORED_SUFFIXES)
+        and path.suffix.lower() in WATCHED_SUFFIXES
+    )
+
+
+class FolderWatcher:
+    """
+    Debounced, hash-checked extraction of the documents in one folder.
+
+    Args:
+        folder: Folder to watch (top level only)
+        workspace_id: Workspace receiving the documents
+        profile: Extraction profile, or "auto"
+        debounce: Seconds a file must stay unchanged before it is processed
+        consolidate_mode: Queue a consolidation in this mode after each batch
+            of changes ("single" or "chapters"); None to only extract
+    """
+
+    def __init__(self, folder: Path, workspace_id: str = None, profile: str = AUTO_PROFILE,
+                 debounce: float = DEBOUNCE_SECONDS, consolidate_mode: str = None):
+        if profile != AUTO_PROFILE and profile not in PROFILES:
+            raise ValueError(f"Unknown profile '{profile}'.")
+        if consolidate_mode is not None and consolidate_mode not in jobs.MODES:
+            raise ValueError(f"Unknown consolidation mode '{consolidate_mode}'. Use one of: {', '.join(jobs.MODES)}.")
+        self.folder = Path(folder)
+        if not self.folder.is_dir():
+            raise ValueError(f"Not a directory: {self.folder}")
+        self.workspace = get_workspace(workspace_id).ensure()
+        self.profile = profile
+        self.debounce = debounce
+        self.consolidate_mode = consolidate_mode
+        self.state_file = self.workspace.consolidated_dir / STATE_FILE_NAME
+        self.state = self._load_state()
+        self._seen = {}  # file name -> ((size, mtime_ns), time the signature was first seen)
+        self._changed_since_consolidation = False
+        self.pending = 0  # files still changing at the last scan
+        self.last_job = None
+
+    def _load_state(self) -> Dict[str, Dict]:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        storage.write_atomic(self.state_file, json.dumps(self.state, indent=2, ensure_ascii=False))
+
+    def _settled_files(self) -> Tuple[List[Path], int]:
+        """Files unchanged for the debounce period, and the number still changing."""
+        now = time.monotonic()
+        settled = []
+        pending = 0
+        present = set()
+        for path in sorted(self.folder.iterdir()):
+            if not _is_candidate(path):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            present.add(path.name)
+
+            seen = self._seen.get(path.name)
+            if seen is None or seen[0] != signature:
+                self._seen[path.name] = (signature, now)
+                pending += 1
+            elif now - seen[1] >= self.debounce:
+                settled.append(path)
+            else:
+                pending += 1
+
+        for name in set(self._seen) - present:
+            del self._seen[name]
+        return settled, pending
+
+    def _is_handled(self, entry: Dict, path: Path) -> bool:
+        """A failed file stays failed until it changes; an extracted one needs its markdown."""
+        return entry["status"] == "failed" or (self.workspace.output_dir / f"{path.stem}.md").exists()
+
+    def process(self, path: Path) -> Optional[Dict]:
+        """
+        Extract one settled file unless its content was already extracted.
+
+        Returns:
+            {"file", "status", ...}, or None when the file was skipped
+        """
+        stat = path.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        entry = self.state.get(path.name)
+        # Same size and mtime as when it was last handled: no need to hash it again
+        if entry and entry.get("signature") == signature and self._is_handled(entry, path):
+            return None
+
+        digest = _sha256(path)
+        if entry and entry["sha256"] == digest and self._is_handled(entry, path):
+            # Touched but not modified (e.g. copied over with the same content)
+            entry["signature"] = signature
+            self._save_state()
+            return None
+
+        started = time.perf_counter()
+        record = {"sha256": digest, "signature": signature, "processed_at": datetime.now().isoformat()}
+        try:
+            file_location = self.workspace.upload_dir / uploads.safe_filename(path.name)
+            with open(path, "rb") as source:
+                uploads.save_stream(source, file_location)
+            extraction = run_extraction(file_location, self.workspace.output_dir, self.profile)
+            output_path = self.workspace.output_dir / f"{file_location.stem}.md"
+            search.index_source(output_path, self.workspace.id)
+            record.update(status="extracted", profile=extraction["profile"])
+            self._changed_since_consolidation = True
+            print(f"Watcher: extracted {path.name} ({extraction['profile']}, "
+                  f"{time.perf_counter() - started:.1f}s)")
+        except (ExtractionError, OSError, ValueError) as e:
+            # Not retried until the file changes
+            record.update(status="failed", error=str(e))
+            print(f"Watcher: failed to extract {path.name}: {e}")
+        self.state[path.name] = record
+        self._save_state()
+        return {"file": path.name, **record}
+
+    def poll(self) -> List[Dict]:
+        """
+        Scan the folder once, extracting settled new or modified files.
+
+        Returns:
+            Results of the files processed in this scan
+        """
+        settled, self.pending = self._settled_files()
+        results = [result for result in (self.process(path) for path in settled) if result]
+
+        if self.consolidate_mode and self._changed_since_consolidation and self.pending == 0:
+            try:
+                self.last_job = jobs.submit_consolidation(self.workspace.id, self.consolidate_mode)
+                self._changed_since_consolidation = False
+                print(f"Watcher: queued consolidation job {self.last_job['id']}")
+            except FileNotFoundError as e:
+                print(f"Watcher: not consolidating: {e}")
+                self._changed_since_consolidation = False
+        return results
+
+    def run(self, interval: float = POLL_INTERVAL, stop: threading.Event = None) -> None:
+        """Poll until `stop` is set."""
+        stop = stop or threading.Event()
+        print(f"Watcher: watching {self.folder} for workspace '{self.workspace.id}' "
+              f"(debounce {self.debounce:g}s)")
+        while not stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Watcher: scan failed: {e}")
+            stop.wait(interval)
+
+    def run_once(self) -> List[Dict]:
+        """Process everything currently in the folder, then wait for a queued consolidation."""
+        results = self.poll()
+        while self.pending:
+            time.sleep(min(self.debounce, POLL_INTERVAL))
+            results.extend(self.poll())
+        if self.last_job:
+            job = self.last_job
+            while job and job["status"] in jobs.ACTIVE_STATUSES:
+                time.sleep(JOB_POLL_INTERVAL)
+                job = jobs.get_job(job["id"], self.workspace.id)
+            if job:
+                print(f"Watcher: consolidation {job['status']}")
+        return results
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.watcher", description="Extract documents dropped into a folder.")
+    parser.add_argument("folder", type=Path, help="Folder to watch")
+    parser.add_argument("--workspace", default=None, help="Workspace ID (default workspace if omitted)")
+    parser.add_argument("--profile", default=AUTO_PROFILE, choices=[AUTO_PROFILE, *PROFILES])
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS,
+                        help="Seconds a file must stay unchanged before it is extracted")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Seconds between scans")
+    parser.add_argument("--consolidate", nargs="?", const="single", choices=jobs.MODES, default=None,
+                        help="Queue a consolidation after each batch of changes (default mode: single)")
+    parser.add_argument("--once", action="store_true",
+                        help="Process the folder's current contents and exit")
+    args = parser.parse_args(argv)
+
+    try:
+        watcher = FolderWatcher(args.folder, args.workspace, args.profile, args.debounce, args.consolidate)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.once:
+        watcher.run_once()
+        return
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        watcher.run(args.interval, stop)
+    except KeyboardInterrupt:
+        pass
+    print("Watcher: stopped")
+
+
+if __name__ == "__main__":
+    main()
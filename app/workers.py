@@ -0,0 +1,281 @@
+"""
+Memory-capped extraction worker processes.
+Docling conversions run in separate worker processes so the memory they
+allocate is returned to the OS when a worker is recycled, and a single
+oversized document cannot take down the API or Streamlit process.
+
+- Each worker runs a watchdog that exits the process if its RSS goes over
+  WORKER_MEMORY_LIMIT_MB while a job is running, or once its parent is gone.
+- A worker leads its own process group, so killing it (timeout) or its death
+  (memory limit, crash) also takes down the page-range processes it started.
+- Workers are recycled after WORKER_MAX_JOBS jobs or once their RSS stays
+  above WORKER_RECYCLE_RSS_MB after a job.
+- Failures are raised to the caller as ExtractionError with a `reason`.
+- Spans timed inside a job are sent back with its result and replayed in the
+  caller, so they reach `/metrics` and the request's Server-Timing header.
+"""
+
+import atexit
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Dict
+
+from app import metrics
+
+WORKER_COUNT = int(os.getenv("BOOKGEN_EXTRACTION_WORKERS", "1"))
+WORKER_MEMORY_LIMIT_MB = int(os.getenv("BOOKGEN_WORKER_MEMORY_MB", "6144"))
+WORKER_RECYCLE_RSS_MB = int(os.getenv("BOOKGEN_WORKER_RECYCLE_RSS_MB", "2048"))
+WORKER_MAX_JOBS = int(os.getenv("BOOKGEN_WORKER_MAX_JOBS", "20"))
+JOB_TIMEOUT_SECONDS = int(os.getenv("BOOKGEN_EXTRACTION_TIMEOUT", "3600"))
+
+# Exit code used by the watchdog so the parent can tell an OOM kill from a crash
+MEMORY_EXIT_CODE = 87
+ORPHANED_EXIT_CODE = 88
+WATCHDOG_INTERVAL = 0.5
+
+
+class ExtractionError(Exception):
+    """
+    Extraction failed inside a worker process.
+
+    Attributes:
+        reason: "memory_limit", "timeout", "crashed" or "error"
+    """
+
+    def __init__(self, message: str, reason: str = "error"):
+        super().__init__(message)
+        self.reason = reason
+
+
+def rss_mb() -> float:
+    """Resident set size of the current process in MB."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        # Not Linux: fall back to peak RSS (KB on Linux, bytes on macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def start_memory_watchdog(limit_mb: int) -> None:
+    """
+    Exit this process with MEMORY_EXIT_CODE once its RSS exceeds `limit_mb`,
+    or with ORPHANED_EXIT_CODE once the process that started it has died.
+    """
+    parent_pid = os.getppid()
+
+    def watch():
+        while True:
+            if rss_mb() > limit_mb:
+                os._exit(MEMORY_EXIT_CODE)
+            if os.getppid() != parent_pid:
+                os._exit(ORPHANED_EXIT_CODE)
+            time.sleep(WATCHDOG_INTERVAL)
+
+    threading.Thread(target=watch, name="memory-watchdog", daemon=True).start()
+
+
+def _worker_main(conn, memory_limit_mb: int) -> None:
+    """Worker loop: run (function, args, kwargs) jobs until told to stop."""
+    if hasattr(os, "setpgid"):
+        # Page-range processes inherit the group and are killed with it
+        os.setpgid(0, 0)
+    start_memory_watchdog(memory_limit_mb)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        func, args, kwargs = job
+        token = metrics.start_request()
+        try:
+            result = func(*args, **kwargs)
+            conn.send(("ok", result, rss_mb(), metrics.end_request(token)))
+        except MemoryError:
+            conn.send(("error", ("memory_limit", "Worker ran out of memory"), rss_mb(), metrics.end_request(token)))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(("error", ("error", f"{type(e).__name__}: {e}"), rss_mb(), metrics.end_request(token)))
+
+
+class _Worker:
+    """One worker process and its pipe."""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        # Not a daemon: large PDFs spawn their own page-range processes
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, WORKER_MEMORY_LIMIT_MB),
+            name="extraction-worker",
+            daemon=False
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+        self.last_rss_mb = 0.0
+
+    def run(self, func, args, kwargs, timeout: float):
+        self.conn.send((func, args, kwargs))
+        deadline = time.monotonic() + timeout
+
+        while not self.conn.poll(WATCHDOG_INTERVAL):
+            if not self.process.is_alive():
+                raise self._exit_error()
+            if time.monotonic() > deadline:
+                self.kill()
+                raise ExtractionError(f"Extraction timed out after {timeout:.0f}s.", reason="timeout")
+
+        try:
+            status, payload, self.last_rss_mb, spans = self.conn.recv()
+        except (EOFError, OSError):
+            # Closing the pipe on exit also wakes up poll()
+            raise self._exit_error()
+
+        metrics.replay_spans(spans)
+        self.jobs_done += 1
+        if status == "error":
+            reason, message = payload
+            raise ExtractionError(message, reason=reason)
+        return payload
+
+    def _exit_error(self) -> ExtractionError:
+        self._kill_group()
+        self.process.join()
+        if self.process.exitcode == MEMORY_EXIT_CODE:
+            return ExtractionError(
+                f"Document exceeded the extraction memory limit ({WORKER_MEMORY_LIMIT_MB} MB).",
+                reason="memory_limit"
+            )
+        return ExtractionError(
+            f"Extraction worker crashed (exit code {self.process.exitcode}).",
+            reason="crashed"
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def should_recycle(self) -> bool:
+        return self.jobs_done >= WORKER_MAX_JOBS or self.last_rss_mb > WORKER_RECYCLE_RSS_MB
+
+    def stop(self) -> None:
+        """Ask the worker to exit, killing it if it does not."""
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self) -> None:
+        self._kill_group()
+        self.process.kill()
+        self.process.join()
+
+    def _kill_group(self) -> None:
+        """Kill the worker's process group, i.e. the worker and its page-range processes."""
+        if not hasattr(os, "killpg"):
+            return  # the orphan check in their watchdog stops them instead
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class ExtractionWorkerPool:
+    """Fixed-size pool of recyclable worker processes."""
+
+    def __init__(self, size: int = WORKER_COUNT):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = set()
+        for _ in range(max(1, size)):
+            self._idle.put(None)  # slots are started lazily
+
+    def run(self, func, *args, timeout: float = JOB_TIMEOUT_SECONDS, **kwargs):
+        """
+        Run `func(*args, **kwargs)` in a worker process and return its result.
+
+        Blocks the calling thread until a worker is free and the job is done.
+
+        Raises:
+            ExtractionError: If the job failed, crashed, timed out or hit the memory limit
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker.alive:
+                worker = _Worker(self._ctx)
+                with self._lock:
+                    self._workers.add(worker)
+
+            try:
+                return worker.run(func, args, kwargs, timeout)
+            except ExtractionError as e:
+                metrics.inc("bookgen_extraction_failures_total", reason=e.reason)
+                raise
+        finally:
+            if worker is not None and (not worker.alive or worker.should_recycle()):
+                metrics.inc("bookgen_worker_recycles_total")
+                if worker.alive:
+                    worker.stop()
+                with self._lock:
+                    self._workers.discard(worker)
+                worker = None
+            self._idle.put(worker)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            if worker.alive:
+                worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ExtractionWorkerPool:
+    """Process-wide extraction pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionWorkerPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def run_extraction(file_path: Path, output_dir: Path, profile: str = "auto") -> Dict:
+    """
+    Run `extraction.convert_file` in a memory-capped worker process.
+
+    Returns:
+        The `convert_file` result dictionary
+
+    Raises:
+        ExtractionError: On failure, with `reason` describing why
+    """
+    from app.extraction import convert_file
+
+    with metrics.span("extraction_worker"):
+        result = get_pool().run(convert_file, Path(file_path), Path(output_dir), profile)
+    # Counted here: only the worker's spans are sent back, not its counters
+    metrics.inc("bookgen_extractions_total", profile=result["profile"])
+    return result
@@ -0,0 +1,84 @@
+"""
+Workspace-scoped storage.
+Each workspace (one book) gets its own uploads, extracted documents,
+consolidated output, highlights and chat sessions. The "default" workspace
+maps onto the original top-level directories so existing data keeps working.
+"""
+
+import re
+from pathlib import Path
+from typing import List
+
+WORKSPACES_DIR = Path("workspaces")
+DEFAULT_WORKSPACE = "default"
+
+# Workspace IDs become directory names, so keep them to a safe character set
+_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+class Workspace:
+    """Paths of one workspace's data."""
+
+    def __init__(self, workspace_id: str, root: Path):
+        self.id = workspace_id
+        self.root = root
+        self.upload_dir = root / "uploaded_files"
+        self.output_dir = root / "extracted_docs"
+        self.consolidated_dir = root / "consolidated_docs"
+        self.sessions_dir = root / "chat_sessions"
+        self.jobs_dir = self.consolidated_dir / "jobs"
+        self.base_context_file = self.consolidated_dir / "base_context.md"
+        self.highlights_file = self.consolidated_dir / "highlights_metadata.json"
+        self.search_index_file = self.consolidated_dir / "search_index.sqlite3"
+        self.provenance_file = self.consolidated_dir / "provenance.json"
+        self.exports_dir = self.consolidated_dir / "exports"
+
+    def ensure(self) -> "Workspace":
+        """Create the workspace directories if needed. Returns self for chaining."""
+        for directory in (self.upload_dir, self.output_dir, self.consolidated_dir, self.sessions_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        return self
+
+    def __repr__(self) -> str:
+        return f"Workspace({self.id!r}, root={str(self.root)!r})"
+
+
+def validate_workspace_id(workspace_id: str) -> str:
+    """
+    Check that a workspace ID is safe to use as a directory name.
+
+    Raises:
+        ValueError: If the ID is empty or contains unsupported characters
+    """
+    if not workspace_id or not _ID_PATTERN.fullmatch(workspace_id):
+        raise ValueError(
+            f"Invalid workspace id '{workspace_id}'. Use 1-64 letters, digits, '-' or '_'."
+        )
+    return workspace_id
+
+
+def get_workspace(workspace_id: str = None) -> Workspace:
+    """
+    Resolve a workspace ID to its storage paths (directories are not created).
+
+    Args:
+        workspace_id: Workspace ID, or None for the default workspace
+
+    Returns:
+        Workspace instance
+    """
+    workspace_id = validate_workspace_id(workspace_id or DEFAULT_WORKSPACE)
+    if workspace_id == DEFAULT_WORKSPACE:
+        return Workspace(DEFAULT_WORKSPACE, Path("."))
+    return Workspace(workspace_id, WORKSPACES_DIR / workspace_id)
+
+
+def list_workspaces() -> List[str]:
+    """Lists all workspace IDs (the default workspace first)."""
+    workspace_ids = []
+    if WORKSPACES_DIR.exists():
+        workspace_ids = sorted(
+            p.name for p in WORKSPACES_DIR.iterdir()
+            if p.is_dir() and _ID_PATTERN.fullmatch(p.name) and p.name != DEFAULT_WORKSPACE
+        )
+    return [DEFAULT_WORKSPACE] + workspace_ids
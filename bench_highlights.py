@@ -0,0 +1,117 @@
+"""
+Benchmark of fuzzy (markdown-insensitive) highlighting on a large book.
+
+Builds a synthetic Arabic/English markdown book, or uses --file, picks
+highlights that only match across markdown formatting (so every one takes the
+fuzzy path) and times:
+
+- regex: one compiled separator pattern per highlight, searched in the shadow
+  (the approach used before the markdown-stripped shadow)
+- cold:  viewer.highlight_spans with empty caches
+- warm:  viewer.highlight_spans again on the same text (cached shadows and needles)
+
+Usage:
+    python bench_highlights.py [--file consolidated_docs/base_context.md] [--highlights 50] [--repeat 5]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from app import viewer
+from app.arabic import normalize_query, normalize_with_offsets
+
+WORDS = [
+    "التدريب", "المدرب",
+    "المعرفة", "المهارة",
+    "القناعة", "البرنامج",
+    "knowledge", "skill", "conviction", "vertical", "horizontal", "trainer", "method", "design"
+]
+
+
+def synthetic_book(chapters: int = 40, paragraphs: int = 60, seed: int = 7) -> str:
+    """Markdown with headings, bold spans and lists, ~10k characters per chapter section."""
+    rng = random.Random(seed)
+    lines = ["# Course"]
+    for chapter in range(chapters):
+        lines.append(f"\n## Chapter {chapter + 1}\n")
+        for _ in range(paragraphs):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(12, 30))]
+            for _ in range(3):
+                i = rng.randrange(len(words) - 1)
+                words[i] = f"**{words[i]}"
+                words[i + 1] = f"{words[i + 1]}**"
+            prefix = rng.choice(["", "", "- ", "> "])
+            lines.append(prefix + " ".join(words) + "\n")
+    return "\n".join(lines)
+
+
+def fuzzy_highlights(text: str, count: int, seed: int = 11) -> list:
+    """Highlights that span markdown symbols, so the phrase match misses."""
+    rng = random.Random(seed)
+    candidates = re.findall(r"(\S+ \*\*\S+ \S+)", text)
+    picked = rng.sample(candidates, min(count, len(candidates)))
+    return [{"text": re.sub(r"[*_#>`-]", "", phrase), "color": "#ffeb3b"} for phrase in picked]
+
+
+def regex_spans(text: str, highlights: list) -> int:
+    """Fuzzy matching with one compiled pattern per highlight (the previous approach)."""
+    shadow, _ = normalize_with_offsets(text)
+    found = 0
+    for highlight in highlights:
+        words = normalize_query(highlight["text"]).split()
+        pattern = re.compile(viewer.FUZZY_SEPARATOR.join(f"({re.escape(word)})" for word in words))
+        found += sum(1 for _ in pattern.finditer(shadow))
+    return found
+
+
+def clear_caches():
+    normalize_with_offsets.cache_clear()
+    viewer.markdown_shadow.cache_clear()
+    viewer._prepared.cache_clear()
+
+
+def timed(func, repeat: int, setup=None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="Markdown file to use instead of the synthetic book")
+    parser.add_argument("--highlights", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = synthetic_book()
+    highlights = fuzzy_highlights(text, args.highlights)
+
+    print(f"Book: {len(text):,} characters, {len(highlights)} fuzzy highlights, best of {args.repeat}")
+
+    # The regex path also needs the shadow; keep it warm so only matching is compared
+    normalize_with_offsets(text)
+    regex_ms = timed(lambda: regex_spans(text, highlights), args.repeat)
+    cold_ms = timed(lambda: viewer.highlight_spans(text, highlights), args.repeat, setup=clear_caches)
+    viewer.highlight_spans(text, highlights)
+    warm_ms = timed(lambda: viewer.highlight_spans(text, highlights), args.repeat)
+    spans = len(viewer.highlight_spans(text, highlights))
+
+    print(f"regex per highlight (matching only): {regex_ms:8.1f} ms")
+    print(f"highlight_spans, cold caches:       {cold_ms:8.1f} ms")
+    print(f"highlight_spans, warm caches:       {warm_ms:8.1f} ms")
+    print(f"{spans:,} word spans marked")
+
+
+if __name__ == "__main__":
+    main()
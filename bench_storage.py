@@ -0,0 +1,109 @@
+"""
+Benchmark of compressed artifact storage.
+
+Writes a synthetic extracted document (Arabic/English markdown, or --file) and
+a long chat session with each codec of app/storage.py and reports, per
+artifact:
+
+- size:   bytes on disk and the ratio to the plain file. Plain sessions are
+          pretty-printed and compressed ones compact, so the session also gets a
+          "compact" row (plain, no indentation) to separate whitespace from compression
+- write:  storage.write_text / write_json (atomic, fsynced)
+- read:   storage.read_text / read_json of the whole file
+- stream: storage.open_text, reading the first 500 characters (job previews)
+
+zstd is skipped when the optional `zstandard` package is not installed.
+
+Usage:
+    python bench_storage.py [--file extracted_docs/book.md] [--messages 400] [--repeat 5]
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app import storage
+from bench_highlights import WORDS, synthetic_book
+
+
+def synthetic_session(messages: int, seed: int = 3) -> dict:
+    """A chat session shaped like app/history.py writes it, with citations on answers."""
+    rng = random.Random(seed)
+    session = {"id": "bench", "created_at": datetime.now().isoformat(), "messages": []}
+    for i in range(messages):
+        message = {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 200))),
+            "timestamp": datetime.now().isoformat()
+        }
+        if i % 2:
+            message["citations"] = [
+                {"source": f"source_{rng.randint(1, 9)}.md", "section": rng.choice(WORDS), "page": rng.randint(1, 300)}
+                for _ in range(3)
+            ]
+        session["messages"].append(message)
+    return session
+
+
+def timed(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def preview(path: Path) -> str:
+    with storage.open_text(path) as f:
+        return f.read(500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="Markdown file to use instead of the synthetic book")
+    parser.add_argument("--messages", type=int, default=400, help="Messages in the synthetic chat session")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.file:
+        text = storage.read_text(Path(args.file))
+    else:
+        text = synthetic_book()
+    session = synthetic_session(args.messages)
+
+    codecs = [c for c in storage.CODECS if c != "zstd" or storage._zstandard() is not None]
+    if "zstd" not in codecs:
+        print("zstd: skipped ('zstandard' is not installed)")
+    print(f"Markdown: {len(text):,} characters; session: {args.messages} messages; best of {args.repeat}\n")
+    print(f"{'artifact':<10}{'codec':<9}{'bytes':>12}{'ratio':>8}{'write ms':>10}{'read ms':>9}{'stream ms':>11}")
+
+    compact = json.dumps(session, ensure_ascii=False, separators=(",", ":"))
+    markdown_rows = [(kind, lambda path, kind=kind: storage.write_text(path, text, kind)) for kind in codecs]
+    session_rows = [(kind, lambda path, kind=kind: storage.write_json(path, session, kind)) for kind in codecs]
+    session_rows.insert(1, ("compact", lambda path: storage.write_text(path, compact, "none")))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        artifacts = [
+            ("markdown", "book.md", markdown_rows, storage.read_text),
+            ("session", "session.json", session_rows, storage.read_json),
+        ]
+        for name, file_name, rows, read in artifacts:
+            plain_size = None
+            for label, write in rows:
+                path = Path(tmp) / label / file_name
+                write_ms = timed(lambda: write(path), args.repeat)
+                size = path.stat().st_size
+                plain_size = plain_size or size
+                read_ms = timed(lambda: read(path), args.repeat)
+                stream_ms = timed(lambda: preview(path), args.repeat)
+                print(f"{name:<10}{label:<9}{size:>12,}{size / plain_size:>8.2f}{write_ms:>10.1f}{read_ms:>9.1f}{stream_ms:>11.2f}")
+    print("\nRatios are relative to the first row; compressed sessions are written compact.")
+
+
+if __name__ == "__main__":
+    main()
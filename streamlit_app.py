@@ -1,16 +1,31 @@
 import streamlit as st
 import os
+import json
 import shutil
 from pathlib import Path
-from docling.document_converter import DocumentConverter
 import pypdf
 from markdown_it import MarkdownIt
 
 import app.history as history
 from app.chat import chat_with_data
-from app.consolidator import generate_summary
+from app import jobs
+from app import budget
+from app import sections
+from app import dedup
+from app import document_store
+from app import cache
+from app import search
+from app import provenance
+from app import exporter
+from app import uploads
+from app import storage
+from app.consolidator import read_sources
 import app.viewer as viewer
 from app.word_like_editor import word_like_editor
+from app.extraction import PROFILES, AUTO_PROFILE
+from app.workers import ExtractionError, run_extraction
+from app.profiler import RerunProfiler, PROFILE_BY_DEFAULT, new_history
+from app.workspace import DEFAULT_WORKSPACE, get_workspace, list_workspaces
 
 # ... (Configuration setup remains the same) ...
 st.set_page_config(page_title="Book Gen Pipeline", layout="wide")
@@ -19,14 +34,60 @@ st.set_page_config(page_title="Book Gen Pipeline", layout="wide")
 if not os.getenv("GEMINI_API_KEY"):
     st.error("⚠️ GENAI_API_KEY is missing! Please set it in your .env file or Streamlit secrets.")
 
-# Setup Directories
-UPLOAD_DIR = Path("uploaded_files")
-OUTPUT_DIR = Path("extracted_docs")
-CONSOLIDATED_DIR = Path("consolidated_docs")
+# --- Workspace Selection ---
+if "workspace_id" not in st.session_state:
+    st.session_state.workspace_id = DEFAULT_WORKSPACE
 
-UPLOAD_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
-CONSOLIDATED_DIR.mkdir(exist_ok=True)
+def reset_workspace_state():
+    """Drops per-workspace state so the next rerun loads the selected workspace."""
+    for key in ("md_content", "highlights_data", "current_session_id", "messages",
+                "consolidation_job_id", "consolidation_notice", "session_page", "chat_window", "export_result"):
+        st.session_state.pop(key, None)
+    st.session_state.editor_key_version = st.session_state.get("editor_key_version", 0) + 1
+
+def open_session(session_id):
+    """Switches the chat to a session, showing its latest messages."""
+    st.session_state["current_session_id"] = session_id
+    st.session_state.pop("chat_window", None)
+
+def store_highlights(result):
+    """Keeps the outcome of a highlight batch as the current highlights (no reload from disk)."""
+    st.session_state.highlights_data = {"highlights": result["highlights"], "last_updated": result["last_updated"]}
+
+def create_workspace():
+    """Callback for the Create Workspace button."""
+    new_id = st.session_state.new_workspace_id.strip()
+    try:
+        get_workspace(new_id).ensure()
+    except ValueError as e:
+        st.session_state.workspace_error = str(e)
+        return
+    st.session_state.workspace_error = None
+    st.session_state.workspace_id = new_id
+    st.session_state.new_workspace_id = ""
+    reset_workspace_state()
+
+with st.sidebar:
+    st.header("Workspace")
+    st.selectbox("Active workspace", list_workspaces(), key="workspace_id", on_change=reset_workspace_state)
+    st.text_input("New workspace", key="new_workspace_id", placeholder="e.g. tot-course")
+    st.button("Create Workspace", on_click=create_workspace)
+    if st.session_state.get("workspace_error"):
+        st.error(st.session_state.workspace_error)
+    st.divider()
+
+# Setup Directories (scoped to the active workspace)
+workspace = get_workspace(st.session_state.workspace_id).ensure()
+UPLOAD_DIR = workspace.upload_dir
+OUTPUT_DIR = workspace.output_dir
+CONSOLIDATED_DIR = workspace.consolidated_dir
+
+# Opt-in developer profiler (toggled from the sidebar)
+if "profile_reruns" not in st.session_state:
+    st.session_state.profile_reruns = PROFILE_BY_DEFAULT
+if "profiler_history" not in st.session_state:
+    st.session_state.profiler_history = new_history()
+profiler = RerunProfiler(enabled=st.session_state.profile_reruns)
 
 st.title("📚 Book Generation Pipeline")
 st.markdown("Upload content, consolidate it into a Knowledge Base, and chat with your data.")
@@ -38,18 +99,58 @@ if "viewer_collapsed" not in st.session_state:
 if "md_content" not in st.session_state:
     context_file = CONSOLIDATED_DIR / "base_context.md"
     if context_file.exists():
-        with open(context_file, "r", encoding="utf-8") as f:
-            st.session_state.md_content = f.read()
+        st.session_state.md_content = cache.read_text(context_file)
     else:
         st.session_state.md_content = "# No Base Context\n\nPlease generate the base context first."
 
 
 if "highlights_data" not in st.session_state:
-    st.session_state.highlights_data = viewer.load_highlights()
+    st.session_state.highlights_data = viewer.load_highlights(workspace.id)
 
 if "editor_key_version" not in st.session_state:
     st.session_state.editor_key_version = 0
 
+
+# Characters of streamed output shown in the live preview
+PREVIEW_TAIL_CHARS = 4000
+
+# Sessions per page of the sidebar picker; chat messages rendered per "Load earlier" step
+SESSIONS_PER_PAGE = 10
+CHAT_WINDOW = 20
+
+@st.fragment(run_every=2)
+def consolidation_status():
+    """Polls the background consolidation job without rerunning the whole app."""
+    job = jobs.get_job(st.session_state.consolidation_job_id, workspace.id)
+    if not job:
+        st.session_state.consolidation_job_id = None
+        return
+
+    if job["status"] in jobs.ACTIVE_STATUSES:
+        last_event = job["events"][-1]["message"] if job["events"] else "Waiting for a worker..."
+        st.progress(job["progress"], text=last_event)
+        if st.button("Cancel consolidation"):
+            jobs.cancel_job(job["id"], workspace.id)
+        partial_md = jobs.read_output(job).decode("utf-8", errors="ignore")
+        if partial_md:
+            with st.expander(f"Live preview ({len(partial_md):,} characters so far)", expanded=True):
+                with st.container(height=300):
+                    # Only the tail: re-rendering the whole book every poll is slow
+                    st.markdown(partial_md[-PREVIEW_TAIL_CHARS:])
+        return
+
+    # Finished: report the outcome and rerun the whole app to show the new content
+    st.session_state.consolidation_job_id = None
+    if job["status"] == "succeeded":
+        st.session_state.consolidation_notice = ("success", "✅ Consolidation Complete!")
+        st.session_state.md_content = cache.read_text(Path(job["output_file"]))
+        st.session_state.editor_key_version += 1 # Force editor reload
+    elif job["status"] == "cancelled":
+        st.session_state.consolidation_notice = ("warning", "Consolidation cancelled. The previous base context was kept.")
+    else:
+        st.session_state.consolidation_notice = ("error", f"❌ Error during consolidation: {job['error']}")
+    st.rerun()
+
 # --- Sidebar: Upload & Consolidation ---
 with st.sidebar:
     st.header("1. Upload Files")
@@ -59,6 +160,12 @@ with st.sidebar:
         type=["pdf", "docx", "txt", "md"]
     )
     
+    extraction_profile = st.selectbox(
+        "Extraction profile",
+        [AUTO_PROFILE] + list(PROFILES),
+        help="auto: pre-scan each PDF and skip OCR/table models when the file has a text layer"
+    )
+    
     if uploaded_files:
         if st.button("Process Uploaded Files"):
             progress_bar = st.progress(0)
@@ -68,21 +175,30 @@ with st.sidebar:
                 status_text = st.empty()
                 status_text.write(f"Processing: *{uploaded_file.name}*...")
                 
-                # Save uploaded file to disk
-                file_path = UPLOAD_DIR / uploaded_file.name
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                # Stream the uploaded file to disk (no extra in-memory copy)
+                file_path = UPLOAD_DIR / uploads.safe_filename(uploaded_file.name)
+                uploaded_file.seek(0)
+                uploads.save_stream(uploaded_file, file_path)
                 
+                fallback_error = None
                 try:
-                    # Try advanced extraction first
-                    converter = DocumentConverter()
-                    result = converter.convert(file_path)
-                    md_content = result.document.export_to_markdown()
-                    st.success(f"✅ Extracted (Advanced): {uploaded_file.name}")
+                    # Try advanced extraction first, in a memory-capped worker process
+                    extraction = run_extraction(file_path, OUTPUT_DIR, extraction_profile)
+                    search.index_source(OUTPUT_DIR / f"{file_path.stem}.md", workspace.id)
+                    st.success(f"✅ Extracted (Advanced, {extraction['profile']}): {uploaded_file.name}")
                     
+                except ExtractionError as e:
+                    if e.reason in ("memory_limit", "timeout"):
+                        # Too big for a worker; a pypdf pass in this process would not be safer
+                        st.error(f"❌ {uploaded_file.name}: {e} Try the 'fast' profile or split the file.")
+                    else:
+                        fallback_error = e
                 except Exception as e:
+                    fallback_error = e
+                
+                if fallback_error is not None:
                     # Fallback to standard pypdf extraction
-                    print(f"Docling failed: {e}. Falling back to pypdf.")
+                    print(f"Docling failed: {fallback_error}. Falling back to pypdf.")
                     try:
                         reader = pypdf.PdfReader(file_path)
                         text_content = ""
@@ -90,19 +206,19 @@ with st.sidebar:
                             text_content += page.extract_text() + "\n\n"
                         
                         md_content = f"# {uploaded_file.name}\n\n{text_content}"
-                        st.warning(f"⚠️ Used standard extraction for {uploaded_file.name} (Advanced method failed).")
+                        st.warning(f"⚠️ Used standard extraction for {uploaded_file.name} (Advanced method failed: {fallback_error}).")
+                        
+                        # Save fallback markdown
+                        output_filename = f"{file_path.stem}.md"
+                        output_path = OUTPUT_DIR / output_filename
+                        
+                        storage.write_text(output_path, md_content)
+                        # A docling document from an earlier conversion would describe other text
+                        document_store.remove_document(OUTPUT_DIR, file_path.stem)
+                        search.index_source(output_path, workspace.id)
                         
                     except Exception as fallback_e:
                         st.error(f"❌ Failed to extract {uploaded_file.name}: {str(fallback_e)}")
-                        md_content = None # Skip saving if both fail
-
-                # Save markdown if content was extracted
-                if md_content:
-                    output_filename = f"{file_path.stem}.md"
-                    output_path = OUTPUT_DIR / output_filename
-                    
-                    with open(output_path, "w", encoding="utf-8") as f:
-                        f.write(md_content)
                 
                 progress_bar.progress((index + 1) / total_files)
                 status_text.empty()
@@ -112,39 +228,102 @@ with st.sidebar:
     st.header("2. Consolidate Context")
     st.info("Merge all extracted files into a single Base Context.")
     
+    consolidation_mode = st.radio(
+        "Mode",
+        jobs.MODES,
+        format_func=lambda m: {"single": "Single pass", "chapters": "Per chapter (parallel)"}[m],
+        horizontal=True,
+        help="Per chapter: a quick outline pass, then every chapter is written concurrently"
+    )
+    
     if st.button("Generate Base Context"):
-        with st.spinner("Consolidating with Gemini... This may take a minute."):
+        st.session_state.consolidation_notice = None
+        try:
+            job = jobs.submit_consolidation(workspace.id, consolidation_mode)
+            st.session_state.consolidation_job_id = job["id"]
+            if job["deduplicated"]:
+                st.info("An identical consolidation is already running; following it.")
+        except FileNotFoundError:
+            st.warning("No extracted documents found to consolidate.")
+        except Exception as e:
+            st.error(f"❌ Error during consolidation: {e}")
+
+    if st.button("Estimate Tokens & Cost"):
+        md_files = sorted(OUTPUT_DIR.glob("*.md"))
+        if md_files:
+            sources, dedup_report = dedup.prepare_sources(read_sources(md_files))
+            plan = budget.plan_consolidation(budget.combine_sources(sources))
+            if dedup_report:
+                st.caption(dedup.summarize_report(dedup_report))
+            st.caption(budget.summarize_plan(plan))
+            st.dataframe(
+                [{"file": f["name"], "tokens": f["tokens"], "status": f["status"]} for f in plan["files"]],
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.warning("No extracted documents found to consolidate.")
+
+    if st.session_state.get("consolidation_job_id"):
+        consolidation_status()
+    elif st.session_state.get("consolidation_notice"):
+        level, message = st.session_state.consolidation_notice
+        getattr(st, level)(message)
+    
+    with st.expander("Regenerate a Section"):
+        book_sections = sections.parse_sections(st.session_state.md_content)
+        if book_sections:
+            section = st.selectbox(
+                "Section",
+                book_sections,
+                format_func=lambda s: " › ".join(s["path"][1:] + [s["title"]]) if s["path"] else s["title"]
+            )
+            section_instructions = st.text_area("Instructions (optional)", placeholder="e.g. Add the missing Skill dimension")
+            if st.button("Regenerate Section"):
+                try:
+                    with st.spinner(f"Regenerating '{section['title']}'..."):
+                        result = sections.regenerate_section(section["id"], section_instructions or None, workspace.id)
+                    st.session_state.md_content = cache.read_text(CONSOLIDATED_DIR / "base_context.md")
+                    st.session_state.editor_key_version += 1
+                    st.success(f"✅ Regenerated '{result['title']}' from {len(result['source_files'])} source file(s).")
+                    if result["orphaned_highlights"]:
+                        st.warning(f"{len(result['orphaned_highlights'])} highlight(s) in this section no longer match the text.")
+                except sections.SectionConflict as e:
+                    st.warning(str(e))
+                except Exception as e:
+                    st.error(f"❌ Could not regenerate section: {e}")
+        else:
+            st.caption("The base context has no H2/H3 sections yet.")
+    
+    with st.expander("Export Book"):
+        export_format = st.selectbox(
+            "Format",
+            exporter.available_formats(),
+            format_func=str.upper,
+            help="PDF export needs the optional weasyprint package"
+        )
+        export_highlights = st.checkbox("Include highlights", value=True)
+        if st.button("Export"):
             try:
-                # 1. Read all markdown files from extracted_docs
-                md_files = list(OUTPUT_DIR.glob("*.md"))
-                if not md_files:
-                    st.warning("No extracted documents found to consolidate.")
-                else:
-                    combined_text = ""
-                    for md_file in md_files:
-                        with open(md_file, "r", encoding="utf-8") as f:
-                            content = f.read()
-                            combined_text += f"\n\n--- START OF FILE: {md_file.name} ---\n\n"
-                            combined_text += content
-                            combined_text += f"\n\n--- END OF FILE: {md_file.name} ---\n\n"
-                    
-                    # 2. Call Gemini Consolidator
-                    summary_md = generate_summary(combined_text)
-                    
-                    # 3. Save to consolidated_docs
-                    output_file = CONSOLIDATED_DIR / "base_context.md"
-                    with open(output_file, "w", encoding="utf-8") as f:
-                        f.write(summary_md)
-                        
-                    st.success("✅ Consolidation Complete!")
-                    st.markdown(f"**Output saved to:** `{output_file}`")
-                    
-                    # Update session state and force rerun to show content immediately
-                    st.session_state.md_content = summary_md
-                    st.session_state.editor_key_version += 1 # Force editor reload
-                    st.rerun()
+                with st.spinner(f"Exporting {export_format.upper()}..."):
+                    st.session_state.export_result = exporter.export_book(export_format, workspace.id, export_highlights)
+            except FileNotFoundError:
+                st.warning("Generate the base context first.")
             except Exception as e:
-                st.error(f"❌ Error during consolidation: {e}")
+                st.error(f"❌ Export failed: {e}")
+        export_result = st.session_state.get("export_result")
+        if export_result and Path(export_result["path"]).exists():
+            st.caption(
+                f"{export_result['fragments']} chapters: {export_result['rendered']} rendered, "
+                f"{export_result['reused']} reused ({export_result['took_ms']:.0f} ms)"
+            )
+            with open(export_result["path"], "rb") as f:
+                st.download_button(
+                    f"Download {export_result['format'].upper()}",
+                    f.read(),
+                    file_name=export_result["filename"],
+                    mime=export_result["media_type"]
+                )
     
     st.divider()
     st.header("Chat Settings")
@@ -154,22 +333,88 @@ with st.sidebar:
     st.header("Chat Sessions")
     
     if st.button("➕ New Chat"):
-        new_id = history.create_session()
-        st.session_state["current_session_id"] = new_id
+        new_id = history.create_session(workspace.id)
+        open_session(new_id)
         st.session_state.messages = [] # Clear local view
         st.rerun()
 
-    # List recent sessions
+    # List recent sessions, one page at a time
     try:
-        sessions = history.list_sessions()
-        for sess in sessions:
-            label = f"Session {sess['id'][:8]}... ({sess['message_count']} msgs)"
-            if st.button(label, key=sess["id"]):
-                st.session_state["current_session_id"] = sess["id"]
-                st.rerun()
+        with profiler.section("session_list"):
+            session_filter = st.text_input(
+                "Filter sessions", placeholder="First prompt or session ID",
+                on_change=lambda: st.session_state.update(session_page=0)
+            )
+            page = st.session_state.get("session_page", 0)
+            sessions, total = history.page_sessions(
+                workspace.id, page * SESSIONS_PER_PAGE, SESSIONS_PER_PAGE, session_filter
+            )
+            for sess in sessions:
+                title = sess["title"] or f"Session {sess['id'][:8]}..."
+                label = f"{title[:40]} ({sess['message_count']} msgs)"
+                if st.button(label, key=sess["id"], help=sess["title"] or None):
+                    open_session(sess["id"])
+                    st.rerun()
+
+            page_count = max(1, -(-total // SESSIONS_PER_PAGE))
+            if page_count > 1:
+                prev_col, page_col, next_col = st.columns([1, 2, 1])
+                if prev_col.button("◀", disabled=page == 0, key="session_page_prev"):
+                    st.session_state.session_page = page - 1
+                    st.rerun()
+                page_col.caption(f"Page {page + 1} of {page_count} ({total} sessions)")
+                if next_col.button("▶", disabled=page >= page_count - 1, key="session_page_next"):
+                    st.session_state.session_page = page + 1
+                    st.rerun()
     except Exception:
         st.warning("Could not fetch sessions.")
 
+    st.divider()
+    st.header("Search")
+    search_query = st.text_input("Search", placeholder="Base context, sources and chats",
+                                 label_visibility="collapsed")
+    search_kinds = st.multiselect(
+        "In",
+        search.KINDS,
+        default=list(search.KINDS),
+        format_func=lambda k: {"context": "Base context", "source": "Sources", "message": "Chats"}[k]
+    )
+    if search_query.strip():
+        try:
+            with profiler.section("search"):
+                found = search.search(search_query, search_kinds, 10, workspace.id)
+            st.caption(f"{len(found['results'])} result(s) in {found['took_ms']} ms")
+            for i, result in enumerate(found["results"]):
+                if result["kind"] == "message":
+                    label = f"💬 {result['title']} · session {result['ref'][:8]}"
+                elif result["kind"] == "source":
+                    label = f"📄 {result['ref']} · {result['title']}"
+                else:
+                    label = f"📘 {result['title'] or 'Base context'}"
+                st.markdown(f"**{label}**  \n{result['snippet']}")
+                if result["kind"] == "message" and st.button("Open chat", key=f"search_open_{i}"):
+                    open_session(result["ref"])
+                    st.rerun()
+        except Exception as e:
+            st.warning(f"Search failed: {e}")
+
+    st.divider()
+    st.toggle("Developer: profile reruns", key="profile_reruns",
+              help="Time each section of the script on every rerun.")
+
+def show_citations(citations):
+    """Numbered source citations under a chat answer."""
+    if not citations:
+        return
+    with st.expander(f"Sources ({len(citations)})"):
+        for citation in citations:
+            files = ", ".join(
+                f"{s['file']} p.{s['page']}" if s["page"] else s["file"] for s in citation["sources"]
+            ) or "no matching source"
+            st.markdown(f"**[{citation['number']}] {citation['title']}** — {files}")
+            for source in citation["sources"]:
+                st.caption(f"{source['file']}: {source['excerpt']}…")
+
 # --- Main Area: Chat with Right Panel Viewer ---
 st.divider()
 st.header("3. Chat with Data")
@@ -187,7 +432,7 @@ with chat_col:
     # Initialize or Load Session
     if "current_session_id" not in st.session_state:
         # Try to create one if none exists
-        new_id = history.create_session()
+        new_id = history.create_session(workspace.id)
         st.session_state["current_session_id"] = new_id
 
     current_id = st.session_state.get("current_session_id")
@@ -196,18 +441,26 @@ with chat_col:
         st.subheader(f"Current Session: `{current_id}`")
         
         # Load history
-        session_data = history.get_session(current_id)
+        with profiler.section("chat_history_load"):
+            session_data = history.get_session(current_id, workspace.id)
         if session_data:
             st.session_state.messages = session_data.get("messages", [])
         else:
             st.warning("Session file not found, starting fresh.")
             st.session_state.messages = []
 
-        # Display chat messages
-        for message in st.session_state.messages:
-            role = message["role"]
-            with st.chat_message(role):
-                st.markdown(message["content"])
+        # Display the latest chat messages; earlier ones are rendered on demand
+        window = st.session_state.get("chat_window", CHAT_WINDOW)
+        hidden = max(0, len(st.session_state.messages) - window)
+        if hidden and st.button(f"⬆ Load earlier messages ({hidden} more)"):
+            st.session_state.chat_window = window + CHAT_WINDOW
+            st.rerun()
+        with profiler.section("chat_render"):
+            for message in st.session_state.messages[hidden:]:
+                role = message["role"]
+                with st.chat_message(role):
+                    st.markdown(message["content"])
+                    show_citations(message.get("citations"))
 
         # React to user input
         if prompt := st.chat_input("Ask a question about your uploaded documents..."):
@@ -226,8 +479,7 @@ with chat_col:
                             st.error("Base context not found. Please run 'Generate Base Context' first.")
                             answer = "Context missing."
                         else:
-                            with open(context_file, "r", encoding="utf-8") as f:
-                                context_content = f.read()
+                            context_content = cache.read_text(context_file)
                             
                             # 2. Chat Logic
                             response_text = chat_with_data(
@@ -237,14 +489,15 @@ with chat_col:
                                 temperature=temperature
                             )
                             
-                            answer = response_text
+                            answer, citations = provenance.resolve_citations(response_text, workspace.id)
                             
                             # 3. Save interaction
-                            history.save_message(current_id, "user", prompt)
-                            history.save_message(current_id, "assistant", answer)
+                            history.save_message(current_id, "user", prompt, workspace.id)
+                            history.save_message(current_id, "assistant", answer, workspace.id, citations)
                             
                             st.markdown(answer)
-                            st.session_state.messages.append({"role": "assistant", "content": answer})
+                            show_citations(citations)
+                            st.session_state.messages.append({"role": "assistant", "content": answer, "citations": citations})
                     
                     except Exception as e:
                         st.error(f"Error: {e}")
@@ -276,20 +529,22 @@ with viewer_col:
         with view_tab:
             # Apply highlights to markdown
             highlights = st.session_state.highlights_data.get("highlights", [])
-            highlighted_content = viewer.apply_highlights(st.session_state.md_content, highlights)
+            with profiler.section("highlight_apply"):
+                highlighted_content = viewer.apply_highlights(st.session_state.md_content, highlights)
             
             # Custom CSS is no longer needed regarding container overrides, 
             # we will use native container + parsed HTML.
             
             # Render markdown with highlights inside a styled container with Scrolling
             # Using st.container(height=...) for scrolling block
-            with st.container(height=600):
+            with st.container(height=600), profiler.section("markdown_render"):
                  # Manually parse Markdown to HTML to avoid Streamlit's div-wrapping limitation
                  md_processor = MarkdownIt()
                  # Ensure we have a string
                  safe_content = str(highlighted_content) if highlighted_content else ""
                  # Render HTML
                  html_content = md_processor.render(safe_content)
+                 profiler.record_size("viewer_payload", html_content)
                  
                  # Wrap in RTL/Auto div
                  # We use 'dir="auto"' to let browser decide per block, or "rtl" for base.
@@ -334,9 +589,9 @@ with viewer_col:
                 st.write("")  # Spacing
                 if st.button("Add Highlight", type="primary", use_container_width=True):
                     if text_to_highlight.strip():
-                        highlights = st.session_state.highlights_data.get("highlights", [])
-                        viewer.add_highlight(text_to_highlight, selected_color, highlights)
-                        st.session_state.highlights_data = viewer.load_highlights()
+                        store_highlights(viewer.add_highlights(
+                            [{"text": text_to_highlight, "color": selected_color}], workspace.id
+                        ))
                         st.success("Highlight added!")
                         st.rerun()
                     else:
@@ -353,28 +608,79 @@ with viewer_col:
                         st.markdown(f"<mark style='background-color: {hl['color']}'>{hl['text']}</mark>", unsafe_allow_html=True)
                     with col2:
                         if st.button("Remove", key=f"del_{hl['id']}"):
-                            viewer.remove_highlight(hl['id'], highlights)
-                            st.session_state.highlights_data = viewer.load_highlights()
+                            store_highlights(viewer.remove_highlights([hl['id']], workspace.id))
                             st.rerun()
                 
                 if st.button("Clear All", type="secondary", use_container_width=True):
-                    viewer.save_highlights([])
-                    st.session_state.highlights_data = viewer.load_highlights()
+                    store_highlights(viewer.remove_highlights([h["id"] for h in highlights], workspace.id))
                     st.success("All highlights cleared!")
                     st.rerun()
             else:
                 st.info("No highlights yet. Add one above!")
+            
+            # Batch operations: every change below is saved with a single write
+            with st.expander("Bulk Highlights & Import/Export"):
+                bulk_text = st.text_area("Phrases to highlight (one per line)", key="bulk_highlight_input")
+                bulk_color = st.selectbox("Color for new highlights", list(colors.keys()), key="bulk_add_color")
+                if st.button("Add All", key="bulk_add"):
+                    phrases = [line.strip() for line in bulk_text.splitlines() if line.strip()]
+                    if phrases:
+                        result = viewer.add_highlights(
+                            [{"text": phrase, "color": colors[bulk_color]} for phrase in phrases], workspace.id
+                        )
+                        store_highlights(result)
+                        st.success(f"Added {len(result['added'])} highlight(s), skipped {result['duplicates']} duplicate(s).")
+                        st.rerun()
+                
+                if highlights:
+                    selected_ids = st.multiselect(
+                        "Select highlights",
+                        [h["id"] for h in highlights],
+                        format_func=lambda i: next(h["text"][:40] for h in highlights if h["id"] == i),
+                        key="bulk_selection"
+                    )
+                    recolor_col, remove_col = st.columns(2)
+                    with recolor_col:
+                        recolor_name = st.selectbox("New color", list(colors.keys()), key="bulk_recolor_color")
+                        if st.button("Recolor Selected", disabled=not selected_ids, use_container_width=True):
+                            store_highlights(viewer.recolor_highlights(selected_ids, colors[recolor_name], workspace.id))
+                            st.rerun()
+                    with remove_col:
+                        st.write("")  # Spacing
+                        st.write("")  # Spacing
+                        if st.button("Remove Selected", disabled=not selected_ids, use_container_width=True):
+                            store_highlights(viewer.remove_highlights(selected_ids, workspace.id))
+                            st.rerun()
+                
+                st.download_button(
+                    "Export Highlights",
+                    json.dumps(viewer.export_highlights(workspace.id), indent=2, ensure_ascii=False),
+                    file_name=f"highlights-{workspace.id}.json",
+                    mime="application/json"
+                )
+                highlight_file = st.file_uploader("Import highlight set", type=["json"], key="highlight_import")
+                replace_highlights = st.checkbox("Replace current highlights", key="highlight_import_replace")
+                if highlight_file is not None and st.button("Import", key="highlight_import_button"):
+                    try:
+                        result = viewer.import_highlights(json.load(highlight_file), replace_highlights, workspace.id)
+                        store_highlights(result)
+                        st.success(f"Imported {len(result['added'])} highlight(s).")
+                        st.rerun()
+                    except (ValueError, AttributeError) as e:
+                        st.error(f"Could not import highlights: {e}")
         
         # --- EDIT MODE TAB ---
         with edit_tab:
             
             # Display Word-like editor (Bidirectional)
             # The component now returns the edited content!
-            new_content = word_like_editor(
-                content=st.session_state.md_content,
-                height=600,
-                key=f"editor_component_{st.session_state.editor_key_version}"
-            )
+            profiler.record_size("editor_payload", st.session_state.md_content)
+            with profiler.section("editor_component"):
+                new_content = word_like_editor(
+                    content=st.session_state.md_content,
+                    height=600,
+                    key=f"editor_component_{st.session_state.editor_key_version}"
+                )
             
             st.markdown("---")
             
@@ -387,8 +693,8 @@ with viewer_col:
                         
                         # Save to file
                         context_file = CONSOLIDATED_DIR / "base_context.md"
-                        with open(context_file, "w", encoding="utf-8") as f:
-                            f.write(new_content)
+                        storage.write_atomic(context_file, new_content, compress=True)
+                        search.index_base_context(workspace.id)
                             
                         st.success("✅ Changes saved successfully!")
                         st.balloons()
@@ -405,3 +711,18 @@ with viewer_col:
             st.session_state.viewer_collapsed = False
             st.rerun()
 
+# --- Developer: Rerun Profiler Panel ---
+if profiler.enabled:
+    summary = profiler.finish(st.session_state.profiler_history)
+    with st.sidebar.expander("⏱️ Rerun Profiler", expanded=True):
+        st.metric("This rerun", f"{summary['total_ms']} ms")
+        st.dataframe(
+            [{"section": k, "value": v} for k, v in summary.items() if k != "timestamp"],
+            hide_index=True,
+            use_container_width=True
+        )
+        st.caption(f"Last {len(st.session_state.profiler_history)} reruns (newest last)")
+        st.dataframe(list(st.session_state.profiler_history), hide_index=True, use_container_width=True)
+        st.line_chart([run["total_ms"] for run in st.session_state.profiler_history])
+        if st.button("Clear profiler history"):
+            st.session_state.profiler_history.clear()
@@ -1,19 +1,32 @@
 import requests
-import os
+import time
 
 url = "http://localhost:8000/consolidate/"
 
 print("Requesting consolidation...")
 try:
-    response = requests.post(url, timeout=300) # Long timeout for GenAI
+    response = requests.post(url)
     
-    if response.status_code == 200:
-        print("Success!")
-        data = response.json()
-        print(f"Message: {data.get('message')}")
-        print(f"File saved at: {data.get('file')}")
-        print("Preview:")
-        print(data.get('content_preview'))
+    if response.status_code == 202:
+        job_id = response.json()["job_id"]
+        print(f"Queued job {job_id}")
+        
+        # Poll the background job until it finishes
+        while True:
+            job = requests.get(f"{url}jobs/{job_id}").json()
+            if job["events"]:
+                print(f"[{job['progress']:.0%}] {job['events'][-1]['message']}")
+            if job["status"] not in ("queued", "running"):
+                break
+            time.sleep(5)
+        
+        if job["status"] == "succeeded":
+            print("Success!")
+            print(f"File saved at: {job.get('output_file')}")
+            print("Preview:")
+            print(job.get('content_preview'))
+        else:
+            print(f"Job {job['status']}: {job.get('error')}")
     else:
         print(f"Failed with status {response.status_code}")
         print(response.text)
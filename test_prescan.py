@@ -0,0 +1,56 @@
+import tempfile
+import time
+from pathlib import Path
+
+from app.extraction import prescan
+
+
+def make_pdf(path: Path, lines: list) -> Path:
+    """Write a one-page PDF whose text layer is `lines`."""
+    escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+    content = "BT /F1 10 Tf 20 800 Td 12 TL " + " ".join(f"({line}) '" for line in escaped) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        "/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+    ]
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(data)
+    return path
+
+
+def test_table_lines():
+    with tempfile.TemporaryDirectory() as tmp:
+        table = ["a  b  c", "a\tb\tc", "a | b | c", "| a | b | c |", "|---|---|---|"]
+        prose = ["a b c", "a  b", "hello world", "| a | | b |", "plain text line"]
+        result = prescan(make_pdf(Path(tmp) / "mixed.pdf", table + prose))
+        assert result["table_line_ratio"] == len(table) / (len(table) + len(prose)), result
+
+
+def test_long_pipe_line():
+    # A malformed pipe row used to make the table-line check backtrack exponentially
+    lines = ["a|" * 5000 + "a x", "a | " * 5000 + "a x", "|" * 5000 + " x"]
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = make_pdf(Path(tmp) / "pipes.pdf", lines)
+        started = time.perf_counter()
+        result = prescan(pdf)
+        elapsed = time.perf_counter() - started
+    assert result["table_line_ratio"] == 0.0, result
+    assert elapsed < 2, f"prescan took {elapsed:.2f}s"
+
+
+if __name__ == "__main__":
+    test_table_lines()
+    test_long_pipe_line()
+    print("Prescan table-line checks passed.")